@@ -0,0 +1,27 @@
+import hmac
+import ipaddress
+
+
+def parse_networks(networks):
+    """ip_network objects for a list of addresses or CIDRs, skipping blanks."""
+    return [ipaddress.ip_network(network.strip()) for network in networks if network.strip()]
+
+
+def refusal(req, token, networks):
+    """
+    Why `req` may not use an endpoint meant for machines rather than logged in
+    users, as (message, status code), or None if it may. With `token` set a
+    request has to send it as "Authorization: Bearer <token>"; otherwise it
+    has to come from an address in `networks`.
+    """
+    if token:
+        if not hmac.compare_digest(req.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            return 'A valid bearer token is required', 401
+        return None
+    try:
+        address = ipaddress.ip_address(req.remote_addr)
+    except ValueError:
+        return 'Forbidden', 403
+    if not any(address in network for network in networks):
+        return 'Forbidden', 403
+    return None
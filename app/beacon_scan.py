@@ -0,0 +1,226 @@
+import asyncio
+import threading
+import time
+import uuid
+from app import app
+from app.ibeacon_scanner import scan_for_ibeacons
+from pi.ble_daemon import is_listening, request as daemon_request
+from pi.ibeacon import ScanCounters
+
+
+class ScannerBusy(Exception):
+    """Another user's scan is still using the Bluetooth adapter."""
+
+
+class ScanJob:
+    """
+    One iBeacon discovery run in a background thread. Beacons are appended
+    to `beacons` as they are heard, so a stream can send each one the moment
+    it shows up instead of after the whole scan. Once it ends, `results`
+    holds every beacon's RSSI statistics over the whole scan and `counters`
+    how many advertisements the scan had to look at.
+
+    The scan ends after `duration` seconds, once `limit` beacons were found,
+    or when stop() is called (e.g. the user already picked a beacon);
+    `reason` then says which of 'timeout', 'limit' or 'stopped' it was, or
+    holds the error if the scan failed.
+    """
+
+    def __init__(self, user_id, duration, limit=None, exclude=()):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.duration = duration
+        self.limit = limit
+        self.exclude = {tuple(beacon) for beacon in exclude}
+        self.beacons = []
+        self.results = None
+        self.counters = ScanCounters()
+        self.state = 'running'
+        self.reason = None
+        self.finished_at = None
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'beacon-scan-{self.id[:8]}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, reason='stopped', timeout=None):
+        with self._cond:
+            if self.reason is None:
+                self.reason = reason
+        self._stopping.set()
+        if timeout is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self.state == 'running'
+
+    def wait(self, seen, timeout):
+        """Blocks until more than `seen` beacons were found, the scan ended or `timeout` expired."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.beacons) > seen or not self.running, timeout=timeout)
+
+    def since(self, seen):
+        """(beacons found after the first `seen`, state, reason), read consistently."""
+        with self._cond:
+            return self.beacons[seen:], self.state, self.reason
+
+    def poll(self, seen, timeout):
+        """wait() and then since()."""
+        self.wait(seen, timeout)
+        return self.since(seen)
+
+    def summary(self):
+        with self._cond:
+            return {'job_id': self.id, 'state': self.state, 'reason': self.reason,
+                    'beacons': list(self.results if self.results is not None else self.beacons),
+                    'scan': self.counters.as_dict()}
+
+    def _found(self, beacon):
+        # Runs on the scan's event loop
+        with self._cond:
+            self.beacons.append(beacon)
+            if self.limit and len(self.beacons) >= self.limit and self.reason is None:
+                self.reason = 'limit'
+                self._stopping.set()
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            results = asyncio.run(scan_for_ibeacons(
+                self.duration, exclude=self.exclude, on_beacon=self._found, should_stop=self._stopping.is_set,
+                daemon_socket=app.config['BLE_DAEMON_SOCKET'], recent_seconds=app.config['BLE_DAEMON_RECENT_SECONDS'],
+                uuid=app.config['BEACON_SCAN_UUID'], counters=self.counters,
+            ))
+            state, reason = 'done', self.reason or 'timeout'
+        except Exception as e:
+            app.logger.error(f"Error scanning for iBeacons: {e}")
+            state, reason, results = 'failed', str(e), None
+        app.logger.info(f"iBeacon scan {self.id[:8]} {state} ({reason}): {self.counters.as_dict()}")
+        with self._cond:
+            self.state, self.reason, self.results = state, reason, results
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+
+class DaemonScanJob:
+    """
+    A scan run by the BLE daemon (see pi.ble_daemon.BeaconScan) instead of
+    this process, so any web worker can stream, read or stop it. Offers the
+    part of ScanJob's interface the routes use; each call asks the daemon.
+    A daemon that can't be reached fails the scan.
+    """
+
+    def __init__(self, reply, daemon_socket):
+        self.daemon_socket = daemon_socket
+        self.id = reply['id']
+        self.user_id = reply['owner']
+        self._update(reply)
+
+    @property
+    def running(self):
+        return self.state == 'running'
+
+    def stop(self):
+        self._request({'cmd': 'scan_stop', 'id': self.id})
+
+    def poll(self, seen, timeout):
+        """(beacons found after the first `seen`, state, reason), waiting up to `timeout` for a change."""
+        reply = self._request({'cmd': 'scan', 'id': self.id, 'seen': seen, 'wait': timeout}, timeout=timeout + 5.0)
+        return (reply['beacons'] if reply else []), self.state, self.reason
+
+    def summary(self):
+        reply = self._request({'cmd': 'scan', 'id': self.id})
+        beacons = self.results if self.results is not None else reply['beacons'] if reply else []
+        return {'job_id': self.id, 'state': self.state, 'reason': self.reason, 'beacons': list(beacons),
+                'scan': self.counters}
+
+    def _request(self, payload, timeout=2.0):
+        try:
+            reply = daemon_request(self.daemon_socket, payload, timeout=timeout)
+        except (OSError, ValueError) as e:
+            reply = {'error': f'BLE daemon unavailable: {e}'}
+        if 'error' in reply:
+            app.logger.error(f"iBeacon scan {self.id[:8]} failed: {reply['error']}")
+            self.state, self.reason = 'failed', reply['error']
+            return None
+        self._update(reply)
+        return reply
+
+    def _update(self, reply):
+        self.state, self.reason = reply['state'], reply['reason']
+        self.results, self.counters = reply['results'], reply['scan']
+
+
+class ScanJobs:
+    """
+    Scan jobs by id. There is one Bluetooth adapter, so only one scan runs at
+    a time: starting a new one stops the user's previous scan and is refused
+    while another user's is running. Finished jobs are kept `retention`
+    seconds for streams that reconnect.
+
+    While the BLE daemon listens on `daemon_socket` the scans run there, so
+    every web worker shares them. Otherwise they run in this process, which
+    then has to be the only one serving the app.
+    """
+
+    def __init__(self, retention=300.0, daemon_socket=None, recent_seconds=5.0, uuid=None):
+        self.retention = retention
+        self.daemon_socket = daemon_socket
+        self.recent_seconds = recent_seconds
+        self.uuid = uuid
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, user_id, duration, limit=None, exclude=()):
+        if self.daemon_socket and is_listening(self.daemon_socket):
+            reply = daemon_request(self.daemon_socket, {
+                'cmd': 'scan_start', 'owner': user_id, 'duration': duration, 'limit': limit,
+                'exclude': [list(beacon) for beacon in exclude], 'uuid': self.uuid, 'since': self.recent_seconds,
+                'retention': self.retention,
+            })
+            if reply.get('busy'):
+                raise ScannerBusy(reply['error'])
+            if 'error' in reply:
+                raise RuntimeError(f"BLE daemon refused the scan: {reply['error']}")
+            return DaemonScanJob(reply, self.daemon_socket)
+        with self._lock:
+            self._prune()
+            running = [job for job in self._jobs.values() if job.running]
+            if any(job.user_id != user_id for job in running):
+                raise ScannerBusy('Another scan is in progress, try again in a few seconds.')
+            for job in running:
+                job.stop(timeout=2.0)
+            job = ScanJob(user_id, duration, limit=limit, exclude=exclude)
+            self._jobs[job.id] = job
+        job.start()
+        return job
+
+    def get(self, job_id, user_id):
+        job = self._jobs.get(job_id)
+        if job is None and self.daemon_socket:
+            try:
+                reply = daemon_request(self.daemon_socket, {'cmd': 'scan', 'id': job_id})
+            except (OSError, ValueError):
+                return None
+            if 'error' not in reply:
+                job = DaemonScanJob(reply, self.daemon_socket)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.retention:
+                del self._jobs[job_id]
+
+
+scan_jobs = ScanJobs(
+    retention=app.config['BEACON_SCAN_RETENTION_SECONDS'],
+    daemon_socket=app.config['BLE_DAEMON_SOCKET'],
+    recent_seconds=app.config['BLE_DAEMON_RECENT_SECONDS'],
+    uuid=app.config['BEACON_SCAN_UUID'],
+)
@@ -0,0 +1,136 @@
+import time
+from datetime import datetime, timedelta
+import click
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from app.laptop_cache import laptop_cache
+from app.maintenance import maintain_readings, raw_purge_cutoff
+from app.partitions import (create_partitions_ahead, drop_partitions_before, is_partitioned, list_partitions,
+                            count_default_rows, purge_default_before, DEFAULT_PARTITION)
+from app.models import ConfigVersion, Laptop, Station
+
+
+@app.cli.command('maintain-readings')
+@click.option('--retention-days', type=float, default=None,
+              help='Keep raw sensor readings this many days (default: SENSOR_READING_RETENTION_DAYS).')
+@click.option('--minute-rollup-retention-days', type=float, default=None,
+              help='Keep minute rollups this many days (default: SENSOR_MINUTE_ROLLUP_RETENTION_DAYS).')
+@click.option('--batch-size', type=int, default=None,
+              help='Rows deleted per transaction (default: SENSOR_PURGE_BATCH_SIZE).')
+@click.option('--interval', type=float, default=None,
+              help='Keep running and repeat every N seconds instead of exiting after one pass.')
+def maintain_readings_command(retention_days, minute_rollup_retention_days, batch_size, interval):
+    """Roll up sensor readings per minute/hour and purge expired raw rows."""
+    config = app.config
+    raw_retention = timedelta(days=retention_days if retention_days is not None
+                              else config['SENSOR_READING_RETENTION_DAYS'])
+    minute_retention = timedelta(days=minute_rollup_retention_days if minute_rollup_retention_days is not None
+                                 else config['SENSOR_MINUTE_ROLLUP_RETENTION_DAYS'])
+    batch_size = batch_size or config['SENSOR_PURGE_BATCH_SIZE']
+    lookback = timedelta(minutes=config['SENSOR_ROLLUP_LOOKBACK_MINUTES'])
+
+    while True:
+        started = time.monotonic()
+        summary = maintain_readings(raw_retention, minute_retention, batch_size=batch_size, lookback=lookback,
+                                    partitions_ahead=config['SENSOR_READING_PARTITIONS_AHEAD_DAYS'])
+        click.echo(', '.join(f'{key}={value}' for key, value in summary.items())
+                   + f' ({time.monotonic() - started:.1f}s)')
+        if interval is None:
+            break
+        time.sleep(interval)
+
+
+@app.cli.group('partitions')
+def partitions_group():
+    """Manage the daily sensor_reading partitions (PostgreSQL)."""
+    if not is_partitioned():
+        raise click.ClickException('sensor_reading is not partitioned on this database.')
+
+
+@partitions_group.command('list')
+def list_partitions_command():
+    """List the partitions of sensor_reading and how many rows the DEFAULT one holds."""
+    for start, end, name in list_partitions():
+        if end - start == timedelta(days=1):
+            click.echo(f'{start.isoformat()}              {name}')
+        else:
+            click.echo(f'{start.isoformat()}..{end.isoformat()}  {name}')
+    click.echo(f'default                 {DEFAULT_PARTITION} ({count_default_rows()} rows)')
+
+
+@partitions_group.command('maintain')
+@click.option('--days-ahead', type=int, default=None,
+              help='Create partitions this many days ahead (default: SENSOR_READING_PARTITIONS_AHEAD_DAYS).')
+@click.option('--retention-days', type=float, default=None,
+              help='Drop partitions older than this many days (default: SENSOR_READING_RETENTION_DAYS).')
+def maintain_partitions_command(days_ahead, retention_days):
+    """Create upcoming partitions and drop expired ones without touching rollups."""
+    config = app.config
+    days_ahead = days_ahead if days_ahead is not None else config['SENSOR_READING_PARTITIONS_AHEAD_DAYS']
+    retention = timedelta(days=retention_days if retention_days is not None
+                          else config['SENSOR_READING_RETENTION_DAYS'])
+    created = create_partitions_ahead(days_ahead)
+    # Never drop a day the minute rollups have not covered yet
+    cutoff = raw_purge_cutoff(datetime.utcnow() - retention)
+    dropped = drop_partitions_before(cutoff) if cutoff else []
+    purged = purge_default_before(cutoff) if cutoff else 0
+    for name in created:
+        click.echo(f'created {name}')
+    for name in dropped:
+        click.echo(f'dropped {name}')
+    if purged:
+        click.echo(f'purged {purged} expired rows from {DEFAULT_PARTITION}')
+
+
+@app.cli.group('stations')
+def stations_group():
+    """Manage stations (one Pi and Arduino each) and the laptops they watch."""
+
+
+@stations_group.command('list')
+def list_stations_command():
+    """List stations with the number of laptops assigned to each."""
+    rows = db.session.query(Station.name, db.func.count(Laptop.id))\
+        .outerjoin(Laptop)\
+        .group_by(Station.id, Station.name)\
+        .order_by(Station.name)\
+        .all()
+    for name, laptops in rows:
+        click.echo(f'{name}  {laptops} laptops')
+    unassigned = Laptop.query.filter(Laptop.station_id.is_(None)).count()
+    if unassigned:
+        click.echo(f'({unassigned} laptops without a station)')
+
+
+@stations_group.command('add')
+@click.argument('name')
+def add_station_command(name):
+    """Create a station; its Pi uses NAME as STATION_NAME."""
+    if Station.query.filter_by(name=name).first() is not None:
+        raise click.ClickException(f'Station {name!r} already exists.')
+    db.session.add(Station(name=name))
+    ConfigVersion.bump()
+    db.session.commit()
+    click.echo(f'created {name}')
+
+
+@stations_group.command('assign')
+@click.argument('station')
+@click.argument('serial_numbers', nargs=-1, required=True)
+def assign_station_command(station, serial_numbers):
+    """Move the laptops with SERIAL_NUMBERS to STATION ("-" for no station)."""
+    station_id = None
+    if station != '-':
+        station_id = db.session.query(Station.id).filter_by(name=station).scalar()
+        if station_id is None:
+            raise click.ClickException(f'No station named {station!r}.')
+    updated = Laptop.query.filter(Laptop.serial_number.in_(serial_numbers))\
+        .update({Laptop.station_id: station_id}, synchronize_session=False)
+    ConfigVersion.bump()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise click.ClickException(f'Two laptops at {station!r} would share an ultrasonic sensor index.')
+    laptop_cache.invalidate()
+    click.echo(f'{updated} of {len(serial_numbers)} laptops assigned to {station}')
@@ -0,0 +1,45 @@
+import threading
+import time
+from app import app, db
+from app.models import ConfigVersion
+
+
+class ConfigWatcher:
+    """
+    Lets a request wait for the laptop configuration to change, for the Pi's
+    long-polling /api/config.
+
+    A change committed by this process wakes the waiters at once through
+    notify(). Changes made by another worker or by the CLI only show up in the
+    shared ConfigVersion row, which waiters re-read every `poll_interval`
+    seconds; that is one primary key lookup per waiting Pi, and the database
+    connection is handed back to the pool in between.
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._changes = 0
+
+    def notify(self):
+        """Call after committing a ConfigVersion.bump()."""
+        with self._cond:
+            self._changes += 1
+            self._cond.notify_all()
+
+    def wait(self, version, timeout):
+        """Blocks until ConfigVersion differs from `version` or `timeout` expires; returns the current version."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                changes = self._changes
+            current = ConfigVersion.current()
+            db.session.remove()
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            with self._cond:
+                self._cond.wait_for(lambda: self._changes != changes, timeout=min(self.poll_interval, remaining))
+
+
+config_watcher = ConfigWatcher(poll_interval=app.config['CONFIG_WAIT_POLL_SECONDS'])
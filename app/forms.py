@@ -43,10 +43,19 @@ class LaptopForm(FlaskForm):
         coerce=int,
         choices=[(0, 'Sensor 0'), (1, 'Sensor 1'), (2, 'Sensor 2'), (3, 'Sensor 3')]
     )
+
+    # The station whose Pi and Arduino watch the laptop (0 for none); the view fills in the choices
+    station_id = SelectField('Station', coerce=int, choices=[(0, 'No station')], default=0)
     
     submit = SubmitField('Add Laptop')
 
     def validate_serial_number(self, serial_number):
         laptop = Laptop.query.filter_by(serial_number=serial_number.data).first()
         if laptop is not None:
-            raise ValidationError('A laptop with this serial number already exists.')
\ No newline at end of file
+            raise ValidationError('A laptop with this serial number already exists.')
+
+    def validate_ultrasonic_sensor_index(self, ultrasonic_sensor_index):
+        laptop = Laptop.query.filter_by(station_id=self.station_id.data or None,
+                                        ultrasonic_sensor_index=ultrasonic_sensor_index.data).first()
+        if laptop is not None:
+            raise ValidationError('This sensor is already assigned to another laptop at this station.')
\ No newline at end of file
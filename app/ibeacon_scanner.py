@@ -1,63 +1,117 @@
 import asyncio
+import json
+import logging
 import time
-from bleak import BleakScanner
+from pi.ble_daemon import is_listening, subscribe
+from pi.ibeacon import BeaconStats, ScanCounters, decode_ibeacon, start_scanner
 
-async def scan_for_ibeacons(scan_duration=10):
+log = logging.getLogger(__name__)
+
+async def scan_for_ibeacons(scan_duration=10, exclude=(), on_beacon=None, should_stop=None,
+                            daemon_socket=None, recent_seconds=5.0, uuid=None, counters=None):
     """
     Scans for iBeacons using the bleak library for a specified duration,
-    returning the MAC address and RSSI.
+    returning each beacon's MAC address, UUID, major, minor and RSSI
+    statistics over the scan (count, min/max/mean RSSI, first/last seen).
+
+    Beacons whose (uuid, major, minor) is in `exclude` are ignored as they
+    are heard. Each new beacon is passed to `on_beacon` straight away, and
+    the scan ends early once `should_stop()` returns True.
+
+    Where the adapter supports it only iBeacons (of proximity `uuid` if
+    given) are delivered to the callback at all. `counters`, a
+    pi.ibeacon.ScanCounters, records how many callbacks the scan ran.
+
+    If the BLE daemon listens on `daemon_socket`, its sightings are used
+    instead of the adapter: those of the last `recent_seconds` arrive at
+    once, followed by live ones.
     """
+    counters = counters if counters is not None else ScanCounters()
+    uuid = uuid.replace('-', '').lower() if uuid else None
     found_beacons = {}
-    
-    def detection_callback(device, advertisement_data):
-        # iBeacon data is typically found in the manufacturer_data field
-        # Apple's manufacturer ID is 0x004c
-        apple_id = 0x004c
-        if apple_id in advertisement_data.manufacturer_data:
-            data = advertisement_data.manufacturer_data[apple_id]
-            # iBeacon data starts with bytes [0x02, 0x15]
-            if data[0:2] == bytes([0x02, 0x15]):
-                # Get the MAC address from the device object
-                mac_address = device.address
-                
-                # Get other beacon data
-                uuid = data[2:18].hex()
-                major = int.from_bytes(data[18:20], byteorder='big')
-                minor = int.from_bytes(data[20:22], byteorder='big')
-                rssi = advertisement_data.rssi
-
-                # Use the MAC address as the unique key
-                if mac_address not in found_beacons:
-                    found_beacons[mac_address] = {
-                        'mac_address': mac_address,
-                        'uuid': uuid,
-                        'major': major,
-                        'minor': minor,
-                        'rssi': rssi
-                    }
-
-    scanner = BleakScanner(detection_callback)
-    
-    print("Scanning for iBeacons...")
-    
-    start_time = time.time()
-    
-    await scanner.start()
-    
-    await asyncio.sleep(scan_duration)
-    
-    await scanner.stop()
-    
-    return list(found_beacons.values())
+    ignored = set()
+
+    def add_sighting(mac_address, fields, rssi, now):
+        beacon = found_beacons.get(mac_address)
+        if beacon is None:
+            # Use the MAC address as the unique key
+            if mac_address in ignored or (uuid and fields[0] != uuid):
+                return
+            if fields in exclude:
+                ignored.add(mac_address)
+                return
+            beacon = found_beacons[mac_address] = BeaconStats(mac_address, *fields)
+            beacon.add(rssi, now)
+            if on_beacon:
+                on_beacon(beacon.as_dict())
+            return
+        beacon.add(rssi, now)
+
+    try:
+        if daemon_socket and is_listening(daemon_socket):
+            counters.mode = 'daemon'
+            await read_daemon(daemon_socket, scan_duration, recent_seconds, add_sighting, should_stop, counters)
+            return [beacon.as_dict() for beacon in found_beacons.values()]
+
+        def detection_callback(device, advertisement_data):
+            counters.callbacks += 1
+            fields = decode_ibeacon(advertisement_data.manufacturer_data)
+            if fields is not None:
+                counters.ibeacons += 1
+                add_sighting(device.address, fields, advertisement_data.rssi, time.time())
+
+        log.info("Scanning for iBeacons...")
+
+        start_time = time.time()
+
+        scanner, counters.mode = await start_scanner(detection_callback, uuid=uuid)
+
+        try:
+            while time.time() - start_time < scan_duration:
+                if should_stop and should_stop():
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await scanner.stop()
+
+        return [beacon.as_dict() for beacon in found_beacons.values()]
+    finally:
+        counters.finish()
+
+async def read_daemon(daemon_socket, scan_duration, recent_seconds, add_sighting, should_stop, counters):
+    """Feeds the BLE daemon's iBeacon sightings to `add_sighting` until the scan time is up or it should stop."""
+    reader, writer = await subscribe(daemon_socket, since=recent_seconds, ibeacon_only=True)
+    log.info("Reading iBeacons from the BLE daemon at %s...", daemon_socket)
+    deadline = time.time() + scan_duration
+    try:
+        while time.time() < deadline and not (should_stop and should_stop()):
+            try:
+                line = await asyncio.wait_for(reader.readline(), timeout=min(0.1, max(0.0, deadline - time.time())))
+            except asyncio.TimeoutError:
+                continue
+            if not line:
+                break  # the daemon went away; keep what was found
+            sighting = json.loads(line)
+            counters.callbacks += 1
+            counters.ibeacons += 1
+            add_sighting(sighting['mac'], (sighting['uuid'], sighting['major'], sighting['minor']),
+                         sighting['rssi'], sighting['t'])
+    finally:
+        writer.close()
 
 if __name__ == '__main__':
     async def main():
-        beacons = await scan_for_ibeacons()
+        counters = ScanCounters()
+        beacons = await scan_for_ibeacons(counters=counters)
         if beacons:
-            print("Found iBeacons:")
+            log.info("Found iBeacons:")
             for beacon in beacons:
-                print(f"MAC: {beacon['mac_address']}, UUID: {beacon['uuid']}, Major: {beacon['major']}, Minor: {beacon['minor']}, RSSI: {beacon['rssi']}")
+                log.info("MAC: %s, UUID: %s, Major: %s, Minor: %s, RSSI: mean %s min %s max %s over %s advertisements",
+                         beacon['mac_address'], beacon['uuid'], beacon['major'], beacon['minor'],
+                         beacon['rssi_mean'], beacon['rssi_min'], beacon['rssi_max'], beacon['count'])
         else:
-            print("No iBeacons found.")
+            log.info("No iBeacons found.")
+        log.info("Scan: %s", counters.as_dict())
 
-    asyncio.run(main())
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from app import app, db
+from app.models import Laptop, ConfigVersion, Station
+
+# The subset of a laptop row the ingest endpoints need. Being a plain tuple it
+# is safe to share between requests, unlike an ORM instance bound to a session.
+LaptopIdentity = namedtuple('LaptopIdentity', [
+    'id', 'serial_number', 'user_id',
+    'ibeacon_uuid', 'ibeacon_major', 'ibeacon_minor', 'ibeacon_mac_address',
+    'ultrasonic_sensor_index',
+])
+
+_IDENTITY_COLUMNS = [getattr(Laptop, field) for field in LaptopIdentity._fields]
+
+
+class LaptopCache:
+    """
+    Bounded LRU cache of laptop identities keyed by serial number and iBeacon
+    MAC, and of station ids keyed by station name.
+
+    Entries are dropped explicitly through invalidate() when this worker changes
+    the laptop table, and implicitly when the shared ConfigVersion row moves on,
+    which is checked at most once every `version_check_interval` seconds.
+    """
+
+    def __init__(self, max_size=1024, version_check_interval=5.0):
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._next_version_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_by_serial(self, serial_number):
+        return self._get(('serial', serial_number), Laptop.serial_number == serial_number)
+
+    def get_by_mac(self, mac_address):
+        return self._get(('mac', mac_address), Laptop.ibeacon_mac_address == mac_address)
+
+    def get_station_id(self, name):
+        """Id of the station called `name`, or None if there is no such station."""
+        self._check_version()
+        key = ('station', name)
+        with self._lock:
+            station_id = self._lookup(key)
+        if station_id is not None:
+            return station_id
+
+        station_id = db.session.query(Station.id).filter(Station.name == name).scalar()
+        if station_id is None:
+            return None
+        with self._lock:
+            self._entries[key] = station_id
+            self._evict()
+        return station_id
+
+    def get_many_by_serial(self, serial_numbers):
+        """Resolves several serial numbers, loading all the misses with one query."""
+        self._check_version()
+        found = {}
+        missing = []
+        with self._lock:
+            for serial_number in serial_numbers:
+                identity = self._lookup(('serial', serial_number))
+                if identity is None:
+                    missing.append(serial_number)
+                else:
+                    found[serial_number] = identity
+
+        if missing:
+            rows = db.session.query(*_IDENTITY_COLUMNS).filter(Laptop.serial_number.in_(missing)).all()
+            with self._lock:
+                for row in rows:
+                    identity = LaptopIdentity(*row)
+                    self._store(identity)
+                    found[identity.serial_number] = identity
+        return found
+
+    def discard(self, identity):
+        """Drops one laptop's entries, e.g. after a write found it deleted."""
+        with self._lock:
+            for key in (('serial', identity.serial_number), ('mac', identity.ibeacon_mac_address)):
+                self._entries.pop(key, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            self._next_version_check = 0.0
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'version': self._version,
+            }
+
+    def _get(self, key, criterion):
+        self._check_version()
+        with self._lock:
+            identity = self._lookup(key)
+        if identity is not None:
+            return identity
+
+        row = db.session.query(*_IDENTITY_COLUMNS).filter(criterion).first()
+        if row is None:
+            return None
+        identity = LaptopIdentity(*row)
+        with self._lock:
+            self._store(identity)
+        return identity
+
+    def _lookup(self, key):
+        identity = self._entries.get(key)
+        if identity is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return identity
+
+    def _store(self, identity):
+        for key in (('serial', identity.serial_number), ('mac', identity.ibeacon_mac_address)):
+            if key[1] is None:
+                continue
+            self._entries[key] = identity
+            self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now < self._next_version_check:
+            return
+        version = ConfigVersion.current()
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+                self.invalidations += 1
+            self._version = version
+            self._next_version_check = now + self.version_check_interval
+
+
+laptop_cache = LaptopCache(
+    max_size=app.config['LAPTOP_CACHE_SIZE'],
+    version_check_interval=app.config['LAPTOP_CACHE_VERSION_CHECK_SECONDS'],
+)
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from app import app
+
+
+class LiveFeed:
+    """
+    In-process fan-out of laptop status/RSSI changes to dashboard streams.
+
+    The ingest endpoints publish after they commit; only values that differ from
+    the last published state become events. Every event gets a cursor of the
+    form "<epoch>-<seq>" which the browser sends back as Last-Event-ID when it
+    reconnects, so a short disconnect is resumed from the in-memory history
+    instead of rebuilding the dashboard from the database. The epoch changes on
+    every process start, which forces a fresh snapshot after a restart.
+
+    The feed only sees writes handled by the same process, so the app must be
+    served by a single (threaded) process; run.py and start_app.sh do that. A
+    stream served by another worker would never see the Pi's readings.
+    """
+
+    def __init__(self, history=4096, last_seen_resolution=5.0):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.last_seen_resolution = last_seen_resolution
+        self._events = deque(maxlen=history)
+        self._state = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def publish(self, user_id, laptop_id, **fields):
+        """
+        Records new values for a laptop and wakes up waiting streams if any of
+        them changed. `last_seen` on its own only counts as a change once it
+        has moved by at least `last_seen_resolution` seconds.
+        """
+        now = time.monotonic()
+        with self._cond:
+            state = self._state.setdefault(laptop_id, {'last_seen_at': None})
+            changed = {k: v for k, v in fields.items() if k != 'last_seen' and state.get(k) != v}
+            stale = state['last_seen_at'] is None or now - state['last_seen_at'] >= self.last_seen_resolution
+            if 'last_seen' in fields and (changed or stale):
+                changed['last_seen'] = fields['last_seen']
+            if not changed:
+                return
+
+            state.update(changed)
+            if 'last_seen' in changed:
+                state['last_seen_at'] = now
+            self._seq += 1
+            self._events.append((self._seq, user_id, dict(changed, id=laptop_id)))
+            self._cond.notify_all()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def cursor(self, seq=None):
+        return f'{self.epoch}-{self._seq if seq is None else seq}'
+
+    def parse_cursor(self, cursor):
+        """Returns the sequence number of a cursor from this process, or None."""
+        try:
+            epoch, seq = cursor.rsplit('-', 1)
+            seq = int(seq)
+        except (AttributeError, ValueError):
+            return None
+        if epoch != self.epoch or seq > self._seq:
+            return None
+        return seq
+
+    def events_since(self, user_id, seq):
+        """
+        Returns (events, last_seq) for the given user after `seq`, or
+        (None, last_seq) if part of that range has already been evicted.
+        """
+        with self._cond:
+            if self._events and seq < self._events[0][0] - 1:
+                return None, self._seq
+            events = [(s, payload) for s, owner, payload in self._events if s > seq and owner == user_id]
+            return events, self._seq
+
+    def wait(self, seq, timeout):
+        """Blocks until an event newer than `seq` is published or `timeout` expires."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+            return self._seq
+
+
+def sse_message(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+live_feed = LiveFeed(
+    history=app.config['LIVE_FEED_HISTORY'],
+    last_seen_resolution=app.config['LIVE_FEED_LAST_SEEN_RESOLUTION_SECONDS'],
+)
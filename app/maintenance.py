@@ -0,0 +1,248 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, delete, func, insert, literal, select
+from app import db
+from app.models import RollupBacklog, SensorReading, SensorReadingRollup
+from app.partitions import create_partitions_ahead, drop_partitions_before, is_partitioned, purge_default_before
+
+BUCKET_WIDTHS = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+}
+
+# Columns every rollup row is built from, in insert order
+ROLLUP_COLUMNS = [
+    'laptop_id', 'resolution', 'bucket_start', 'sample_count',
+    'rssi_min', 'rssi_max', 'rssi_avg',
+] + [
+    f'distance_{i}_{stat}_cm' for i in range(1, 5) for stat in ('min', 'max', 'avg')
+] + ['intrusion_count']
+
+# Raw rollup ranges are processed at most this long at a time, so the first
+# run over a big backlog is split into short transactions.
+ROLLUP_CHUNK = timedelta(hours=6)
+
+
+def floor_bucket(timestamp, resolution):
+    if resolution == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def bucket_expression(column, resolution):
+    """SQL expression truncating `column` to the start of its bucket."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.date_trunc(resolution, column)
+    # Match SQLAlchemy's SQLite DATETIME storage format so the buckets compare
+    # correctly against bound datetime parameters.
+    pattern = '%Y-%m-%d %H:00:00.000000' if resolution == 'hour' else '%Y-%m-%d %H:%M:00.000000'
+    return func.strftime(pattern, column)
+
+
+def _minute_rollup_select(start, end):
+    bucket = bucket_expression(SensorReading.timestamp, 'minute')
+    distances = []
+    for i in range(1, 5):
+        column = getattr(SensorReading, f'ultrasonic_distance_{i}_cm')
+        distances += [func.min(column), func.max(column), func.avg(column)]
+
+    return select(
+        SensorReading.laptop_id, literal('minute'), bucket, func.count(),
+        func.min(SensorReading.ibeacon_rssi), func.max(SensorReading.ibeacon_rssi),
+        func.avg(SensorReading.ibeacon_rssi),
+        *distances,
+        func.sum(case((SensorReading.ultrasonic_intrusion_detected, 1), else_=0)),
+    ).where(
+        SensorReading.timestamp >= start,
+        SensorReading.timestamp < end,
+        SensorReading.laptop_id.isnot(None),
+    ).group_by(SensorReading.laptop_id, bucket)
+
+
+def _hour_rollup_select(start, end):
+    minute = SensorReadingRollup
+    bucket = bucket_expression(minute.bucket_start, 'hour')
+    total = func.sum(minute.sample_count)
+
+    def weighted_avg(column):
+        return func.sum(column * minute.sample_count) / total
+
+    distances = []
+    for i in range(1, 5):
+        distances += [
+            func.min(getattr(minute, f'distance_{i}_min_cm')),
+            func.max(getattr(minute, f'distance_{i}_max_cm')),
+            weighted_avg(getattr(minute, f'distance_{i}_avg_cm')),
+        ]
+
+    return select(
+        minute.laptop_id, literal('hour'), bucket, total,
+        func.min(minute.rssi_min), func.max(minute.rssi_max), weighted_avg(minute.rssi_avg),
+        *distances,
+        func.sum(minute.intrusion_count),
+    ).where(
+        minute.resolution == 'minute',
+        minute.bucket_start >= start,
+        minute.bucket_start < end,
+    ).group_by(minute.laptop_id, bucket)
+
+
+def rollup_readings(resolution, now=None, lookback=timedelta(hours=1), not_before=None):
+    """
+    Writes rollups for every complete `resolution` bucket that ended before
+    `now`. Minute rollups are built from sensor_reading, hour rollups from the
+    minute rollups.
+
+    Work resumes from the newest existing rollup, minus `lookback`, so
+    readings that arrive a little late are folded into buckets that were
+    already written. Readings older than that (replayed from a Pi's spool)
+    are recorded in RollupBacklog when they are stored, and work then
+    resumes from the oldest of them instead, but never from before
+    `not_before`: older source data has been purged, so rebuilding those
+    buckets would lose what they hold. Returns the number of rollup rows
+    written.
+    """
+    now = now or datetime.utcnow()
+    width = BUCKET_WIDTHS[resolution]
+    end = floor_bucket(now, resolution)
+
+    watermark = db.session.query(func.max(SensorReadingRollup.bucket_start))\
+        .filter(SensorReadingRollup.resolution == resolution)\
+        .scalar()
+    backlog = RollupBacklog.pending(resolution)
+    if watermark is not None:
+        start = floor_bucket(watermark + width - lookback, resolution)
+        if backlog is not None:
+            since = backlog.since
+            if not_before is not None:
+                since = max(since, floor_bucket(not_before, resolution) + width)
+            start = min(start, since)
+    elif resolution == 'minute':
+        start = db.session.query(func.min(SensorReading.timestamp)).scalar()
+    else:
+        start = db.session.query(func.min(SensorReadingRollup.bucket_start))\
+            .filter(SensorReadingRollup.resolution == 'minute')\
+            .scalar()
+    if start is None:
+        return 0
+    start = floor_bucket(start, resolution)
+
+    build = _minute_rollup_select if resolution == 'minute' else _hour_rollup_select
+    rebuilt_from = start
+    written = 0
+    while start < end:
+        chunk_end = min(start + ROLLUP_CHUNK, end)
+        # Recomputing is idempotent: drop whatever an earlier run wrote for
+        # these buckets and insert fresh aggregates in the same transaction.
+        db.session.execute(delete(SensorReadingRollup).where(
+            SensorReadingRollup.resolution == resolution,
+            SensorReadingRollup.bucket_start >= start,
+            SensorReadingRollup.bucket_start < chunk_end,
+        ))
+        result = db.session.execute(
+            insert(SensorReadingRollup).from_select(ROLLUP_COLUMNS, build(start, chunk_end))
+        )
+        db.session.commit()
+        written += max(result.rowcount, 0)
+        start = chunk_end
+
+    if backlog is not None:
+        RollupBacklog.clear(resolution, backlog.version)
+        if resolution == 'minute':
+            # The hour rollups built from the minute rollups just rewritten are stale too
+            RollupBacklog.mark('hour', rebuilt_from)
+        db.session.commit()
+    return written
+
+
+def rolled_up_until(resolution='minute'):
+    """End of the newest rollup bucket, i.e. data before this time is safe to purge."""
+    newest = db.session.query(func.max(SensorReadingRollup.bucket_start))\
+        .filter(SensorReadingRollup.resolution == resolution)\
+        .scalar()
+    return newest + BUCKET_WIDTHS[resolution] if newest is not None else None
+
+
+def purge_in_batches(model, *criteria, batch_size=5000):
+    """
+    Deletes rows of `model` matching `criteria`, `batch_size` rows per
+    transaction so no single statement holds locks for long. Returns the
+    number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        ids = select(model.id).where(*criteria).limit(batch_size).scalar_subquery()
+        result = db.session.execute(delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def safe_purge_cutoff(older_than, resolution):
+    """
+    Time before which data is both expired and covered by `resolution`
+    rollups, leaving alone anything a rollup still has to fold in.
+    """
+    safe_until = rolled_up_until(resolution)
+    if safe_until is None:
+        return None
+    cutoff = min(older_than, safe_until)
+    backlog = RollupBacklog.pending(resolution)
+    if backlog is not None:
+        cutoff = min(cutoff, floor_bucket(backlog.since, resolution))
+    return cutoff
+
+
+def raw_purge_cutoff(older_than):
+    """Time before which raw readings are both expired and covered by minute rollups."""
+    return safe_purge_cutoff(older_than, 'minute')
+
+
+def purge_raw_readings(older_than, batch_size=5000):
+    """
+    Deletes sensor_reading rows older than `older_than` that are already
+    covered by minute rollups. Returns the number of rows deleted.
+    """
+    cutoff = raw_purge_cutoff(older_than)
+    if cutoff is None:
+        return 0
+    return purge_in_batches(SensorReading, SensorReading.timestamp < cutoff, batch_size=batch_size)
+
+
+def purge_minute_rollups(older_than, batch_size=5000):
+    """Deletes minute rollups older than `older_than` that hour rollups already cover."""
+    cutoff = safe_purge_cutoff(older_than, 'hour')
+    if cutoff is None:
+        return 0
+    return purge_in_batches(
+        SensorReadingRollup,
+        SensorReadingRollup.resolution == 'minute',
+        SensorReadingRollup.bucket_start < cutoff,
+        batch_size=batch_size,
+    )
+
+
+def maintain_readings(raw_retention, minute_retention, batch_size=5000, lookback=timedelta(hours=1),
+                      partitions_ahead=7, now=None):
+    """
+    Runs one full maintenance pass and returns a summary of what it did.
+    When sensor_reading is partitioned, expired raw readings go away a whole
+    day partition at a time instead of through batched DELETEs, so a day is
+    only dropped once all of it is past the retention cutoff. Expired rows
+    that ended up in the DEFAULT partition are deleted.
+    """
+    now = now or datetime.utcnow()
+    partitioned = is_partitioned()
+    summary = {}
+    if partitioned:
+        summary['partitions_created'] = len(create_partitions_ahead(partitions_ahead, today=now.date()))
+    summary['minute_rollups'] = rollup_readings('minute', now=now, lookback=lookback, not_before=now - raw_retention)
+    summary['hour_rollups'] = rollup_readings('hour', now=now, lookback=lookback, not_before=now - minute_retention)
+    if partitioned:
+        cutoff = raw_purge_cutoff(now - raw_retention)
+        summary['partitions_dropped'] = len(drop_partitions_before(cutoff)) if cutoff else 0
+        summary['default_rows_purged'] = purge_default_before(cutoff) if cutoff else 0
+    else:
+        summary['raw_readings_purged'] = purge_raw_readings(now - raw_retention, batch_size=batch_size)
+    summary['minute_rollups_purged'] = purge_minute_rollups(now - minute_retention, batch_size=batch_size)
+    return summary
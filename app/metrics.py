@@ -0,0 +1,220 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import app, db
+from app.access import parse_networks, refusal
+from app.laptop_cache import laptop_cache
+from app.models import Laptop, LaptopState
+
+# Endpoints whose request counts and latencies are recorded
+INSTRUMENTED_ENDPOINTS = frozenset({
+    'receive_sensor_data', 'receive_sensor_data_batch', 'get_laptop_status', 'log_event', 'update_laptop_status',
+})
+
+# Histogram bucket upper bounds, in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative latency histogram; observing takes one short lock and a bisect, no allocation."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+class RateWindow:
+    """Events per second over the last `seconds` seconds, kept in one bucket per second."""
+
+    def __init__(self, seconds=60):
+        self.seconds = seconds
+        self._counts = [0] * seconds
+        self._stamps = [0] * seconds
+        self._lock = threading.Lock()
+
+    def add(self, n, now=None):
+        second = int(now if now is not None else time.time())
+        i = second % self.seconds
+        with self._lock:
+            if self._stamps[i] != second:
+                self._stamps[i] = second
+                self._counts[i] = 0
+            self._counts[i] += n
+
+    def rate(self, now=None):
+        second = int(now if now is not None else time.time())
+        with self._lock:
+            total = sum(count for count, stamp in zip(self._counts, self._stamps) if second - stamp < self.seconds)
+        return total / self.seconds
+
+
+class Metrics:
+    """
+    Request, commit and ingest metrics of this process, exposed on /metrics
+    in the Prometheus text format. Recording only touches in-memory counters;
+    the per-laptop gauges are read from the database when /metrics is
+    scraped. Every worker process counts its own requests.
+    """
+
+    def __init__(self, rate_seconds=60):
+        self.requests = {}
+        self.latency = {}
+        self.commit_latency = Histogram(COMMIT_BUCKETS)
+        self.readings = 0
+        self.readings_rate = RateWindow(rate_seconds)
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint, status, seconds):
+        histogram = self.latency.get(endpoint)
+        if histogram is None:
+            # setdefault is atomic, so two first requests still share one histogram
+            histogram = self.latency.setdefault(endpoint, Histogram(REQUEST_BUCKETS))
+        histogram.observe(seconds)
+        key = (endpoint, status)
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def readings_ingested(self, n):
+        with self._lock:
+            self.readings += n
+        self.readings_rate.add(n)
+
+    def render(self):
+        """The whole exposition, including the database-backed laptop gauges."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(labels)} {_value(value)}')
+
+        def histograms(name, help_text, labelled):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, histogram in labelled:
+                for suffix, sample_labels, value in _histogram_samples(histogram, labels):
+                    lines.append(f'{name}{suffix}{_labels(sample_labels)} {_value(value)}')
+
+        with self._lock:
+            counts = sorted(self.requests.items())
+            readings = self.readings
+        metric('laptop_security_http_requests_total', 'counter', 'Requests handled, by endpoint and status code.',
+               [({'endpoint': endpoint, 'status': status}, count) for (endpoint, status), count in counts])
+        histograms('laptop_security_http_request_duration_seconds', 'Time spent handling a request.',
+                   [({'endpoint': endpoint}, histogram) for endpoint, histogram in sorted(self.latency.items())])
+        histograms('laptop_security_db_commit_duration_seconds', 'Time spent in session commits, flush included.',
+                   [({}, self.commit_latency)])
+
+        metric('laptop_security_readings_ingested_total', 'counter',
+               'Readings stored by the ingest endpoints, not counting replays of stored ones.', [({}, readings)])
+        metric('laptop_security_readings_per_second', 'gauge',
+               f'Sensor readings stored per second over the last {self.readings_rate.seconds} seconds.',
+               [({}, round(self.readings_rate.rate(), 3))])
+
+        now = datetime.utcnow()
+        laptops = db.session.query(Laptop.id, LaptopState.is_stolen, LaptopState.last_seen)\
+            .outerjoin(LaptopState).order_by(Laptop.id).all()
+        metric('laptop_security_laptop_last_seen_age_seconds', 'gauge', 'Seconds since a laptop was last heard.',
+               [({'laptop_id': laptop_id}, round((now - last_seen).total_seconds(), 3))
+                for laptop_id, _, last_seen in laptops if last_seen is not None])
+        metric('laptop_security_laptops_stolen', 'gauge', 'Laptops currently flagged as stolen.',
+               [({}, sum(1 for _, is_stolen, _ in laptops if is_stolen))])
+
+        cache = laptop_cache.stats()
+        metric('laptop_security_laptop_cache_hits_total', 'counter', 'Laptop cache lookups answered from memory.',
+               [({}, cache['hits'])])
+        metric('laptop_security_laptop_cache_misses_total', 'counter', 'Laptop cache lookups that hit the database.',
+               [({}, cache['misses'])])
+        metric('laptop_security_laptop_cache_entries', 'gauge', 'Laptops held in the cache.', [({}, cache['size'])])
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_samples(histogram, labels):
+    cumulative, total = histogram.snapshot()
+    samples = [('_bucket', dict(labels, le=_value(bound)), count)
+               for bound, count in zip(histogram.buckets, cumulative)]
+    samples.append(('_bucket', dict(labels, le='+Inf'), cumulative[-1]))
+    samples.append(('_sum', labels, total))
+    samples.append(('_count', labels, cumulative[-1]))
+    return samples
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def scrape_refusal(req):
+    """
+    Why `req` may not read /metrics, as (message, status code), or None if
+    it may: see METRICS_TOKEN and METRICS_ALLOWED_NETWORKS in config.py.
+    """
+    return refusal(req, app.config['METRICS_TOKEN'], _ALLOWED_NETWORKS)
+
+
+_ALLOWED_NETWORKS = parse_networks(app.config['METRICS_ALLOWED_NETWORKS'])
+
+metrics = Metrics()
+
+
+@app.before_request
+def _start_timer():
+    if request.endpoint in INSTRUMENTED_ENDPOINTS:
+        g.metrics_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        metrics.observe_request(request.endpoint, response.status_code, time.perf_counter() - started)
+    return response
+
+
+@event.listens_for(Session, 'before_commit')
+def _commit_started(session):
+    session.info['metrics_commit_started'] = time.perf_counter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _commit_finished(session):
+    started = session.info.pop('metrics_commit_started', None)
+    if started is not None:
+        metrics.commit_latency.observe(time.perf_counter() - started)
@@ -5,6 +5,17 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from app import login
 
+def dialect_insert():
+    """The database's INSERT construct with ON CONFLICT support, or None if it has none."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
@@ -25,13 +36,37 @@ class User(UserMixin, db.Model):
 def load_user(id):
     return User.query.get(int(id))
 
+class Station(db.Model):
+    """
+    One receiver: a Pi with its Bluetooth adapter and an Arduino with four
+    ultrasonic sensors, usually covering one room. Each Pi loads only the
+    laptops assigned to its station and tags what it sends with the station
+    name, so capacity grows by adding stations.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    laptops = db.relationship('Laptop', backref='station', lazy='dynamic')
+
+    def __repr__(self):
+        return f'<Station {self.name}>'
+
 class Laptop(db.Model):
+    # Sensor indexes refer to the Arduino of the laptop's station
+    __table_args__ = (
+        db.UniqueConstraint('station_id', 'ultrasonic_sensor_index', name='uq_laptop_station_sensor'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     serial_number = db.Column(db.String(120), index=True, unique=True)
+    # Superseded by LaptopState.is_stolen, which status changes write and every status read uses
     is_stolen = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     readings = db.relationship('SensorReading', backref='laptop', lazy='dynamic', cascade="all, delete-orphan")
+    state = db.relationship('LaptopState', backref='laptop', uselist=False, cascade="all, delete-orphan")
+    rollups = db.relationship('SensorReadingRollup', backref='laptop', lazy='dynamic',
+                              cascade="all, delete-orphan", passive_deletes=True)
     
     # Updated iBeacon Columns for Data Integrity
     ibeacon_uuid = db.Column(db.String(36))
@@ -42,12 +77,15 @@ class Laptop(db.Model):
     # New Column for Ultrasonic Sensor Mapping
     ultrasonic_sensor_index = db.Column(db.Integer)
 
+    # The station whose Pi watches this laptop; None for single-Pi setups
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'), index=True)
+
     def __repr__(self):
         return f'<Laptop {self.name} - {self.serial_number}>'
 
 class SensorReading(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, index=True, nullable=False, default=datetime.utcnow)
     ibeacon_uuid = db.Column(db.String(36))
     ibeacon_major = db.Column(db.Integer)
     ibeacon_minor = db.Column(db.Integer)
@@ -65,14 +103,235 @@ class SensorReading(db.Model):
     
     laptop_id = db.Column(db.Integer, db.ForeignKey('laptop.id'))
 
+    # Which Pi sent the reading and its sequence number there, so a reading
+    # replayed from the Pi's offline spool is only stored once
+    source_id = db.Column(db.String(64))
+    source_seq = db.Column(db.BigInteger)
+
+    # The station that heard the laptop, which need not be the one it is assigned to
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'))
+
+    @staticmethod
+    def insert_many(rows):
+        """
+        Inserts readings as part of the caller's transaction, skipping any
+        whose (source_id, source_seq, timestamp) is already stored. Returns
+        the number of readings actually inserted.
+        """
+        insert = dialect_insert()
+        if insert is None:
+            db.session.execute(db.insert(SensorReading), rows)
+            return len(rows)
+        stmt = insert(SensorReading).on_conflict_do_nothing(
+            index_elements=['source_id', 'source_seq', 'timestamp']
+        ).returning(SensorReading.id)
+        return len(db.session.execute(stmt, rows).all())
+
+    @staticmethod
+    def stored_seqs(source_id, seqs):
+        """The sequence numbers among `seqs` already stored for `source_id`, whatever their timestamp."""
+        if not seqs:
+            return set()
+        return {seq for (seq,) in db.session.query(SensorReading.source_seq).filter(
+            SensorReading.source_id == source_id, SensorReading.source_seq.in_(seqs))}
+
     def __repr__(self):
         return f'<SensorReading {self.timestamp} from Laptop {self.laptop_id}>'
 
+# Every hot read picks one laptop's readings newest-first. On PostgreSQL the
+# index also carries the RSSI so the latest-reading lookups are index-only.
+db.Index(
+    'ix_sensor_reading_laptop_id_timestamp',
+    SensorReading.laptop_id,
+    SensorReading.timestamp.desc(),
+    postgresql_include=['ibeacon_rssi'],
+)
+
+# Per-station reads: when a station last reported and what it heard recently.
+db.Index(
+    'ix_sensor_reading_station_id_timestamp',
+    SensorReading.station_id,
+    SensorReading.timestamp.desc(),
+)
+
+# The timestamp is part of the key because unique indexes on the partitioned
+# PostgreSQL table must include the partition key.
+db.Index(
+    'ux_sensor_reading_source',
+    SensorReading.source_id,
+    SensorReading.source_seq,
+    SensorReading.timestamp,
+    unique=True,
+)
+
+class SensorReadingRollup(db.Model):
+    """
+    Per-minute or per-hour aggregate of one laptop's sensor readings. Rollups
+    outlive the raw sensor_reading rows, which are purged after a retention
+    window by the `flask maintain-readings` command.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('laptop_id', 'resolution', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    laptop_id = db.Column(db.Integer, db.ForeignKey('laptop.id', ondelete='CASCADE'), nullable=False)
+    resolution = db.Column(db.String(6), nullable=False) # 'minute' or 'hour'
+    bucket_start = db.Column(db.DateTime, nullable=False, index=True)
+    sample_count = db.Column(db.Integer, nullable=False)
+
+    rssi_min = db.Column(db.Integer)
+    rssi_max = db.Column(db.Integer)
+    rssi_avg = db.Column(db.Float)
+
+    distance_1_min_cm = db.Column(db.Float)
+    distance_1_max_cm = db.Column(db.Float)
+    distance_1_avg_cm = db.Column(db.Float)
+    distance_2_min_cm = db.Column(db.Float)
+    distance_2_max_cm = db.Column(db.Float)
+    distance_2_avg_cm = db.Column(db.Float)
+    distance_3_min_cm = db.Column(db.Float)
+    distance_3_max_cm = db.Column(db.Float)
+    distance_3_avg_cm = db.Column(db.Float)
+    distance_4_min_cm = db.Column(db.Float)
+    distance_4_max_cm = db.Column(db.Float)
+    distance_4_avg_cm = db.Column(db.Float)
+
+    intrusion_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SensorReadingRollup {self.resolution} {self.bucket_start} for Laptop {self.laptop_id}>'
+
+class RollupBacklog(db.Model):
+    """
+    Per rollup resolution, the oldest time whose source data changed after
+    it may already have been rolled up: readings that arrived late (replayed
+    from a Pi's spool) for minute rollups, minute rollups rebuilt for them
+    for hour rollups. The next maintenance pass rebuilds that resolution
+    from there. `version` goes up with every mark, so the pass only clears
+    the row if nothing more arrived while it ran.
+    """
+    resolution = db.Column(db.String(6), primary_key=True)
+    since = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    @staticmethod
+    def mark(resolution, since):
+        """Records that data from `since` on changed, as part of the caller's transaction."""
+        insert = dialect_insert()
+        if insert is None:
+            backlog = db.session.get(RollupBacklog, resolution, with_for_update=True)
+            if backlog is None:
+                db.session.add(RollupBacklog(resolution=resolution, since=since, version=1))
+            else:
+                backlog.since = min(backlog.since, since)
+                backlog.version += 1
+            return
+        stmt = insert(RollupBacklog).values(resolution=resolution, since=since, version=1)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['resolution'], set_={
+            'since': db.case((stmt.excluded.since < RollupBacklog.since, stmt.excluded.since),
+                             else_=RollupBacklog.since),
+            'version': RollupBacklog.version + 1,
+        }))
+
+    @staticmethod
+    def pending(resolution):
+        """The (since, version) row of `resolution`, or None if nothing is waiting."""
+        return db.session.query(RollupBacklog.since, RollupBacklog.version).filter_by(resolution=resolution).first()
+
+    @staticmethod
+    def clear(resolution, version):
+        """Drops the row unless it was marked again after `version` was read, as part of the caller's transaction."""
+        db.session.query(RollupBacklog).filter_by(resolution=resolution, version=version)\
+            .delete(synchronize_session=False)
+
+    def __repr__(self):
+        return f'<RollupBacklog {self.resolution} since {self.since}>'
+
+class LaptopState(db.Model):
+    """
+    Latest known state of a laptop, upserted in the same transaction as every
+    reading and status change so status reads never have to sort the ever
+    growing sensor_reading history.
+    """
+    laptop_id = db.Column(db.Integer, db.ForeignKey('laptop.id', ondelete='CASCADE'), primary_key=True)
+    last_rssi = db.Column(db.Integer)
+    last_distance_1_cm = db.Column(db.Float)
+    last_distance_2_cm = db.Column(db.Float)
+    last_distance_3_cm = db.Column(db.Float)
+    last_distance_4_cm = db.Column(db.Float)
+    last_seen = db.Column(db.DateTime)
+    ultrasonic_intrusion_detected = db.Column(db.Boolean, default=False)
+    is_stolen = db.Column(db.Boolean, default=False)
+
+    def __repr__(self):
+        return f'<LaptopState {self.laptop_id} seen {self.last_seen}>'
+
+    @staticmethod
+    def upsert(rows):
+        """
+        Inserts or updates laptop_state rows as part of the caller's transaction.
+        Every row is a dict with `laptop_id` and the same set of other columns;
+        if a laptop appears more than once the last row wins.
+        """
+        rows = list({row['laptop_id']: row for row in rows}.values())
+        if not rows:
+            return
+
+        insert = dialect_insert()
+        if insert is None:
+            for row in rows:
+                db.session.merge(LaptopState(**row))
+            return
+
+        stmt = insert(LaptopState)
+        where = None
+        if 'last_seen' in rows[0]:
+            # Readings replayed from a Pi's spool must not roll the state back
+            where = db.or_(LaptopState.last_seen.is_(None), stmt.excluded.last_seen >= LaptopState.last_seen)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[LaptopState.laptop_id],
+            set_={key: stmt.excluded[key] for key in rows[0] if key != 'laptop_id'},
+            where=where,
+        )
+        db.session.execute(stmt, rows)
+
 class Log(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     serial_number = db.Column(db.String(120), index=True)
     event_type = db.Column(db.String(20)) # e.g., 'stolen', 'returned'
+    # Set for events sent by the Pi, so an event replayed from its spool is only logged once
+    source_id = db.Column(db.String(64))
+    source_seq = db.Column(db.BigInteger)
+
+    __table_args__ = (db.UniqueConstraint('source_id', 'source_seq', name='uq_log_source'),)
+
+    def __repr__(self):
+        return f'<Log {self.serial_number} - {self.event_type} at {self.timestamp}>'
+
+class ConfigVersion(db.Model):
+    """
+    Single-row counter that is bumped whenever laptops are added or removed,
+    so every worker (and the Pi) can tell when its cached copy is stale.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def current():
+        return db.session.query(ConfigVersion.version).filter_by(id=1).scalar() or 0
+
+    @staticmethod
+    def bump():
+        """Increments the version as part of the caller's transaction."""
+        updated = ConfigVersion.query.filter_by(id=1).update(
+            {ConfigVersion.version: ConfigVersion.version + 1, ConfigVersion.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        if not updated:
+            db.session.add(ConfigVersion(id=1, version=1))
 
     def __repr__(self):
-        return f'<Log {self.serial_number} - {self.event_type} at {self.timestamp}>'
\ No newline at end of file
+        return f'<ConfigVersion {self.version}>'
@@ -0,0 +1,121 @@
+import re
+from datetime import datetime, timedelta
+from app import db
+
+# sensor_reading is range partitioned by timestamp on PostgreSQL (see
+# migration c7e2a9f05d18). Each partition is named after the days it holds:
+# sensor_reading_pYYYYMMDD for one day, sensor_reading_pYYYYMMDD_YYYYMMDD for
+# the coarse partitions the migration put older history in (end exclusive).
+# Rows outside every partition land in the DEFAULT partition.
+PARTITIONED_TABLE = 'sensor_reading'
+DEFAULT_PARTITION = 'sensor_reading_default'
+PARTITION_NAME = re.compile(r'^sensor_reading_p(\d{8})(?:_(\d{8}))?$')
+
+
+def partition_name(day):
+    return f'{PARTITIONED_TABLE}_p{day:%Y%m%d}'
+
+
+def _parse_day(text):
+    return datetime.strptime(text, '%Y%m%d').date()
+
+
+def _day_start(day):
+    return datetime.combine(day, datetime.min.time())
+
+
+def is_partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return bool(db.session.execute(db.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"
+    ), {'table': PARTITIONED_TABLE}).scalar())
+
+
+def list_partitions():
+    """Returns (first day, day after the last, name) for every partition but DEFAULT, oldest first."""
+    names = db.session.execute(db.text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.oid = to_regclass(:table)"
+    ), {'table': PARTITIONED_TABLE}).scalars()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            start = _parse_day(match.group(1))
+            end = _parse_day(match.group(2)) if match.group(2) else start + timedelta(days=1)
+            partitions.append((start, end, name))
+    return sorted(partitions)
+
+
+def create_partition(day):
+    """
+    Creates the partition for `day`. Readings of that day that arrived before
+    it existed (a Pi clock running ahead) sit in the DEFAULT partition, and
+    PostgreSQL refuses the new partition while they do: DEFAULT is then
+    detached, the partition created, those rows moved into it and DEFAULT
+    attached again, all in the caller's transaction.
+    """
+    start, end = _day_start(day), _day_start(day + timedelta(days=1))
+    create = (f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF {PARTITIONED_TABLE} "
+              f"FOR VALUES FROM ('{start.date().isoformat()}') TO ('{end.date().isoformat()}')")
+    stray = db.session.execute(db.text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end)"
+    ), {'start': start, 'end': end}).scalar()
+    if not stray:
+        db.session.execute(db.text(create))
+        return
+    db.session.execute(db.text(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+    db.session.execute(db.text(create))
+    db.session.execute(db.text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end "
+        f"RETURNING *) INSERT INTO {PARTITIONED_TABLE} SELECT * FROM moved"
+    ), {'start': start, 'end': end})
+    db.session.execute(db.text(f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+def create_partitions_ahead(days_ahead, today=None):
+    """Makes sure a partition exists for today and each of the next `days_ahead` days."""
+    today = today or datetime.utcnow().date()
+    partitions = list_partitions()
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        if not any(start <= day < end for start, end, _ in partitions):
+            create_partition(day)
+            db.session.commit()
+            created.append(partition_name(day))
+    return created
+
+
+def drop_partitions_before(cutoff):
+    """
+    Drops every partition whose whole range lies before `cutoff`. Unlike a
+    DELETE this is O(1) per partition and leaves nothing behind to vacuum.
+    """
+    dropped = []
+    for _, end, name in list_partitions():
+        if _day_start(end) > cutoff:
+            break
+        db.session.execute(db.text(f'DROP TABLE {name}'))
+        db.session.commit()
+        dropped.append(name)
+    return dropped
+
+
+def count_default_rows():
+    return db.session.execute(db.text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar()
+
+
+def purge_default_before(cutoff):
+    """
+    Deletes the rows of the DEFAULT partition older than `cutoff`, which no
+    partition drop ever reaches. Returns the number of rows deleted.
+    """
+    result = db.session.execute(db.text(
+        f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < :cutoff"
+    ), {'cutoff': cutoff})
+    db.session.commit()
+    return result.rowcount
@@ -1,27 +1,123 @@
-from flask import render_template, flash, redirect, url_for, request, jsonify, current_app
+from flask import render_template, flash, redirect, url_for, request, jsonify, current_app, Response, abort
 from flask_login import current_user, login_user, logout_user, login_required
 from app import app, db
 from app.forms import LoginForm, RegistrationForm, LaptopForm
-from app.models import User, Laptop, SensorReading, Log
-from app.ibeacon_scanner import scan_for_ibeacons
+from app.models import (User, Laptop, SensorReading, LaptopState, Log, ConfigVersion, Station, RollupBacklog,
+                        dialect_insert)
+from app.laptop_cache import laptop_cache
+from app.live_feed import live_feed, sse_message
+from app.config_watch import config_watcher
+from app.beacon_scan import scan_jobs, ScannerBusy
+from app.sensor_control import sensor_control
+from app.metrics import metrics, scrape_refusal, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.access import parse_networks, refusal
+from sqlalchemy.exc import IntegrityError
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
-import asyncio
-import subprocess
-import os
-import sys
 import pytz
 
-# Global variable to hold the script's process object
-sensor_script_process = None
+# Fields every reading posted by the Pi must carry
+SENSOR_DATA_REQUIRED_FIELDS = ['serial_number', 'ibeacon_rssi', 'ultrasonic_distances']
+
+# Fields of a laptop status entry, in the order used by the columnar format
+LAPTOP_STATUS_FIELDS = ['id', 'serial_number', 'is_stolen', 'last_rssi', 'last_seen']
+
+# Readings older than this (replayed from a Pi's offline spool) are stored but not pushed to live dashboards
+LIVE_READING_MAX_AGE = timedelta(minutes=1)
+
+# Addresses that may read /api/config without CONFIG_TOKEN
+CONFIG_ALLOWED_NETWORKS = parse_networks(app.config['CONFIG_ALLOWED_NETWORKS'])
 
 @app.route('/')
 @app.route('/index')
 @login_required
 def index():
-    laptops = current_user.laptops.all()
-    is_script_running = sensor_script_process is not None and sensor_script_process.poll() is None
-    return render_template('index.html', title='Dashboard', laptops=laptops, db=db, SensorReading=SensorReading, is_script_running=is_script_running)
+    laptops, next_after = laptop_page(current_user.id)
+    stations = station_summary(current_user.id)
+    sensor_status = sensor_control.status()
+    return render_template('index.html', title='Dashboard', laptops=laptops, next_after=next_after,
+                           stations=stations, sensor_status=sensor_status,
+                           is_script_running=sensor_status['state'] != 'stopped')
+
+@app.route('/index/laptops')
+@login_required
+def laptop_cards():
+    """Renders the dashboard cards that follow laptop id `after`, for lazy loading."""
+    after = request.args.get('after', type=int)
+    laptops, next_after = laptop_page(current_user.id, after=after)
+    html = ''.join(
+        render_template('_laptop_card.html', laptop=laptop, is_stolen=is_stolen, last_rssi=last_rssi,
+                        last_seen=last_seen)
+        for laptop, is_stolen, last_rssi, last_seen in laptops
+    )
+    return jsonify({'html': html, 'next_after': next_after})
+
+def laptop_page(user_id, after=None):
+    """
+    One keyset page of a user's laptops ordered by id, each with its stolen
+    status, last RSSI and last seen time, plus the `after` value for the next page (None on the
+    last page). Laptops and their live state come from a single query.
+    """
+    page_size = app.config['LAPTOPS_PER_PAGE']
+    criteria = [Laptop.user_id == user_id]
+    if after is not None:
+        criteria.append(Laptop.id > after)
+
+    rows = db.session.query(Laptop, LaptopState.is_stolen, LaptopState.last_rssi, LaptopState.last_seen)\
+        .outerjoin(LaptopState)\
+        .filter(*criteria)\
+        .order_by(Laptop.id)\
+        .limit(page_size + 1)\
+        .all()
+
+    next_after = rows[page_size - 1][0].id if len(rows) > page_size else None
+    return rows[:page_size], next_after
+
+def station_summary(user_id):
+    """
+    Per station: how many of the user's laptops it watches, how many of them
+    are stolen and how many were heard in the last STATION_ONLINE_SECONDS,
+    plus when the station last sent any reading. Laptops without a station
+    are summed up in a final entry with id None, and the list is empty when
+    the user has no laptop on a station. Counts come from one GROUP BY over
+    laptop_state; last reports are read off the (station_id, timestamp) index.
+    """
+    online_since = datetime.utcnow() - timedelta(seconds=app.config['STATION_ONLINE_SECONDS'])
+    counts = db.session.query(
+        Laptop.station_id,
+        db.func.count(Laptop.id),
+        db.func.count(db.case((LaptopState.is_stolen.is_(True), 1))),
+        db.func.count(db.case((LaptopState.last_seen >= online_since, 1))),
+    ).outerjoin(LaptopState)\
+        .filter(Laptop.user_id == user_id)\
+        .group_by(Laptop.station_id)\
+        .all()
+    counts = {station_id: rest for station_id, *rest in counts}
+    if not any(station_id is not None for station_id in counts):
+        return []
+
+    last_report = db.session.query(db.func.max(SensorReading.timestamp))\
+        .filter(SensorReading.station_id == Station.id)\
+        .correlate(Station)\
+        .scalar_subquery()
+    stations = [tuple(row) for row in db.session.query(Station.id, Station.name, last_report)
+                .filter(Station.id.in_([station_id for station_id in counts if station_id is not None]))
+                .order_by(Station.name)]
+    if None in counts:
+        stations.append((None, None, None))
+    return [{
+        'id': station_id,
+        'name': name,
+        'laptops': counts[station_id][0],
+        'stolen': counts[station_id][1],
+        'online': counts[station_id][2],
+        'last_report': format_timestamp(last_report) if last_report else None,
+    } for station_id, name, last_report in stations]
+
+@app.route('/api/stations', methods=['GET'])
+@login_required
+def get_station_summary():
+    return jsonify({'stations': station_summary(current_user.id)})
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -73,13 +169,19 @@ def register():
 def add_laptop():
     form = LaptopForm()
     
+    stations = Station.query.order_by(Station.name).all()
+    form.station_id.choices = [(0, 'No station')] + [(station.id, station.name) for station in stations]
+
     # Logic to populate the ultrasonic sensor choices for the form
-    used_sensors = db.session.query(Laptop.ultrasonic_sensor_index).filter(
-        Laptop.ultrasonic_sensor_index.isnot(None)
-    ).all()
-    used_sensor_indices = {s[0] for s in used_sensors}
-    
-    available_indices = [i for i in range(4) if i not in used_sensor_indices]
+    if stations:
+        # Every station has its own Arduino, so any sensor may be free; the form checks the chosen station
+        available_indices = range(4)
+    else:
+        used_sensors = db.session.query(Laptop.ultrasonic_sensor_index).filter(
+            Laptop.ultrasonic_sensor_index.isnot(None)
+        ).all()
+        used_sensor_indices = {s[0] for s in used_sensors}
+        available_indices = [i for i in range(4) if i not in used_sensor_indices]
     form.ultrasonic_sensor_index.choices = [(i, f'Sensor {i}') for i in available_indices]
 
     if form.validate_on_submit():
@@ -101,25 +203,20 @@ def add_laptop():
                 ibeacon_major=int(major),
                 ibeacon_minor=int(minor),
                 ibeacon_mac_address=mac_address,
-                ultrasonic_sensor_index=ultrasonic_sensor_index 
+                ultrasonic_sensor_index=ultrasonic_sensor_index,
+                station_id=form.station_id.data or None,
+                state=LaptopState(is_stolen=False)
             )
             db.session.add(laptop)
+            ConfigVersion.bump()
             db.session.commit()
+            laptop_cache.invalidate()
+            config_watcher.notify()
 
             if rssi:
-                initial_reading = SensorReading(
-                    ibeacon_uuid=uuid,
-                    ibeacon_major=int(major),
-                    ibeacon_minor=int(minor),
-                    ibeacon_rssi=int(rssi),
-                    ibeacon_mac_address=mac_address,
-                    ultrasonic_distance_1_cm=0.0,
-                    ultrasonic_distance_2_cm=0.0,
-                    ultrasonic_distance_3_cm=0.0,
-                    ultrasonic_distance_4_cm=0.0,
-                    laptop_id=laptop.id
-                )
-                db.session.add(initial_reading)
+                initial_reading = sensor_reading_values(laptop, int(rssi), [0.0, 0.0, 0.0, 0.0], datetime.utcnow())
+                db.session.add(SensorReading(**initial_reading))
+                LaptopState.upsert([laptop_state_values(initial_reading)])
                 db.session.commit()
 
             flash(f"Laptop '{laptop.name}' has been added!", 'success')
@@ -133,24 +230,80 @@ def add_laptop():
 @app.route('/scan_ibeacons', methods=['POST'])
 @login_required
 def scan_ibeacons():
+    """
+    Starts an iBeacon scan in the background and returns its job id at once.
+    Beacons already tagged on a laptop are skipped while scanning. An optional
+    JSON body {"limit": N} ends the scan once N beacons were found.
+    """
+    limit = (request.get_json(silent=True) or {}).get('limit')
+    if limit is not None and (not isinstance(limit, int) or limit < 1):
+        return jsonify({'success': False, 'message': 'limit must be a positive integer'}), 400
+
+    used = db.session.query(Laptop.ibeacon_uuid, Laptop.ibeacon_major, Laptop.ibeacon_minor).all()
+    db.session.remove()
     try:
-        used = db.session.query(Laptop.ibeacon_uuid, Laptop.ibeacon_major, Laptop.ibeacon_minor).all()
-        used_set = set(used)
-        beacons_found = asyncio.run(scan_for_ibeacons(scan_duration=10))
-
-        available_beacons = [
-            b for b in beacons_found
-            if (b['uuid'], b['major'], b['minor']) not in used_set
-        ]
-
-        if available_beacons:
-            print(f"Found {len(beacons_found)} beacons, {len(available_beacons)} are available.")
-            return jsonify({'success': True, 'beacons': available_beacons})
-        else:
-            return jsonify({'success': False, 'message': 'No new iBeacons found.'})
-    except Exception as e:
-        current_app.logger.error(f"Error scanning for iBeacons: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
+        job = scan_jobs.start(current_user.id, app.config['BEACON_SCAN_SECONDS'], limit=limit, exclude=used)
+    except ScannerBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'events': url_for('scan_ibeacons_events', job_id=job.id),
+        'stop': url_for('stop_scan_ibeacons', job_id=job.id),
+    }), 202
+
+@app.route('/scan_ibeacons/<job_id>', methods=['GET'])
+@login_required
+def scan_ibeacons_status(job_id):
+    job = scan_jobs.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'error': 'Scan not found'}), 404
+    return jsonify(job.summary())
+
+@app.route('/scan_ibeacons/<job_id>/events')
+@login_required
+def scan_ibeacons_events(job_id):
+    """
+    Server-sent event stream of a scan: a "beacon" event per beacon as it is
+    found, then one "done" event with how the scan ended, every beacon's RSSI
+    statistics over the scan and the scan's callback counters. A reconnecting
+    EventSource resumes after the last beacon it received.
+    """
+    job = scan_jobs.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'error': 'Scan not found'}), 404
+    try:
+        seen = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        seen = 0
+    keepalive = app.config['LIVE_FEED_KEEPALIVE_SECONDS']
+
+    def generate():
+        count = seen
+        while True:
+            beacons, state, reason = job.poll(count, timeout=keepalive)
+            for beacon in beacons:
+                count += 1
+                yield sse_message(beacon, event='beacon', event_id=str(count))
+            if state != 'running':
+                summary = job.summary()
+                yield sse_message({'state': state, 'reason': reason, 'count': count, 'beacons': summary['beacons'],
+                                   'scan': summary['scan']}, event='done')
+                return
+            if not beacons:
+                yield ': keepalive\n\n'
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/scan_ibeacons/<job_id>/stop', methods=['POST'])
+@login_required
+def stop_scan_ibeacons(job_id):
+    job = scan_jobs.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'error': 'Scan not found'}), 404
+    job.stop()
+    return jsonify({'success': True})
 
 @app.route('/delete_laptop/<int:laptop_id>', methods=['POST'])
 @login_required
@@ -161,7 +314,10 @@ def delete_laptop(laptop_id):
         return redirect(url_for('index'))
 
     db.session.delete(laptop)
+    ConfigVersion.bump()
     db.session.commit()
+    laptop_cache.invalidate()
+    config_watcher.notify()
     flash('Laptop has been deleted.', 'success')
     return redirect(url_for('index'))
 
@@ -169,44 +325,303 @@ def delete_laptop(laptop_id):
 @login_required
 def laptop_details(laptop_id):
     laptop = Laptop.query.filter_by(id=laptop_id, user_id=current_user.id).first_or_404()
-    last_reading = SensorReading.query.filter_by(laptop_id=laptop_id).order_by(db.desc(SensorReading.timestamp)).first()
-    return render_template('laptop_details.html', title='Laptop Details', laptop=laptop, last_reading=last_reading)
+    return render_template('laptop_details.html', title='Laptop Details', laptop=laptop, state=laptop.state)
+
+@app.route('/api/config', methods=['GET'])
+def get_config():
+    """
+    The laptops a Pi watches: every laptop, or with ?station=NAME only that
+    station's. The response carries the config version as its ETag, and a
+    request whose If-None-Match still matches gets 304 Not Modified. Adding
+    ?wait=SECONDS turns that into a long-poll: the request is held until the
+    config changes or the time is up, so a Pi learns about added and removed
+    laptops straight away without re-downloading the list in between.
+
+    Only Pis may read it: see CONFIG_TOKEN and CONFIG_ALLOWED_NETWORKS in
+    config.py.
+    """
+    denied = refusal(request, app.config['CONFIG_TOKEN'], CONFIG_ALLOWED_NETWORKS)
+    if denied is not None:
+        message, status = denied
+        headers = {'WWW-Authenticate': 'Bearer'} if status == 401 else {}
+        return jsonify({'error': message}), status, headers
+    station = request.args.get('station')
+    wait = min(max(request.args.get('wait', 0.0, type=float), 0.0), app.config['CONFIG_WAIT_MAX_SECONDS'])
+
+    query = db.session.query(Laptop.serial_number, Laptop.ibeacon_mac_address, Laptop.ultrasonic_sensor_index)
+    if station:
+        station_id = db.session.query(Station.id).filter_by(name=station).scalar()
+        if station_id is None:
+            return jsonify({'error': f'Unknown station {station!r}'}), 404
+        query = query.filter(Laptop.station_id == station_id)
+
+    # Read the version before the laptops: a change in between is then sent
+    # under the older ETag and simply fetched once more, never missed
+    version = ConfigVersion.current()
+    if wait and request.if_none_match.contains(str(version)):
+        version = config_watcher.wait(version, wait)
+    if request.if_none_match.contains(str(version)):
+        return Response(status=304, headers={'ETag': f'"{version}"', 'Cache-Control': 'no-cache'})
+
+    response = jsonify({
+        'version': version,
+        'station': station,
+        'laptops': [{
+            'serial_number': serial_number,
+            'ibeacon_mac_address': mac_address,
+            'ultrasonic_sensor_index': sensor_index,
+        } for serial_number, mac_address, sensor_index in query.order_by(Laptop.id)],
+    })
+    response.set_etag(str(version))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/sensor_data', methods=['POST'])
 def receive_sensor_data():
     try:
         data = request.get_json()
-        required = ['serial_number', 'ibeacon_rssi', 'ultrasonic_distances']
-        if not all(field in data for field in required):
+        if not all(field in data for field in SENSOR_DATA_REQUIRED_FIELDS):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        laptop = Laptop.query.filter_by(serial_number=data['serial_number']).first()
+        laptop = laptop_cache.get_by_serial(data['serial_number'])
         if not laptop:
             return jsonify({'error': 'Laptop not found'}), 404
 
-        distances = data.get('ultrasonic_distances', [0.0, 0.0, 0.0, 0.0])
-        new_reading = SensorReading(
-            ibeacon_uuid=laptop.ibeacon_uuid,
-            ibeacon_major=laptop.ibeacon_major,
-            ibeacon_minor=laptop.ibeacon_minor,
-            ibeacon_rssi=data['ibeacon_rssi'],
-            ultrasonic_distance_1_cm=distances[0],
-            ultrasonic_distance_2_cm=distances[1],
-            ultrasonic_distance_3_cm=distances[2],
-            ultrasonic_distance_4_cm=distances[3],
-            laptop_id=laptop.id
-        )
-
-        db.session.add(new_reading)
-        db.session.commit()
+        now = datetime.utcnow()
+        try:
+            seq = int(data['seq']) if data.get('source_id') and data.get('seq') is not None else None
+            timestamp = parse_captured_at(data.get('captured_at'), now)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid captured_at or seq'}), 400
+
+        distances = data['ultrasonic_distances']
+        if not isinstance(distances, list) or len(distances) != 4:
+            return jsonify({'error': 'ultrasonic_distances must hold 4 values'}), 400
+
+        values = sensor_reading_values(laptop, data['ibeacon_rssi'], distances, timestamp,
+                                       data.get('ultrasonic_intrusion_detected', False),
+                                       source_id=data['source_id'] if seq is not None else None, source_seq=seq,
+                                       station_id=station_id_of(data.get('station')))
+
+        try:
+            inserted = store_readings([values])
+        except IntegrityError:
+            db.session.rollback()
+            if deleted_laptops([laptop]):
+                return jsonify({'error': 'Laptop not found'}), 404
+            raise
+        metrics.readings_ingested(inserted)
+        if now - timestamp <= LIVE_READING_MAX_AGE:
+            live_feed.publish(laptop.user_id, laptop.id, last_rssi=data['ibeacon_rssi'], last_seen=format_timestamp(timestamp))
 
         # check_security_status(laptop, new_reading)  # Optional logic
         return jsonify({'message': 'Sensor data received successfully'}), 200
 
     except Exception as e:
+        db.session.rollback()
         app.logger.error(f"Error processing sensor data: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/sensor_data/batch', methods=['POST'])
+def receive_sensor_data_batch():
+    """
+    Stores one scan tick worth of readings for many laptops at once.
+
+    Expects {"readings": [{serial_number, ibeacon_rssi, ultrasonic_distances}, ...]}.
+    All serial numbers are resolved with a single query and every valid reading
+    is inserted, and its laptop's live state upserted, in one transaction. The response lists a status for each item,
+    in the same order as the request.
+
+    A Pi also sends a top-level "source_id" and, per reading, its "seq" and
+    "captured_at" (ISO 8601, UTC). When it replays its offline spool it adds
+    "replayed": true, and readings already stored under the same source_id
+    and seq are skipped, so a batch can safely be sent again. A Pi that
+    belongs to a station sends its name as "station".
+    """
+    data = request.get_json(silent=True)
+    items = data.get('readings') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a JSON object with a "readings" list'}), 400
+    if len(items) > app.config['SENSOR_BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"Batch exceeds {app.config['SENSOR_BATCH_MAX_ITEMS']} readings"}), 413
+    source_id = data.get('source_id')
+    if source_id is not None and (not isinstance(source_id, str) or not 0 < len(source_id) <= 64):
+        return jsonify({'error': 'source_id must be a string of at most 64 characters'}), 400
+
+    try:
+        serials = {item.get('serial_number') for item in items if isinstance(item, dict)}
+        serials.discard(None)
+        laptops = laptop_cache.get_many_by_serial(serials)
+        station_id = station_id_of(data.get('station'))
+
+        now = datetime.utcnow()
+        rows = []
+        results = []
+        for item in items:
+            if not isinstance(item, dict) or not all(field in item for field in SENSOR_DATA_REQUIRED_FIELDS):
+                results.append({'serial_number': item.get('serial_number') if isinstance(item, dict) else None,
+                                'status': 'error', 'error': 'Missing required fields'})
+                continue
+
+            serial_number = item['serial_number']
+            laptop = laptops.get(serial_number)
+            if laptop is None:
+                results.append({'serial_number': serial_number, 'status': 'error', 'error': 'Laptop not found'})
+                continue
+
+            distances = item['ultrasonic_distances']
+            if not isinstance(distances, list) or len(distances) != 4:
+                results.append({'serial_number': serial_number, 'status': 'error',
+                                'error': 'ultrasonic_distances must hold 4 values'})
+                continue
+
+            try:
+                seq = int(item['seq']) if source_id is not None and item.get('seq') is not None else None
+                timestamp = parse_captured_at(item.get('captured_at'), now)
+            except (TypeError, ValueError):
+                results.append({'serial_number': serial_number, 'status': 'error',
+                                'error': 'Invalid captured_at or seq'})
+                continue
+
+            rows.append(sensor_reading_values(laptop, item['ibeacon_rssi'], distances, timestamp,
+                                              item.get('ultrasonic_intrusion_detected', False),
+                                              source_id=source_id if seq is not None else None, source_seq=seq,
+                                              station_id=station_id))
+            results.append({'serial_number': serial_number, 'status': 'ok'})
+
+        if rows and source_id is not None and data.get('replayed') is True:
+            # A Pi clock ahead of ours gets its readings capped at our time, so a
+            # replay need not carry the timestamp the reading was first stored with
+            stored = SensorReading.stored_seqs(source_id, [row['source_seq'] for row in rows
+                                                           if row['source_seq'] is not None])
+            rows = [row for row in rows if row['source_seq'] not in stored]
+
+        if rows:
+            try:
+                inserted = store_readings(rows)
+            except IntegrityError:
+                # Laptops deleted since they were cached: reject their readings and store the rest
+                db.session.rollback()
+                gone = deleted_laptops(laptops.values())
+                if not gone:
+                    raise
+                rows = [row for row in rows if row['laptop_id'] not in gone]
+                for result in results:
+                    if result['status'] == 'ok' and laptops[result['serial_number']].id in gone:
+                        result.update(status='error', error='Laptop not found')
+                inserted = store_readings(rows) if rows else 0
+            metrics.readings_ingested(inserted)
+            newest = {row['laptop_id']: row for row in rows}
+            user_ids = {laptop.id: laptop.user_id for laptop in laptops.values()}
+            for laptop_id, row in newest.items():
+                if now - row['timestamp'] <= LIVE_READING_MAX_AGE:
+                    live_feed.publish(user_ids[laptop_id], laptop_id, last_rssi=row['ibeacon_rssi'],
+                                      last_seen=format_timestamp(row['timestamp']))
+
+        accepted = sum(result['status'] == 'ok' for result in results)
+        return jsonify({'accepted': accepted, 'rejected': len(items) - accepted, 'results': results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error processing sensor data batch: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def store_readings(rows):
+    """
+    Inserts new readings and refreshes their laptops' live state, in one
+    transaction. Returns the number of readings inserted, which leaves out
+    replays of readings already stored.
+    """
+    inserted = SensorReading.insert_many(rows)
+    # Oldest first, so the newest reading of each laptop wins the state upsert
+    rows.sort(key=lambda row: row['timestamp'])
+    LaptopState.upsert([laptop_state_values(row) for row in rows])
+    # Rollups only look back SENSOR_ROLLUP_LOOKBACK_MINUTES by themselves; have them rebuilt from anything older
+    rollup_lookback = timedelta(minutes=app.config['SENSOR_ROLLUP_LOOKBACK_MINUTES'])
+    if inserted and rows[0]['timestamp'] < datetime.utcnow() - rollup_lookback:
+        RollupBacklog.mark('minute', rows[0]['timestamp'])
+    db.session.commit()
+    return inserted
+
+def deleted_laptops(identities):
+    """
+    Ids of the laptops among `identities` (taken from the laptop cache) that
+    no longer exist; a write referencing one fails its foreign key. Those
+    are dropped from the cache, so the next request sees them as unknown.
+    """
+    identities = list(identities)
+    existing = {laptop_id for (laptop_id,) in db.session.query(Laptop.id)
+                .filter(Laptop.id.in_([identity.id for identity in identities]))}
+    gone = set()
+    for identity in identities:
+        if identity.id not in existing:
+            laptop_cache.discard(identity)
+            gone.add(identity.id)
+    return gone
+
+def station_id_of(name):
+    """
+    The id of the station a Pi named in its request. An unknown name is logged
+    and the reading kept without a station rather than rejected, which would
+    make a misconfigured Pi discard its spool.
+    """
+    if not name:
+        return None
+    station_id = laptop_cache.get_station_id(name)
+    if station_id is None:
+        app.logger.warning(f"Reading from unknown station {name!r}")
+    return station_id
+
+def parse_captured_at(value, now):
+    """
+    The time a Pi captured a reading, as naive UTC. Missing means the reading
+    is live; times in the future (a Pi clock ahead of ours) are capped at now.
+    """
+    if value is None:
+        return now
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+    return min(timestamp, now)
+
+def sensor_reading_values(laptop, rssi, distances, timestamp, intrusion_detected=False, source_id=None, source_seq=None,
+                          station_id=None):
+    """Column values for a new SensorReading taken from a laptop's beacon and one tick of data."""
+    return {
+        'timestamp': timestamp,
+        'ibeacon_uuid': laptop.ibeacon_uuid,
+        'ibeacon_major': laptop.ibeacon_major,
+        'ibeacon_minor': laptop.ibeacon_minor,
+        'ibeacon_mac_address': laptop.ibeacon_mac_address,
+        'ibeacon_rssi': rssi,
+        'ultrasonic_distance_1_cm': distances[0],
+        'ultrasonic_distance_2_cm': distances[1],
+        'ultrasonic_distance_3_cm': distances[2],
+        'ultrasonic_distance_4_cm': distances[3],
+        'ultrasonic_intrusion_detected': bool(intrusion_detected),
+        'laptop_id': laptop.id,
+        'source_id': source_id,
+        'source_seq': source_seq,
+        'station_id': station_id,
+    }
+
+def laptop_state_values(reading):
+    """
+    The laptop_state columns refreshed by a new reading (as built by
+    sensor_reading_values). A reading stamped ahead of our clock counts as
+    seen now, so it can't hold back the readings that follow it.
+    """
+    return {
+        'laptop_id': reading['laptop_id'],
+        'last_rssi': reading['ibeacon_rssi'],
+        'last_distance_1_cm': reading['ultrasonic_distance_1_cm'],
+        'last_distance_2_cm': reading['ultrasonic_distance_2_cm'],
+        'last_distance_3_cm': reading['ultrasonic_distance_3_cm'],
+        'last_distance_4_cm': reading['ultrasonic_distance_4_cm'],
+        'last_seen': min(reading['timestamp'], datetime.utcnow()),
+        'ultrasonic_intrusion_detected': reading['ultrasonic_intrusion_detected'],
+    }
+
 def check_security_status(laptop, reading):
     rssi_threshold = -80
     ultrasonic_threshold = 200
@@ -220,13 +635,15 @@ def check_security_status(laptop, reading):
 @app.route('/api/latest_reading/<int:laptop_id>', methods=['GET'])
 @login_required
 def get_latest_reading(laptop_id):
-    laptop = Laptop.query.filter_by(id=laptop_id, owner=current_user).first_or_404()
-    last_reading = SensorReading.query.filter_by(laptop_id=laptop.id).order_by(db.desc(SensorReading.timestamp)).first()
+    state = db.session.query(Laptop.id, LaptopState.last_rssi, LaptopState.last_seen)\
+        .outerjoin(LaptopState)\
+        .filter(Laptop.id == laptop_id, Laptop.user_id == current_user.id)\
+        .first_or_404()
 
-    if last_reading:
+    if state.last_seen:
         return jsonify({
-            'rssi': last_reading.ibeacon_rssi,
-            'timestamp': last_reading.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+            'rssi': state.last_rssi,
+            'timestamp': format_timestamp(state.last_seen)
         })
     else:
         return jsonify({'rssi': 'N/A', 'timestamp': 'N/A'})
@@ -239,27 +656,125 @@ def update_laptop_status(serial_number):
     if is_stolen is None:
         return jsonify({"message": "Invalid status provided"}), 400
 
-    laptop = Laptop.query.filter_by(serial_number=serial_number).first()
+    laptop = laptop_cache.get_by_serial(serial_number)
     if not laptop:
         return jsonify({"message": "Laptop not found"}), 404
 
-    laptop.is_stolen = is_stolen
-    db.session.commit()
+    try:
+        LaptopState.upsert([{'laptop_id': laptop.id, 'is_stolen': bool(is_stolen)}])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if deleted_laptops([laptop]):
+            return jsonify({"message": "Laptop not found"}), 404
+        raise
+    live_feed.publish(laptop.user_id, laptop.id, is_stolen=bool(is_stolen))
 
     return jsonify({"message": f"Laptop {serial_number} stolen status updated to {is_stolen}"}), 200
 
 @app.route('/api/laptop_status/<int:laptop_id>', methods=['GET'])
 def get_laptop_status(laptop_id):
-    laptop = Laptop.query.get_or_404(laptop_id)
-    last_reading = laptop.readings.order_by(db.desc(SensorReading.timestamp)).first()
+    statuses = laptop_statuses(Laptop.id == laptop_id)
+    if not statuses:
+        abort(404)
+    return jsonify(statuses[0])
 
-    return jsonify({
-        "id": laptop.id,
-        "serial_number": laptop.serial_number,
-        "is_stolen": laptop.is_stolen,
-        "last_rssi": last_reading.ibeacon_rssi if last_reading else None,
-        "last_seen": last_reading.timestamp.strftime('%Y-%m-%d %H:%M:%S') if last_reading else None,
-    })
+@app.route('/api/laptop_status', methods=['GET'])
+@login_required
+def get_laptop_statuses():
+    """
+    Status of several of the current user's laptops in one request.
+
+    `ids` selects laptops (comma separated and/or repeated); without it every
+    laptop of the user is returned. `format=columnar` returns one list per
+    field instead of one object per laptop, which is much smaller for big fleets.
+    """
+    criteria = [Laptop.user_id == current_user.id]
+    raw_ids = [i for value in request.args.getlist('ids') for i in value.split(',') if i.strip()]
+    if raw_ids:
+        try:
+            criteria.append(Laptop.id.in_([int(i) for i in raw_ids]))
+        except ValueError:
+            return jsonify({"error": "ids must be integers"}), 400
+
+    statuses = laptop_statuses(*criteria)
+    if request.args.get('format') == 'columnar':
+        columns = {field: [status[field] for status in statuses] for field in LAPTOP_STATUS_FIELDS}
+        return jsonify({"count": len(statuses), "columns": columns})
+    return jsonify({"count": len(statuses), "laptops": statuses})
+
+def laptop_statuses(*criteria):
+    """
+    Status, last RSSI and last seen time of every laptop matching `criteria`,
+    read together with each laptop's live state in a single query.
+    """
+    rows = db.session.query(
+        Laptop.id, Laptop.serial_number, db.func.coalesce(LaptopState.is_stolen, False).label('is_stolen'),
+        LaptopState.last_rssi, LaptopState.last_seen
+    ).outerjoin(LaptopState)\
+        .filter(*criteria)\
+        .order_by(Laptop.id)\
+        .all()
+
+    return [{
+        "id": row.id,
+        "serial_number": row.serial_number,
+        "is_stolen": row.is_stolen,
+        "last_rssi": row.last_rssi,
+        "last_seen": format_timestamp(row.last_seen) if row.last_seen else None,
+    } for row in rows]
+
+def format_timestamp(timestamp):
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+@app.route('/api/live')
+@login_required
+def live_stream():
+    """
+    Server-sent event stream of status/RSSI changes for the current user's laptops.
+
+    A new connection (or one whose Last-Event-ID can no longer be resumed) first
+    receives a "snapshot" event with every laptop; after that only "laptop"
+    events carrying the fields that changed are sent.
+    """
+    user_id = current_user.id
+    seq = live_feed.parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('cursor'))
+    backlog = None
+    if seq is not None:
+        backlog, seq = live_feed.events_since(user_id, seq)
+
+    snapshot = None
+    if backlog is None:
+        # Take the cursor before reading the database so nothing published in
+        # between is lost; replaying an already applied change is harmless.
+        seq = live_feed.seq
+        snapshot = laptop_statuses(Laptop.user_id == user_id)
+        db.session.remove()
+
+    keepalive = app.config['LIVE_FEED_KEEPALIVE_SECONDS']
+
+    def generate():
+        last_seq = seq
+        if snapshot is not None:
+            yield sse_message(snapshot, event='snapshot', event_id=live_feed.cursor(last_seq))
+        for event_seq, payload in backlog or []:
+            yield sse_message(payload, event='laptop', event_id=live_feed.cursor(event_seq))
+
+        while True:
+            live_feed.wait(last_seq, timeout=keepalive)
+            events, newest = live_feed.events_since(user_id, last_seq)
+            if events is None:
+                # This client fell too far behind; the browser reconnects on
+                # its own and gets a fresh snapshot.
+                return
+            for event_seq, payload in events:
+                yield sse_message(payload, event='laptop', event_id=live_feed.cursor(event_seq))
+            if not events:
+                yield ': keepalive\n\n'
+            last_seq = newest
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/logs')
 @login_required
@@ -278,61 +793,111 @@ def logs():
 
 @app.route('/api/log_event', methods=['POST'])
 def log_event():
+    """
+    Creates a log entry. Events replayed from a Pi's offline spool carry
+    "source_id", "seq" and "captured_at"; one already logged under the same
+    source_id and seq is acknowledged without being logged again.
+    """
     data = request.get_json()
     serial_number = data.get('serial_number')
     event_type = data.get('event_type')
     
     if not serial_number or not event_type:
         return jsonify({"error": "Missing serial_number or event_type"}), 400
+
+    if not laptop_cache.get_by_serial(serial_number):
+        return jsonify({"error": "Laptop not found"}), 404
     
     # Define your local timezone
     local_timezone = pytz.timezone('Asia/Manila')
     
-    # Get the current time and localize it
-    local_now = datetime.now(local_timezone)
+    # Get the capture (or current) time and localize it
+    try:
+        captured_at = parse_captured_at(data.get('captured_at'), datetime.utcnow())
+        seq = int(data['seq']) if data.get('source_id') and data.get('seq') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid captured_at or seq"}), 400
+    local_now = pytz.utc.localize(captured_at).astimezone(local_timezone)
     
     # Create the log entry with the local timestamp
-    log = Log(serial_number=serial_number, event_type=event_type, timestamp=local_now)
-    db.session.add(log)
-    db.session.commit()
+    values = {'serial_number': serial_number, 'event_type': event_type, 'timestamp': local_now,
+              'source_id': data['source_id'] if seq is not None else None, 'source_seq': seq}
+    insert = dialect_insert()
+    if seq is not None and insert is not None:
+        result = db.session.execute(
+            insert(Log).values(**values).on_conflict_do_nothing(index_elements=['source_id', 'source_seq'])
+        )
+        db.session.commit()
+        if not result.rowcount:
+            return jsonify({"success": "Log entry already recorded"}), 200
+    else:
+        db.session.add(Log(**values))
+        db.session.commit()
     
     return jsonify({"success": "Log entry created"}), 201
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Request, commit and ingest metrics in the Prometheus text format, for a
+    scraper: no login, but a bearer token or an allowed address is required.
+    """
+    refusal = scrape_refusal(request)
+    if refusal is not None:
+        message, status = refusal
+        headers = {'WWW-Authenticate': 'Bearer'} if status == 401 else {}
+        return Response(message + '\n', status=status, headers=headers, content_type='text/plain')
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/laptop_cache/stats', methods=['GET'])
+@login_required
+def laptop_cache_stats():
+    return jsonify(laptop_cache.stats())
+
 @app.route('/toggle_sensor_script', methods=['POST'])
 @login_required
 def toggle_sensor_script():
-    global sensor_script_process
-    
     action = request.form.get('action')
-    script_path = os.path.join(app.root_path, '..', 'pi_sensor_script.py')
-    log_file_path = os.path.join(app.root_path, '..', 'sensor_script_log.txt')
-    
+
     if action == 'start':
-        if sensor_script_process is None or sensor_script_process.poll() is not None:
-            try:
-                # Use the same Python interpreter that is running Flask
-                python_executable = sys.executable
-                with open(log_file_path, 'a') as log_file:
-                    sensor_script_process = subprocess.Popen(
-                        [python_executable, script_path],
-                        stdout=log_file,
-                        stderr=log_file
-                    )
+        try:
+            if sensor_control.start():
                 flash('Sensor script started successfully!', 'success')
-            except Exception as e:
-                flash(f'Error starting script: {e}', 'danger')
-        else:
-            flash('Sensor script is already running.', 'info')
-    
+            else:
+                flash('Sensor script is already running.', 'info')
+        except OSError as e:
+            flash(f'Error starting script: {e}', 'danger')
+
     elif action == 'stop':
-        if sensor_script_process is not None and sensor_script_process.poll() is None:
-            try:
-                sensor_script_process.terminate()
-                sensor_script_process = None
+        try:
+            if sensor_control.stop():
                 flash('Sensor script stopped.', 'success')
-            except Exception as e:
-                flash(f'Error stopping script: {e}', 'danger')
-        else:
+            else:
+                flash('Sensor script is not running.', 'info')
+        except (OSError, ValueError) as e:
+            flash(f'Error stopping script: {e}', 'danger')
+
+    elif action == 'reload':
+        reply = sensor_control.reload()
+        if reply is None:
             flash('Sensor script is not running.', 'info')
-            
-    return redirect(url_for('index'))
\ No newline at end of file
+        elif 'error' in reply:
+            flash(f"Error reloading laptops: {reply['error']}", 'danger')
+        else:
+            flash(f"Sensor script has configuration version {reply['version']}.", 'success')
+
+    return redirect(url_for('index'))
+
+@app.route('/api/sensor_script/status', methods=['GET'])
+@login_required
+def sensor_script_status():
+    """The sensor script's state and health, read from its control socket, for the dashboard to poll."""
+    return jsonify(sensor_control.status())
+
+@app.route('/api/sensor_script/log', methods=['GET'])
+@login_required
+def sensor_script_log():
+    """The last `lines` lines of the sensor script's log (at most SENSOR_LOG_TAIL_MAX_LINES)."""
+    lines = request.args.get('lines', 100, type=int)
+    lines = max(0, min(lines, app.config['SENSOR_LOG_TAIL_MAX_LINES']))
+    return jsonify({'lines': sensor_control.log_tail(lines)})
\ No newline at end of file
@@ -0,0 +1,155 @@
+import fcntl
+import os
+import signal
+import subprocess
+import sys
+import threading
+from app import app
+from pi.control import remove_pid_file, send
+
+
+class SensorControl:
+    """
+    Starts, stops and queries the sensor script (pi_sensor_script.py) through
+    its control socket, so every web worker sees the same script and nothing
+    is lost when a worker restarts. The script runs in its own session and
+    outlives the worker that started it.
+
+    Between being launched and opening its socket the script only exists as
+    the pid written to `pid_path`; status() reports it as "starting" then.
+    The script deletes that file when it exits. A pid is only trusted, and
+    only ever signalled, while /proc shows it running the script, so a pid
+    the system has since handed to another process is left alone.
+    A script whose socket answers but whose heartbeat is more than
+    `stall_seconds` old is "stalled": its detection loop has hung.
+
+    The script writes and rotates its own log at `log_path`; its console
+    output, which only matters if it dies before logging is set up, goes
+    to `console_path`.
+    """
+
+    def __init__(self, socket_path, script_path, log_path, console_path, pid_path, stall_seconds=10.0,
+                 timeout=2.0):
+        self.socket_path = socket_path
+        self.script_path = script_path
+        self.log_path = log_path
+        self.console_path = console_path
+        self.pid_path = pid_path
+        self.stall_seconds = stall_seconds
+        self.timeout = timeout
+
+    def status(self):
+        """The script's status reply plus "state": one of running, stalled, starting or stopped."""
+        try:
+            status = send(self.socket_path, 'status', timeout=self.timeout)
+        except (OSError, ValueError):
+            pid = self._launched_pid()
+            return {'state': 'starting' if pid else 'stopped', 'pid': pid}
+        age = status.get('heartbeat_age_s')
+        status['state'] = 'stalled' if age is not None and age > self.stall_seconds else 'running'
+        return status
+
+    def start(self):
+        """Launches the script; returns False if one is already running or starting."""
+        # Held from the check until the pid is written, so two workers can't both launch a script. It is a
+        # file of its own because the pid file is deleted when the script exits.
+        with open(self.pid_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.status()['state'] != 'stopped':
+                return False
+            with open(self.console_path, 'w') as console:
+                # Use the same Python interpreter that is running Flask; run it from its own directory so its
+                # relative paths (log, spool, pid file) are the ones the web app expects
+                process = subprocess.Popen([sys.executable, self.script_path], stdin=subprocess.DEVNULL,
+                                           stdout=console, stderr=console, start_new_session=True,
+                                           cwd=os.path.dirname(os.path.abspath(self.script_path)))
+            with open(self.pid_path, 'w') as pid_file:
+                pid_file.write(str(process.pid))
+        # Reap it when it exits, or it would linger as a zombie that still looks alive
+        threading.Thread(target=self._reap, args=(process,), name='sensor-script-reaper', daemon=True).start()
+        return True
+
+    def stop(self):
+        """Shuts the script down; returns False if none was running."""
+        status = self.status()
+        if status['state'] == 'running':
+            send(self.socket_path, 'stop', timeout=self.timeout)
+        elif status['state'] == 'stalled' and self._is_script(status['pid']):
+            # Its loop can't run the shutdown anyway
+            os.kill(status['pid'], signal.SIGKILL)
+        elif status['state'] == 'starting' and self._is_script(status['pid']):
+            os.kill(status['pid'], signal.SIGTERM)
+        else:
+            return False
+        remove_pid_file(self.pid_path, status['pid'])
+        return True
+
+    def reload(self, timeout=15.0):
+        """Makes the script fetch its laptop configuration now; returns its reply, None if it isn't running."""
+        try:
+            return send(self.socket_path, 'reload', timeout=timeout)
+        except (OSError, ValueError):
+            return None
+
+    def log_tail(self, lines):
+        """The last `lines` lines of the script's log; empty if it has none yet."""
+        try:
+            return tail(self.log_path, lines)
+        except FileNotFoundError:
+            return []
+
+    def _launched_pid(self):
+        try:
+            with open(self.pid_path) as pid_file:
+                pid = int(pid_file.read())
+        except (OSError, ValueError):
+            return None
+        if not self._is_script(pid):
+            # Left behind by a script that was killed before it could delete it
+            remove_pid_file(self.pid_path, pid)
+            return None
+        return pid
+
+    def _is_script(self, pid):
+        """Whether process `pid` exists and is running the sensor script."""
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as cmdline:
+                args = cmdline.read().split(b'\0')
+        except OSError:
+            return False
+        script = os.path.basename(self.script_path).encode()
+        return any(os.path.basename(arg) == script for arg in args[1:])
+
+    def _reap(self, process):
+        process.wait()
+        remove_pid_file(self.pid_path, process.pid)
+
+
+def tail(path, lines, block_size=8192):
+    """
+    The last `lines` lines of the file at `path`, read backwards from its end
+    in blocks, so the cost depends on the lines asked for and not on the size
+    of the file.
+    """
+    if lines <= 0:
+        return []
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+        # One newline more than asked for, so the first line kept is complete
+        while end > 0 and data.count(b'\n') <= lines:
+            start = max(0, end - block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    return [line.decode('utf-8', errors='replace') for line in data.splitlines()[-lines:]]
+
+
+sensor_control = SensorControl(
+    app.config['SENSOR_CONTROL_SOCKET'],
+    os.path.join(app.root_path, '..', 'pi_sensor_script.py'),
+    os.path.join(app.root_path, '..', 'sensor_script_log.txt'),
+    os.path.join(app.root_path, '..', 'sensor_script_console.txt'),
+    os.path.join(app.root_path, '..', 'sensor_script.pid'),
+    stall_seconds=app.config['SENSOR_STALL_SECONDS'],
+)
@@ -0,0 +1,400 @@
+"""
+Replays a recorded sensor trace through the Pi's detection logic and the
+Flask ingest API, and compares the decisions it makes with the recorded ones.
+
+    python -m benchmarks.replay_trace sensor_script_log.txt
+    python -m benchmarks.replay_trace capture.jsonl --speed 1 --api-url http://localhost:5000
+    python -m benchmarks.replay_trace sensor_script_log.txt --no-presence --beacon-timeout 4 --json
+
+A trace is either a plain pi_sensor_script.py log, whose timing is inferred
+from its 2 s tick, or a JSON lines capture written with CAPTURE_PATH (see
+pi/trace.py). Events are fed to an EventDetector (with the presence filter
+unless --no-presence) on the trace's own clock, as fast as possible or at
+--speed times real time. Every --report-interval the readings it would send
+go to /api/sensor_data/batch, and each status change goes to
+/api/laptop_status and /api/log_event. By default they go to an in-process
+app on a fresh SQLite database that has the trace's laptops.
+
+Reported: event throughput, per-event detection cost, API latency, and each
+replayed status change paired with the recorded one for the same laptop
+within --match-window seconds. "offset" is replayed minus recorded time, so
+a negative offset means the replay decided earlier.
+"""
+import argparse
+import bisect
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Traces whose times look like Unix time (captures) send their own capture times to the server
+UNIX_TIME = 1e9
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('trace', nargs='?', default=os.path.join(ROOT, 'sensor_script_log.txt'))
+    parser.add_argument('--speed', type=float, default=0, help='times real time; 0 replays as fast as possible')
+    parser.add_argument('--tick', type=float, default=2.0, help='tick length assumed for plain logs')
+    parser.add_argument('--min-distance', type=float, default=5.0, help='cm above which a laptop counts as moved')
+    parser.add_argument('--beacon-timeout', type=float, default=2.0, help='only used with --no-presence')
+    parser.add_argument('--no-presence', action='store_true', help='plain beacon timeouts instead of the N-of-M filter')
+    parser.add_argument('--slot-seconds', type=float, default=1.0)
+    parser.add_argument('--window', type=int, default=5)
+    parser.add_argument('--absent-slots', type=int, default=3)
+    parser.add_argument('--present-slots', type=int, default=3)
+    parser.add_argument('--rssi-smoothing', type=float, default=0.3)
+    parser.add_argument('--min-rssi', type=float)
+    parser.add_argument('--report-interval', type=float, default=2.0)
+    parser.add_argument('--match-window', type=float, default=10.0)
+    parser.add_argument('--api-url', help='send to a running server instead of an in-process app')
+    parser.add_argument('--database-url', help='database for the in-process app (default: a fresh SQLite file)')
+    parser.add_argument('--no-api', action='store_true', help='only run the detection logic')
+    parser.add_argument('--decisions', action='store_true', help='list every replayed and recorded decision')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values, scale=1.0, digits=2):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50': round(statistics.median(values) * scale, digits),
+        'p95': round(percentile(values, 0.95) * scale, digits),
+        'p99': round(percentile(values, 0.99) * scale, digits),
+        'max': round(max(values) * scale, digits),
+    }
+
+
+class InProcessApi:
+    """The Flask app's test client on its own database, seeded with each session's laptops."""
+
+    def __init__(self, database_url):
+        os.environ['DATABASE_URL'] = database_url
+        from flask_migrate import upgrade
+        from app import app, db, models
+        from app.laptop_cache import laptop_cache
+
+        self.app, self.db, self.models, self.laptop_cache = app, db, models, laptop_cache
+        with app.app_context():
+            upgrade(directory=os.path.join(ROOT, 'migrations'))
+        self.client = app.test_client()
+
+    def add_laptops(self, ibeacon_map, ultrasonic_map):
+        models, db = self.models, self.db
+        with self.app.app_context():
+            user = models.User.query.filter_by(username='replay').first()
+            if user is None:
+                user = models.User(username='replay', email='replay@example.com')
+                user.set_password('replay')
+                db.session.add(user)
+            known = set()
+            for serial, mac in db.session.query(models.Laptop.serial_number, models.Laptop.ibeacon_mac_address):
+                known.update((serial, mac))
+            for mac, serial in ibeacon_map.items():
+                # Beacons moved between laptops over a trace keep their first laptop
+                if serial not in known and mac not in known:
+                    db.session.add(models.Laptop(name=f'Laptop {serial}', serial_number=serial, owner=user,
+                                                 ibeacon_mac_address=mac,
+                                                 ultrasonic_sensor_index=ultrasonic_map.get(serial)))
+            db.session.commit()
+        self.laptop_cache.invalidate()
+
+    def post(self, path, body):
+        return self.client.post(path, json=body).status_code
+
+
+class HttpApi:
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.errors = (requests.exceptions.RequestException,)
+
+    def add_laptops(self, ibeacon_map, ultrasonic_map):
+        pass  # a running server must already know them
+
+    def post(self, path, body):
+        try:
+            return self.session.post(self.base_url + path, json=body, timeout=10).status_code
+        except self.errors:
+            return None
+
+
+class Replay:
+    """Feeds trace events to a fresh EventDetector per session, on the trace's clock."""
+
+    def __init__(self, args, api):
+        self.args = args
+        self.api = api
+        self.source_id = f'replay-{int(time.time())}'
+        self.seq = 0
+        self.now = None
+        self.detector = None
+        self.configured = False
+        self.ibeacon_map = {}
+        self.ultrasonic_map = {}
+        self.statuses = {}
+        self.next_report = None
+        self.latest_distances = [0.0, 0.0, 0.0, 0.0]
+        self.counts = {'events': 0, 'sessions': 0, 'advertisements': 0, 'frames': 0, 'serial_errors': 0,
+                       'readings_sent': 0, 'alarms_on': 0, 'alarms_off': 0, 'recorded_alarms_on': 0,
+                       'recorded_alarms_off': 0}
+        self.replayed = []
+        self.recorded = []
+        self.event_seconds = []
+        self.api_seconds = {}
+        self.api_failures = {}
+        self._api_time = 0.0
+
+    def new_session(self):
+        from pi.detector import EventDetector
+        from pi.presence import PresenceTracker
+
+        args = self.args
+        presence = None
+        if not args.no_presence:
+            presence = PresenceTracker(self.ibeacon_map, slot_seconds=args.slot_seconds, window=args.window,
+                                       absent_slots=args.absent_slots, present_slots=args.present_slots,
+                                       alpha=args.rssi_smoothing, min_rssi=args.min_rssi)
+        self.detector = EventDetector(self.ibeacon_map, self.ultrasonic_map, args.min_distance,
+                                      args.beacon_timeout, self.on_status, self.on_alarm, presence=presence)
+        self.detector.start(self.now)
+        self.statuses = {serial: False for serial in self.ibeacon_map.values()}
+        self.next_report = self.now + args.report_interval
+        if self.api is not None:
+            self.api.add_laptops(self.ibeacon_map, self.ultrasonic_map)
+
+    def update_config(self):
+        self.detector.set_laptops(self.ibeacon_map, self.ultrasonic_map, self.now)
+        self.statuses = {serial: self.statuses.get(serial, False) for serial in self.ibeacon_map.values()}
+        if self.api is not None:
+            self.api.add_laptops(self.ibeacon_map, self.ultrasonic_map)
+
+    def feed(self, event):
+        started = time.perf_counter()
+        t = event['t']
+        self.run_timers(t)
+        self.now = t
+        kind = event['type']
+        self.counts['events'] += 1
+
+        if kind == 'start':
+            self.counts['sessions'] += 1
+            self.configured = False
+            self.new_session()
+        elif kind == 'config':
+            # Logs print the config before "start", captures after it; any
+            # further config in a session was synced from the server at runtime
+            self.ibeacon_map = event['ibeacon_map']
+            self.ultrasonic_map = event['ultrasonic_map']
+            if self.configured:
+                self.update_config()
+            else:
+                self.new_session()
+                self.configured = True
+        elif self.detector is None:
+            pass  # nothing to detect with until the first session starts
+        elif kind == 'advertisement':
+            self.counts['advertisements'] += 1
+            self.detector.on_advertisement(event['mac'], event['rssi'], t)
+            self.time_detection(started)
+        elif kind == 'frame':
+            self.counts['frames'] += 1
+            self.latest_distances = event['distances']
+            self.detector.on_frame(event['distances'], t)
+            self.time_detection(started)
+        elif kind == 'serial_error':
+            self.counts['serial_errors'] += 1
+        elif kind == 'status':
+            self.recorded.append((t, event['serial'], event['is_stolen']))
+        elif kind == 'alarm':
+            self.counts['recorded_alarms_on' if event['active'] else 'recorded_alarms_off'] += 1
+        self._api_time = 0.0
+
+    def time_detection(self, started):
+        # Everything the detector did for one input event, including expiries and reports due before it,
+        # less the time spent waiting for the API
+        self.event_seconds.append(time.perf_counter() - started - self._api_time)
+
+    def run_timers(self, until):
+        """Expires beacons and sends reports that fell due before the next event, each at its own time."""
+        if self.detector is None:
+            return
+        while True:
+            deadline = self.detector.next_deadline()
+            due = [d for d in (deadline, self.next_report) if d is not None and d <= until]
+            if not due:
+                return
+            self.now = min(due)
+            if self.now == self.next_report:
+                self.report()
+                self.next_report += self.args.report_interval
+            else:
+                self.detector.expire(self.now)
+
+    def report(self):
+        seen = self.detector.report()
+        if not seen or self.api is None:
+            return
+        readings = []
+        for mac, serial, rssi, is_moved in seen:
+            self.seq += 1
+            reading = {'serial_number': serial, 'ibeacon_rssi': rssi, 'ultrasonic_distances': self.latest_distances,
+                       'ultrasonic_intrusion_detected': is_moved, 'seq': self.seq}
+            if self.now > UNIX_TIME:
+                reading['captured_at'] = datetime.utcfromtimestamp(self.now).isoformat()
+            readings.append(reading)
+        if self.post('batch', '/api/sensor_data/batch', {'source_id': self.source_id, 'readings': readings}):
+            self.counts['readings_sent'] += len(readings)
+
+    def on_status(self, serial, is_stolen):
+        if self.statuses.get(serial) == is_stolen:
+            return
+        self.statuses[serial] = is_stolen
+        self.replayed.append((self.now, serial, is_stolen))
+        if self.api is not None:
+            self.post('status', f'/api/laptop_status/{serial}', {'is_stolen': is_stolen})
+            self.post('log', '/api/log_event', {'serial_number': serial,
+                                                'event_type': 'stolen' if is_stolen else 'returned'})
+
+    def on_alarm(self, active, reason):
+        self.counts['alarms_on' if active else 'alarms_off'] += 1
+
+    def post(self, name, path, body):
+        started = time.perf_counter()
+        status = self.api.post(path, body)
+        elapsed = time.perf_counter() - started
+        self._api_time += elapsed
+        self.api_seconds.setdefault(name, []).append(elapsed)
+        ok = status is not None and status < 400
+        if not ok:
+            self.api_failures[name] = self.api_failures.get(name, 0) + 1
+        return ok
+
+
+def match_decisions(replayed, recorded, window):
+    """
+    Pairs each recorded status change with the nearest unpaired replayed one
+    for the same laptop and status within `window` seconds.
+    Returns (offsets, unmatched recorded, unmatched replayed).
+    """
+    candidates = {}
+    for t, serial, is_stolen in replayed:
+        candidates.setdefault((serial, is_stolen), []).append(t)
+    used = set()
+    offsets, missed = [], []
+    for t, serial, is_stolen in recorded:
+        times = candidates.get((serial, is_stolen), [])
+        i = bisect.bisect_left(times, t - window)
+        best = None
+        while i < len(times) and times[i] <= t + window:
+            if (serial, is_stolen, i) not in used and (best is None or abs(times[i] - t) < abs(times[best] - t)):
+                best = i
+            i += 1
+        if best is None:
+            missed.append((t, serial, is_stolen))
+            continue
+        used.add((serial, is_stolen, best))
+        offsets.append(times[best] - t)
+    return offsets, missed, len(replayed) - len(used)
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, ROOT)
+    from pi.trace import read_trace
+
+    api = None
+    if args.api_url:
+        api = HttpApi(args.api_url)
+    elif not args.no_api:
+        api = InProcessApi(args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'replay.db'))
+    replay = Replay(args, api)
+
+    # The detector logs every transition; only the numbers matter here
+    logging.disable(logging.CRITICAL)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    lateness = []
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    first = last = None
+    try:
+        for event in read_trace(args.trace, tick=args.tick):
+            if first is None:
+                first = event['t']
+            if args.speed:
+                due = wall_started + (event['t'] - first) / args.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lateness.append(-delay)
+            replay.feed(event)
+            last = event['t']
+        if last is not None:
+            replay.run_timers(last + args.report_interval)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        logging.disable(logging.NOTSET)
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+
+    offsets, missed, extra = match_decisions(replay.replayed, replay.recorded, args.match_window)
+    trace_seconds = (last - first) if first is not None else 0.0
+    results = {
+        'trace': os.path.basename(args.trace),
+        'engine': 'timeout' if args.no_presence else 'presence',
+        'trace_seconds': round(trace_seconds, 1),
+        'wall_seconds': round(wall, 2),
+        'cpu_seconds': round(cpu, 2),
+        'speedup': round(trace_seconds / wall, 1) if wall else None,
+        'events_per_second': round(replay.counts['events'] / wall, 1) if wall else None,
+        **replay.counts,
+        'detection_us': summarize(replay.event_seconds, 1e6, 1),
+        'api_ms': {name: dict(summarize(seconds, 1e3), failed=replay.api_failures.get(name, 0))
+                   for name, seconds in sorted(replay.api_seconds.items())},
+        'status_changes': {
+            'replayed': len(replay.replayed),
+            'recorded': len(replay.recorded),
+            'matched': len(offsets),
+            'missed': len(missed),
+            'extra': extra,
+            'offset_s_mean': round(statistics.fmean(offsets), 2) if offsets else None,
+            'offset_s_p50': round(statistics.median(offsets), 2) if offsets else None,
+            'offset_s_max': round(max(offsets, key=abs), 2) if offsets else None,
+        },
+    }
+    if args.speed:
+        results['late_events'] = dict(summarize(lateness, 1e3), unit='ms')
+    if args.decisions:
+        results['replayed_decisions'] = [[round(t, 2), serial, stolen] for t, serial, stolen in replay.replayed]
+        results['recorded_decisions'] = [[round(t, 2), serial, stolen] for t, serial, stolen in replay.recorded]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    width = max(len(key) for key in results)
+    for key, value in results.items():
+        print(f'{key:<{width}}  {value}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
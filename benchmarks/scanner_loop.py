@@ -0,0 +1,168 @@
+"""
+Runs the Pi's detection loop against simulated hardware, so its cost at fleet
+scale can be measured on any Linux box without a Bluetooth adapter, an
+Arduino or a buzzer.
+
+    python -m benchmarks.scanner_loop --beacons 5000 --seconds 30
+    python -m benchmarks.scanner_loop --beacons 2000 --departures-per-hour 120 --no-presence --json
+
+Synthetic beacons advertise once a second through pi.hardware, are fed to the
+same EventDetector / PresenceTracker the sensor script uses, and the status
+changes and report payloads it would send are counted instead of posted.
+Event-loop lag is sampled by a task that asks to wake up every 10 ms.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAG_PROBE_INTERVAL = 0.01
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--beacons', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--interval', type=float, default=1.0, help='advertising interval per beacon')
+    parser.add_argument('--dropout', type=float, default=0.05, help='share of advertisements lost')
+    parser.add_argument('--departures-per-hour', type=float, default=60.0, help='per beacon')
+    parser.add_argument('--absence-seconds', type=float, default=10.0)
+    parser.add_argument('--lifts-per-hour', type=float, default=60.0, help='per ultrasonic sensor')
+    parser.add_argument('--report-interval', type=float, default=2.0)
+    parser.add_argument('--no-presence', action='store_true', help='plain beacon timeouts instead of the N-of-M filter')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(args):
+    from pi.detector import EventDetector
+    from pi.hardware import SimulatedBeaconSource, SimulatedDistanceSource, SimulatedBuzzer, simulated_laptops
+    from pi.presence import PresenceTracker
+
+    loop = asyncio.get_running_loop()
+    ibeacon_map, ultrasonic_map = simulated_laptops(args.beacons)
+    buzzer = SimulatedBuzzer()
+    counts = {'status_changes': 0, 'alarm_on': 0, 'alarm_off': 0, 'payloads': 0, 'reports': 0}
+    statuses = {}
+
+    def on_status(serial, is_stolen):
+        if statuses.get(serial) != is_stolen:
+            statuses[serial] = is_stolen
+            counts['status_changes'] += 1
+
+    def on_alarm(active, reason):
+        counts['alarm_on' if active else 'alarm_off'] += 1
+        buzzer.on() if active else buzzer.off()
+
+    presence = None if args.no_presence else PresenceTracker(ibeacon_map)
+    detector = EventDetector(ibeacon_map, ultrasonic_map, 5.0, 2.0, on_status, on_alarm, presence=presence)
+    wakeup = asyncio.Event()
+
+    def on_advertisement(mac, rssi):
+        if mac in detector.missing:
+            wakeup.set()
+        detector.on_advertisement(mac, rssi, loop.time())
+
+    def handle_frame(frame):
+        detector.on_frame(list(frame.distances), loop.time())
+
+    beacons = SimulatedBeaconSource(on_advertisement, ibeacon_map, interval=args.interval, dropout=args.dropout,
+                                    departure_rate=args.departures_per_hour, absence_seconds=args.absence_seconds,
+                                    seed=args.seed)
+    reader = SimulatedDistanceSource(lift_rate=args.lifts_per_hour, lifted_cm=20.0, seed=args.seed,
+                                     on_frame=lambda frame: loop.call_soon_threadsafe(handle_frame, frame))
+
+    async def expire_deadlines():
+        while True:
+            deadline = detector.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            detector.expire(loop.time())
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.report_interval)
+            counts['reports'] += 1
+            counts['payloads'] += len(detector.report())
+
+    lags = []
+
+    async def probe_lag():
+        while True:
+            expected = loop.time() + LAG_PROBE_INTERVAL
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lags.append((loop.time() - expected) * 1000)
+
+    # The detector prints every transition; only the numbers matter here
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    detector.start(loop.time())
+    await beacons.start()
+    reader.start()
+    tasks = [asyncio.create_task(coro()) for coro in (expire_deadlines, report, probe_lag)]
+    try:
+        await asyncio.sleep(args.seconds)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await beacons.stop()
+        reader.stop()
+        buzzer.close()
+        sys.stdout.close()
+        sys.stdout = stdout
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+
+    return {
+        'beacons': args.beacons,
+        'presence_filter': presence is not None,
+        'seconds': round(wall, 2),
+        'advertisements': beacons.sent,
+        'advertisements_lost': beacons.lost,
+        'advertisements_per_second': round(beacons.sent / wall, 1),
+        'frames': reader.stats()['frames'],
+        'cpu_seconds': round(cpu, 3),
+        'cpu_share': round(cpu / wall, 3),
+        'loop_lag_ms_p50': round(statistics.median(lags), 2) if lags else 0.0,
+        'loop_lag_ms_p99': round(percentile(lags, 0.99), 2),
+        'loop_lag_ms_max': round(max(lags, default=0.0), 2),
+        'missing_at_end': len(detector.missing),
+        'moved_at_end': len(detector.moved),
+        'buzzer_seconds_on': round(buzzer.seconds_on, 2),
+        **counts,
+    }
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, ROOT)
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    width = max(len(key) for key in results)
+    for key, value in results.items():
+        print(f'{key:<{width}}  {value}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
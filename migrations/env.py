@@ -5,6 +5,8 @@ from flask import current_app
 
 from alembic import context
 
+from app.partitions import DEFAULT_PARTITION, PARTITION_NAME
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -90,9 +92,21 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # sensor_reading is partitioned by day on PostgreSQL; its partitions (daily,
+    # coarse and DEFAULT) are managed by `flask partitions maintain`, not by
+    # the models
+    def include_object(object, name, type_, reflected, compare_to):
+        table = object if type_ == 'table' else getattr(object, 'table', None)
+        if reflected and compare_to is None and table is not None:
+            return not (table.name == DEFAULT_PARTITION
+                        or PARTITION_NAME.match(table.name))
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
@@ -0,0 +1,34 @@
+"""Add composite (laptop_id, timestamp DESC) index on sensor_reading
+
+Revision ID: 5e8a0b7c2d91
+Revises: 3c9d1e2f4a7b
+Create Date: 2026-10-17 19:41:36.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a0b7c2d91'
+down_revision = '3c9d1e2f4a7b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Covers "readings of one laptop, newest first" (laptop_details,
+    # get_latest_reading, get_laptop_status and the dashboard). PostgreSQL
+    # also stores ibeacon_rssi in the index so those reads stay index-only.
+    with op.batch_alter_table('sensor_reading', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_sensor_reading_laptop_id_timestamp',
+            ['laptop_id', sa.text('timestamp DESC')],
+            unique=False,
+            postgresql_include=['ibeacon_rssi']
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('sensor_reading', schema=None) as batch_op:
+        batch_op.drop_index('ix_sensor_reading_laptop_id_timestamp')
@@ -0,0 +1,127 @@
+"""Partition sensor_reading by day on PostgreSQL
+
+Revision ID: c7e2a9f05d18
+Revises: a41d7e9c3b52
+Create Date: 2026-10-17 21:48:09.124533
+
+"""
+from datetime import datetime, timedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a9f05d18'
+down_revision = 'a41d7e9c3b52'
+branch_labels = None
+depends_on = None
+
+# Partitions created ahead of today; `flask partitions maintain` (and
+# `flask maintain-readings`) keep extending this window afterwards.
+DAYS_AHEAD = 7
+
+# Days before today that get daily partitions (SENSOR_READING_RETENTION_DAYS by
+# default); older history goes into one partition per calendar month, which
+# retention drops as a whole once all of it has expired.
+DAYS_KEPT = 7
+
+COLUMNS = """
+    id INTEGER NOT NULL DEFAULT nextval('sensor_reading_id_seq'),
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    ibeacon_uuid VARCHAR(36),
+    ibeacon_major INTEGER,
+    ibeacon_minor INTEGER,
+    ibeacon_mac_address VARCHAR(17),
+    ibeacon_rssi INTEGER,
+    ultrasonic_distance_1_cm FLOAT,
+    ultrasonic_distance_2_cm FLOAT,
+    ultrasonic_distance_3_cm FLOAT,
+    ultrasonic_distance_4_cm FLOAT,
+    ultrasonic_intrusion_detected BOOLEAN,
+    laptop_id INTEGER,
+    CONSTRAINT sensor_reading_laptop_id_fkey FOREIGN KEY(laptop_id) REFERENCES laptop (id)
+"""
+
+COLUMN_NAMES = (
+    "id, timestamp, ibeacon_uuid, ibeacon_major, ibeacon_minor, ibeacon_mac_address, ibeacon_rssi, "
+    "ultrasonic_distance_1_cm, ultrasonic_distance_2_cm, ultrasonic_distance_3_cm, ultrasonic_distance_4_cm, "
+    "ultrasonic_intrusion_detected, laptop_id"
+)
+
+
+def _rename_old_table():
+    op.execute("ALTER TABLE sensor_reading RENAME TO sensor_reading_old")
+    op.execute("ALTER TABLE sensor_reading_old RENAME CONSTRAINT sensor_reading_pkey TO sensor_reading_old_pkey")
+    op.execute("ALTER TABLE sensor_reading_old RENAME CONSTRAINT sensor_reading_laptop_id_fkey TO sensor_reading_old_laptop_id_fkey")
+    op.execute("ALTER INDEX ix_sensor_reading_timestamp RENAME TO ix_sensor_reading_old_timestamp")
+    op.execute("ALTER INDEX ix_sensor_reading_laptop_id_timestamp RENAME TO ix_sensor_reading_old_laptop_id_timestamp")
+
+
+def _create_indexes():
+    op.execute("CREATE INDEX ix_sensor_reading_timestamp ON sensor_reading (timestamp)")
+    op.execute(
+        "CREATE INDEX ix_sensor_reading_laptop_id_timestamp ON sensor_reading "
+        "(laptop_id, timestamp DESC) INCLUDE (ibeacon_rssi)"
+    )
+
+
+def _create_partition(start, end, name):
+    op.execute(
+        f"CREATE TABLE {name} PARTITION OF sensor_reading "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def _month_after(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # Other databases keep a plain table; only the NOT NULL partition key
+        # is shared so the model is the same everywhere.
+        op.execute("UPDATE sensor_reading SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL")
+        with op.batch_alter_table('sensor_reading', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+        return
+
+    bind = op.get_bind()
+    _rename_old_table()
+    op.execute(f"CREATE TABLE sensor_reading ({COLUMNS}, PRIMARY KEY (id, timestamp)) PARTITION BY RANGE (timestamp)")
+    op.execute("ALTER SEQUENCE sensor_reading_id_seq OWNED BY sensor_reading.id")
+    _create_indexes()
+    # Catches rows outside every daily partition (far past or future clocks)
+    op.execute("CREATE TABLE sensor_reading_default PARTITION OF sensor_reading DEFAULT")
+
+    oldest = bind.execute(sa.text("SELECT min(timestamp) FROM sensor_reading_old")).scalar()
+    today = datetime.utcnow().date()
+    first_daily = today - timedelta(days=DAYS_KEPT)
+    day = min(oldest.date(), today) if oldest else today
+    while day < first_daily:
+        end = min(_month_after(day), first_daily)
+        _create_partition(day, end, f"sensor_reading_p{day:%Y%m%d}_{end:%Y%m%d}")
+        day = end
+    while day <= today + timedelta(days=DAYS_AHEAD):
+        _create_partition(day, day + timedelta(days=1), f"sensor_reading_p{day:%Y%m%d}")
+        day += timedelta(days=1)
+
+    op.execute(
+        f"INSERT INTO sensor_reading ({COLUMN_NAMES}) "
+        f"SELECT {COLUMN_NAMES.replace('timestamp,', 'COALESCE(timestamp, CURRENT_TIMESTAMP),')} "
+        f"FROM sensor_reading_old"
+    )
+    op.execute("DROP TABLE sensor_reading_old")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('sensor_reading', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+        return
+
+    _rename_old_table()
+    op.execute(f"CREATE TABLE sensor_reading ({COLUMNS.replace('TIME ZONE NOT NULL', 'TIME ZONE')}, PRIMARY KEY (id))")
+    op.execute("ALTER SEQUENCE sensor_reading_id_seq OWNED BY sensor_reading.id")
+    _create_indexes()
+    op.execute(f"INSERT INTO sensor_reading ({COLUMN_NAMES}) SELECT {COLUMN_NAMES} FROM sensor_reading_old")
+    op.execute("DROP TABLE sensor_reading_old")
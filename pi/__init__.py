@@ -0,0 +1 @@
+"""Support modules for the Raspberry Pi sensor scripts."""
@@ -0,0 +1,479 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid as uuidlib
+
+from pi.ibeacon import BeaconStats, ScanCounters, decode_ibeacon, start_scanner
+from pi.logs import StructuredFormatter
+
+log = logging.getLogger(__name__)
+
+# One process owns the Bluetooth adapter and scans continuously; the web
+# app's beacon discovery and the sensor script's detection loop read its
+# advertisements over a Unix socket instead of opening the adapter
+# themselves. Start it with `python -m pi.ble_daemon`.
+#
+# A client sends one JSON line:
+#
+#   {"cmd": "table", "max_age": 5}      one JSON line {"sightings": [...]} with the
+#                                       latest sighting per MAC heard in the last
+#                                       `max_age` seconds, then the daemon hangs up
+#   {"cmd": "subscribe", "since": 5,    the sightings of the last `since` seconds,
+#    "ibeacon": false}                  then one JSON line per advertisement until
+#                                       the client hangs up; "ibeacon" limits both
+#                                       to iBeacons
+#   {"cmd": "stats"}                    one JSON line of counters
+#
+# A sighting is {"mac", "rssi", "t" (Unix time), "count" (advertisements
+# heard from that MAC)} plus "uuid", "major" and "minor" for iBeacons.
+#
+# The web app's beacon discovery runs here as well, so every web worker sees
+# the same scan and only one runs at a time:
+#
+#   {"cmd": "scan_start", "owner": 1,   starts a scan (see BeaconScan) fed with the
+#    "duration": 10, "limit": null,     iBeacons of the last `since` seconds and then
+#    "exclude": [[uuid, major, minor]], live ones, stopping the owner's running scan;
+#    "uuid": null, "since": 5,          refused with "busy": true while another
+#    "retention": 300}                  owner's scan runs. Replies like "scan"
+#   {"cmd": "scan", "id": "...",        the scan's state and the beacons found after
+#    "seen": 0, "wait": 0}              the first `seen`, after waiting up to `wait`
+#                                       seconds for a new one or the end of the scan
+#   {"cmd": "scan_stop", "id": "..."}   ends the scan, then replies like "scan"
+
+DEFAULT_SOCKET = '/tmp/laptop-security-ble.sock'
+
+# UUID of the iBeacons made up by --simulate
+SIMULATED_UUID = 'f7826da64fa24e988024bc5b71e0893e'
+
+
+class AdvertisementTable:
+    """Latest sighting per MAC; entries not refreshed for `max_age` seconds are pruned."""
+
+    def __init__(self, max_age=30.0):
+        self.max_age = max_age
+        self._sightings = {}
+
+    def __len__(self):
+        return len(self._sightings)
+
+    def update(self, mac, rssi, now, ibeacon=None):
+        previous = self._sightings.get(mac)
+        sighting = {'mac': mac, 'rssi': rssi, 't': round(now, 3),
+                    'count': previous['count'] + 1 if previous else 1}
+        if ibeacon:
+            sighting.update(ibeacon)
+        self._sightings[mac] = sighting
+        return sighting
+
+    def recent(self, max_age, now, ibeacon_only=False):
+        return [s for s in self._sightings.values()
+                if now - s['t'] <= max_age and (not ibeacon_only or 'uuid' in s)]
+
+    def prune(self, now):
+        stale = [mac for mac, s in self._sightings.items() if now - s['t'] > self.max_age]
+        for mac in stale:
+            del self._sightings[mac]
+        return len(stale)
+
+
+class BeaconScan:
+    """
+    One beacon discovery run for the web app, fed from the daemon's iBeacon
+    sightings. Beacons are listed in the order they were first heard; once the
+    scan ends every beacon's RSSI statistics over the whole scan are reported
+    as "results". It ends after `duration` seconds, once `limit` beacons were
+    found or when stopped, and `reason` says which of 'timeout', 'limit' or
+    'stopped' it was. Finished scans are kept `retention` seconds for streams
+    that reconnect.
+    """
+
+    def __init__(self, owner, duration, limit=None, exclude=(), uuid=None, retention=300.0):
+        self.id = uuidlib.uuid4().hex
+        self.owner = owner
+        self.limit = limit
+        self.exclude = {tuple(beacon) for beacon in exclude}
+        self.uuid = uuid
+        self.retention = retention
+        self.found = []
+        self.counters = ScanCounters()
+        self.counters.mode = 'daemon'
+        self.state = 'running'
+        self.reason = None
+        self.finished_at = None
+        self._stats = {}
+        self._ignored = set()
+        self._changed = asyncio.Event()
+        self._timer = asyncio.get_running_loop().call_later(duration, self.finish, 'timeout')
+
+    @property
+    def running(self):
+        return self.state == 'running'
+
+    def add(self, sighting):
+        if not self.running:
+            return
+        self.counters.callbacks += 1
+        self.counters.ibeacons += 1
+        mac = sighting['mac']
+        stats = self._stats.get(mac)
+        if stats is None:
+            fields = (sighting['uuid'], sighting['major'], sighting['minor'])
+            if mac in self._ignored or (self.uuid and fields[0] != self.uuid):
+                return
+            if fields in self.exclude:
+                self._ignored.add(mac)
+                return
+            stats = self._stats[mac] = BeaconStats(mac, *fields)
+            stats.add(sighting['rssi'], sighting['t'])
+            self.found.append(stats.as_dict())
+            if self.limit and len(self.found) >= self.limit:
+                self.finish('limit')
+            self._notify()
+            return
+        stats.add(sighting['rssi'], sighting['t'])
+
+    def finish(self, reason):
+        if not self.running:
+            return
+        self._timer.cancel()
+        self.state, self.reason = 'done', reason
+        self.finished_at = time.monotonic()
+        self.counters.finish()
+        self._notify()
+
+    def expired(self, now):
+        return self.finished_at is not None and now - self.finished_at > self.retention
+
+    async def wait(self, seen, timeout):
+        """Returns once more than `seen` beacons were found, the scan ended or `timeout` expired."""
+        if len(self.found) > seen or not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def reply(self, seen=0):
+        return {'id': self.id, 'owner': self.owner, 'state': self.state, 'reason': self.reason,
+                'beacons': self.found[seen:], 'scan': self.counters.as_dict(),
+                'results': None if self.running else [stats.as_dict() for stats in self._stats.values()]}
+
+    def _notify(self):
+        # Wake the current waiters; later ones wait for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class Subscriber:
+    def __init__(self, ibeacon_only, queue_size):
+        self.ibeacon_only = ibeacon_only
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+
+class BleDaemon:
+    """
+    Scans without pause and fans every advertisement out to the clients of
+    its Unix socket. Each sighting is encoded once and queued to every
+    subscriber; a subscriber that falls `queue_size` lines behind loses the
+    newest ones (counted in "dropped") rather than holding up the others.
+
+    Both of its users only care about iBeacons, so unless `all_devices` is
+    set the adapter is asked to pass on iBeacons (of proximity `uuid` if
+    given) only, see pi.ibeacon.start_scanner. With `simulate` set to a
+    number of beacons, advertisements come from
+    pi.hardware.SimulatedBeaconSource instead of the adapter.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, table_seconds=30.0, queue_size=1024, simulate=None,
+                 all_devices=False, uuid=None):
+        self.path = path
+        self.table = AdvertisementTable(max_age=table_seconds)
+        self.queue_size = queue_size
+        self.simulate = simulate
+        self.all_devices = all_devices
+        self.uuid = uuid
+        self.advertisements = 0
+        self.dropped = 0
+        self.started_at = None
+        self._subscribers = set()
+        self._scans = {}
+        self._handlers = set()
+        self._server = None
+        self._source = None
+        self._prune_task = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise RuntimeError(f'A BLE daemon is already listening on {self.path}')
+            os.unlink(self.path)  # left over from a daemon that didn't shut down cleanly
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        self._source = self._make_source()
+        await self._source.start()
+        self._prune_task = asyncio.create_task(self._prune())
+        self.started_at = time.time()
+
+    async def stop(self):
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+        if self._source is not None:
+            await self._source.stop()
+        for scan in self._scans.values():
+            scan.finish('stopped')
+        # Let every stream end on its own; a handler left to be cancelled is reported as an error
+        for subscriber in self._subscribers:
+            while subscriber.queue.full():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout=1.0)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _make_source(self):
+        if self.simulate:
+            from pi.hardware import SimulatedBeaconSource, simulated_laptops
+
+            macs = list(simulated_laptops(self.simulate)[0])
+            ibeacons = {mac: {'uuid': SIMULATED_UUID, 'major': 1, 'minor': row} for row, mac in enumerate(macs)}
+            return SimulatedBeaconSource(lambda mac, rssi: self.on_advertisement(mac, rssi, ibeacons[mac]), macs)
+        return _BleakSource(self.on_advertisement, filtered=not self.all_devices, uuid=self.uuid)
+
+    def on_advertisement(self, mac, rssi, ibeacon=None):
+        self.advertisements += 1
+        sighting = self.table.update(mac, rssi, time.time(), ibeacon)
+        if ibeacon and self._scans:
+            for scan in self._scans.values():
+                scan.add(sighting)
+        if not self._subscribers:
+            return
+        line = (json.dumps(sighting) + '\n').encode()
+        for subscriber in self._subscribers:
+            if subscriber.ibeacon_only and ibeacon is None:
+                continue
+            try:
+                subscriber.queue.put_nowait(line)
+            except asyncio.QueueFull:
+                subscriber.dropped += 1
+                self.dropped += 1
+
+    def stats(self):
+        return {
+            'advertisements': self.advertisements,
+            'table': len(self.table),
+            'subscribers': len(self._subscribers),
+            'scans': sum(scan.running for scan in self._scans.values()),
+            'dropped': self.dropped,
+            'uptime_s': round(time.time() - self.started_at, 1) if self.started_at else 0,
+            'source': 'simulated' if self.simulate else 'bluetooth',
+            'scan_mode': getattr(self._source, 'mode', None),
+        }
+
+    async def _prune(self):
+        while True:
+            await asyncio.sleep(self.table.max_age)
+            self.table.prune(time.time())
+            self._prune_scans()
+
+    def _prune_scans(self):
+        now = time.monotonic()
+        for scan_id in [scan.id for scan in self._scans.values() if scan.expired(now)]:
+            del self._scans[scan_id]
+
+    def start_scan(self, request):
+        """Starts a scan for the "scan_start" command, or returns None if another owner's scan is running."""
+        self._prune_scans()
+        running = [scan for scan in self._scans.values() if scan.running]
+        if any(scan.owner != request.get('owner') for scan in running):
+            return None
+        for scan in running:
+            scan.finish('stopped')
+        scan = BeaconScan(request.get('owner'), float(request.get('duration', 10.0)), limit=request.get('limit'),
+                          exclude=request.get('exclude', ()), uuid=request.get('uuid'),
+                          retention=float(request.get('retention', 300.0)))
+        self._scans[scan.id] = scan
+        for sighting in self.table.recent(float(request.get('since', 0.0)), time.time(), ibeacon_only=True):
+            scan.add(sighting)
+        log.info("Beacon scan %s started for %s", scan.id[:8], scan.owner)
+        return scan
+
+    async def _scan_reply(self, request):
+        cmd = request['cmd']
+        if cmd == 'scan_start':
+            scan = self.start_scan(request)
+            if scan is None:
+                return {'error': 'Another scan is in progress, try again in a few seconds.', 'busy': True}
+            return scan.reply()
+        scan = self._scans.get(request.get('id'))
+        if scan is None:
+            return {'error': 'unknown scan'}
+        if cmd == 'scan_stop':
+            scan.finish('stopped')
+        seen = int(request.get('seen', 0))
+        await scan.wait(seen, float(request.get('wait', 0.0)))
+        return scan.reply(seen)
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        try:
+            request = json.loads(await reader.readline() or b'{}')
+            cmd = request.get('cmd')
+            if cmd == 'table':
+                sightings = self.table.recent(float(request.get('max_age', 5.0)), time.time(),
+                                              ibeacon_only=bool(request.get('ibeacon')))
+                writer.write((json.dumps({'sightings': sightings}) + '\n').encode())
+            elif cmd == 'stats':
+                writer.write((json.dumps(self.stats()) + '\n').encode())
+            elif cmd == 'subscribe':
+                await self._stream(request, reader, writer)
+            elif cmd in ('scan_start', 'scan', 'scan_stop'):
+                writer.write((json.dumps(await self._scan_reply(request)) + '\n').encode())
+            else:
+                writer.write((json.dumps({'error': f'unknown command {cmd!r}'}) + '\n').encode())
+            await writer.drain()
+        except (ValueError, AttributeError) as e:
+            writer.write((json.dumps({'error': f'bad request: {e}'}) + '\n').encode())
+        except (ConnectionError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
+
+    async def _stream(self, request, reader, writer):
+        subscriber = Subscriber(bool(request.get('ibeacon')), self.queue_size)
+        since = float(request.get('since', 0.0))
+        if since > 0:
+            for sighting in self.table.recent(since, time.time(), ibeacon_only=subscriber.ibeacon_only):
+                writer.write((json.dumps(sighting) + '\n').encode())
+        self._subscribers.add(subscriber)
+        # The client never sends anything else, so its reader only completes when it hangs up
+        hangup = asyncio.ensure_future(reader.read())
+        try:
+            while True:
+                get = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait({get, hangup}, return_when=asyncio.FIRST_COMPLETED)
+                if hangup in done:
+                    get.cancel()
+                    return
+                lines = [get.result()]
+                while not subscriber.queue.empty() and len(lines) < 256:
+                    lines.append(subscriber.queue.get_nowait())
+                stopping = None in lines  # queued by stop()
+                writer.write(b''.join(line for line in lines if line is not None))
+                await writer.drain()
+                if stopping:
+                    return
+        finally:
+            hangup.cancel()
+            self._subscribers.discard(subscriber)
+
+
+class _BleakSource:
+    """The adapter itself, passing iBeacon fields along with each advertisement."""
+
+    def __init__(self, on_advertisement, filtered=True, uuid=None):
+        self.on_advertisement = on_advertisement
+        self.filtered = filtered
+        self.uuid = uuid
+        self.mode = None
+        self._scanner = None
+
+    async def start(self):
+        def detection_callback(device, advertisement_data):
+            fields = decode_ibeacon(advertisement_data.manufacturer_data)
+            if fields is None:
+                if self.filtered:
+                    return  # the adapter couldn't filter; nobody subscribes to other devices
+                ibeacon = None
+            elif self.uuid and fields[0] != self.uuid:
+                return
+            else:
+                ibeacon = {'uuid': fields[0], 'major': fields[1], 'minor': fields[2]}
+            self.on_advertisement(device.address, advertisement_data.rssi, ibeacon)
+
+        self._scanner, self.mode = await start_scanner(detection_callback, uuid=self.uuid, filtered=self.filtered)
+
+    async def stop(self):
+        if self._scanner is not None:
+            await self._scanner.stop()
+
+
+def is_listening(path):
+    """True if a daemon accepts connections on `path`."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def request(path, payload, timeout=2.0):
+    """Sends a one-shot request (any command but "subscribe") and returns the decoded reply; raises OSError without a daemon."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps(payload) + '\n').encode())
+        with sock.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
+async def subscribe(path, since=0.0, ibeacon_only=False):
+    """
+    Opens a subscription and returns the (reader, writer) pair; each line the
+    reader yields is one JSON sighting. Raises OSError if no daemon listens.
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write((json.dumps({'cmd': 'subscribe', 'since': since, 'ibeacon': ibeacon_only}) + '\n').encode())
+    await writer.drain()
+    return reader, writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared BLE scanner for the web app and the sensor script.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f'Unix socket to serve (default {DEFAULT_SOCKET})')
+    parser.add_argument('--table-seconds', type=float, default=30.0, help='how long a silent MAC stays in the table')
+    parser.add_argument('--queue-size', type=int, default=1024, help='lines a slow subscriber may fall behind')
+    parser.add_argument('--simulate', type=int, metavar='BEACONS', help='serve simulated iBeacons instead')
+    parser.add_argument('--all-devices', action='store_true', help='serve every BLE device, not just iBeacons')
+    parser.add_argument('--uuid', help='serve only iBeacons with this proximity UUID')
+    parser.add_argument('--stats-every', type=float, default=60.0, help='seconds between logged stats (0: never)')
+    args = parser.parse_args()
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter())
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+
+    async def run():
+        daemon = BleDaemon(args.socket, table_seconds=args.table_seconds, queue_size=args.queue_size,
+                           simulate=args.simulate, all_devices=args.all_devices,
+                           uuid=args.uuid.replace('-', '').lower() if args.uuid else None)
+        await daemon.start()
+        # Shut down cleanly (removing the socket) when systemd or kill stops the daemon
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        log.info("BLE daemon listening on %s", args.socket)
+        try:
+            while True:
+                await asyncio.sleep(args.stats_every or 3600)
+                if args.stats_every:
+                    log.info("BLE daemon: %s", daemon.stats())
+        finally:
+            await daemon.stop()
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        log.info("BLE daemon stopped.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import logging
+import threading
+
+import requests
+
+log = logging.getLogger(__name__)
+
+
+def laptop_maps(config):
+    """(iBeacon MAC -> serial, serial -> ultrasonic sensor index) for the laptops in an /api/config response."""
+    ibeacon_map = {}
+    ultrasonic_map = {}
+    for laptop in config['laptops']:
+        ibeacon_mac = laptop['ibeacon_mac_address']
+        serial_number = laptop['serial_number']
+        sensor_index = laptop['ultrasonic_sensor_index']
+        if ibeacon_mac and serial_number and sensor_index is not None:
+            ibeacon_map[ibeacon_mac] = serial_number
+            ultrasonic_map[serial_number] = sensor_index
+    return ibeacon_map, ultrasonic_map
+
+
+def diff_maps(old, new):
+    """(added, removed, changed) keys going from `old` to `new`; changed keys map to a different value."""
+    added = new.keys() - old.keys()
+    removed = old.keys() - new.keys()
+    changed = {key for key in old.keys() & new.keys() if old[key] != new[key]}
+    return added, removed, changed
+
+
+class ConfigSync:
+    """
+    Keeps the Pi's laptop maps in step with the server's /api/config.
+
+    fetch() loads the configuration once at startup. After start(), a
+    background thread long-polls the same endpoint, sending the version it
+    holds as If-None-Match: the server answers as soon as a laptop is added,
+    removed or moved to another station, or with 304 Not Modified after
+    `wait` seconds. Every newer configuration is handed to
+    `on_change(version, ibeacon_map, ultrasonic_map)` on that thread. While
+    the server is unreachable the thread backs off exponentially, passing
+    each failure to `on_error` if given. With `token` set, every request
+    sends it as a bearer token (the server's CONFIG_TOKEN).
+    """
+
+    def __init__(self, url, station=None, wait=30, timeout=10, min_backoff=1.0, max_backoff=60.0, on_change=None,
+                 on_error=None, token=None):
+        self.url = url
+        self.station = station
+        self.token = token
+        self.wait = wait
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_change = on_change
+        self.on_error = on_error
+        self.version = None
+        self.updates = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def fetch(self, session=requests, wait=0):
+        """
+        Returns (version, ibeacon_map, ultrasonic_map), or None if the server
+        still has the version fetched last. Raises requests' exceptions when
+        the server can't be reached or answers with an error.
+        """
+        params = {}
+        if self.station:
+            params['station'] = self.station
+        if wait:
+            params['wait'] = wait
+        headers = {}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if self.version is not None:
+            headers['If-None-Match'] = f'"{self.version}"'
+        response = session.get(self.url, params=params, headers=headers, timeout=self.timeout + wait)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        config = response.json()
+        self.version = config['version']
+        return (config['version'],) + laptop_maps(config)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='config-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1):
+        # A long-poll in flight isn't interrupted; the daemon thread just ends with the script
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        session = requests.Session()
+        backoff = self.min_backoff
+        try:
+            while not self._stopping.is_set():
+                try:
+                    config = self.fetch(session, wait=self.wait)
+                    backoff = self.min_backoff
+                except (requests.exceptions.RequestException, KeyError) as e:
+                    log.warning("Config sync failed, retrying in %.0fs: %s", backoff, e)
+                    if self.on_error:
+                        self.on_error(e)
+                    self._stopping.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                if config is not None and not self._stopping.is_set():
+                    self.updates += 1
+                    self.on_change(*config)
+        finally:
+            session.close()
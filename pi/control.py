@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import json
+import os
+import socketserver
+import threading
+import time
+
+from pi.ble_daemon import is_listening, request
+
+# The sensor script answers on a local Unix socket so the web app, whichever
+# worker serves the dashboard, can see whether it runs, how healthy it is and
+# tell it what to do. The socket is served from its own thread, so a status
+# request still answers (with a stale heartbeat) if the detection loop hangs.
+#
+# A client sends one JSON line and gets one JSON line back:
+#
+#   {"cmd": "status"}    heartbeat, tick duration, advertisements and frames per
+#                        second, HTTP queue and spool depth, last error
+#   {"cmd": "stop"}      shuts the script down as Ctrl+C would
+#   {"cmd": "reload"}    fetches the laptop configuration from the server now
+#                        instead of waiting for the next long-poll answer
+#
+# Unknown commands and failed ones answer {"error": "..."}.
+
+DEFAULT_SOCKET = '/tmp/laptop-security-sensor.sock'
+
+
+class LoopMetrics:
+    """
+    Health of the detection loop. Callbacks only bump plain counters; rates
+    are worked out when status is asked for, from the counts recorded at the
+    heartbeats of the last `window` seconds.
+    """
+
+    def __init__(self, window=10.0, ticks_kept=100):
+        self.window = window
+        self.started_at = time.time()
+        self.advertisements = 0
+        self.frames = 0
+        self.ticks = 0
+        self.heartbeat = None
+        self.loop_lag = 0.0
+        self.last_error = None
+        self._tick_seconds = collections.deque(maxlen=ticks_kept)
+        self._samples = collections.deque()
+        self._lock = threading.Lock()
+
+    def tick(self, seconds):
+        with self._lock:
+            self.ticks += 1
+            self._tick_seconds.append(seconds)
+
+    def error(self, source, message):
+        # Called from the loop, the HTTP workers and the serial and config threads
+        self.last_error = {'source': source, 'message': str(message), 'at': time.time()}
+
+    def beat(self, lag):
+        now = time.monotonic()
+        with self._lock:
+            self.heartbeat = time.time()
+            self.loop_lag = lag
+            self._samples.append((now, self.advertisements, self.frames))
+            # Keep one sample at least `window` old to measure the rates from
+            while len(self._samples) > 1 and now - self._samples[1][0] >= self.window:
+                self._samples.popleft()
+
+    def as_dict(self):
+        now = time.monotonic()
+        with self._lock:
+            ticks = list(self._tick_seconds)
+            oldest = self._samples[0] if self._samples else None
+            heartbeat, lag = self.heartbeat, self.loop_lag
+        advertisements, frames = self.advertisements, self.frames
+        seconds = now - oldest[0] if oldest else 0
+        return {
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'heartbeat': heartbeat,
+            'heartbeat_age_s': round(time.time() - heartbeat, 1) if heartbeat else None,
+            'loop_lag_ms': round(lag * 1000, 1),
+            'ticks': self.ticks,
+            'tick_ms': {
+                'last': round(ticks[-1] * 1000, 2),
+                'mean': round(sum(ticks) / len(ticks) * 1000, 2),
+                'max': round(max(ticks) * 1000, 2),
+            } if ticks else None,
+            'advertisements': advertisements,
+            'frames': frames,
+            'advertisements_per_s': round((advertisements - oldest[1]) / seconds, 1) if seconds > 0 else None,
+            'frames_per_s': round((frames - oldest[2]) / seconds, 1) if seconds > 0 else None,
+            'last_error': self.last_error,
+        }
+
+
+async def heartbeat(metrics, interval=1.0):
+    """Beats every `interval` seconds from the event loop, recording how late each beat ran."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        metrics.beat(max(0.0, loop.time() - expected))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    """
+    Serves `commands` (name -> function taking the request dict and returning
+    the reply dict) on the Unix socket `path`. Only one script can hold the
+    socket, so start() raises RuntimeError if another one already answers.
+    """
+
+    def __init__(self, path, commands):
+        self.path = path
+        self.commands = commands
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise RuntimeError(f'A sensor script is already listening on {self.path}')
+            os.unlink(self.path)  # left over from a script that didn't shut down cleanly
+        commands = self.commands
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    payload = json.loads(self.rfile.readline() or b'{}')
+                    command = commands.get(payload.get('cmd'))
+                    if command is None:
+                        reply = {'error': f"unknown command {payload.get('cmd')!r}"}
+                    else:
+                        reply = command(payload)
+                except (ValueError, AttributeError) as e:
+                    reply = {'error': f'bad request: {e}'}
+                except Exception as e:
+                    reply = {'error': str(e)}
+                try:
+                    self.wfile.write((json.dumps(reply) + '\n').encode())
+                except OSError:
+                    pass
+
+        self._server = _Server(self.path, Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='control-socket', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def remove_pid_file(path, pid):
+    """Deletes the pid file at `path` if it still names `pid`, leaving one written for a newer script alone."""
+    try:
+        with open(path) as pid_file:
+            if int(pid_file.read()) != pid:
+                return
+        os.remove(path)
+    except (OSError, ValueError):
+        pass
+
+
+def send(path, cmd, timeout=2.0):
+    """Sends `cmd` to the script listening on `path` and returns its reply; raises OSError if none listens."""
+    return request(path, {'cmd': cmd}, timeout=timeout)
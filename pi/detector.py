@@ -0,0 +1,185 @@
+import heapq
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class EventDetector:
+    """
+    Decides which laptops are missing or moved as soon as an event arrives,
+    instead of once per polling tick:
+
+    - a BLE advertisement refreshes its beacon's deadline and, if the beacon
+      was missing, re-evaluates its laptop straight away;
+    - a new ultrasonic frame re-evaluates every laptop whose beacon is present;
+    - `expire` marks beacons missing once their deadline has passed. Deadlines
+      live in a heap with at most one entry per beacon, so finding the next
+      one to wait for is O(1) and expiring one is O(log n).
+
+    With a `presence` tracker (pi.presence.PresenceTracker) beacons instead go
+    missing and come back through its N-of-M hysteresis, evaluated for all
+    beacons at once whenever one of its slots closes.
+
+    The detector never touches the clock, GPIO or the network. Callers pass
+    `now` in (any monotonic clock) and get told about changes through
+    `on_status(serial, is_stolen)` and `on_alarm(active, reason)`.
+    """
+
+    def __init__(self, beacon_to_serial, serial_to_sensor, min_distance_cm, beacon_timeout,
+                 on_status, on_alarm, presence=None):
+        self.beacon_to_serial = dict(beacon_to_serial)
+        self.serial_to_sensor = dict(serial_to_sensor)
+        self.min_distance_cm = min_distance_cm
+        self.beacon_timeout = beacon_timeout
+        self.on_status = on_status
+        self.on_alarm = on_alarm
+        self.presence = presence
+        self.deadlines = {}
+        self.missing = set()
+        self.moved = set()
+        self.distances = None
+        self.alarm_active = False
+        self._heap = []
+        self._queued = set()
+        self._seen = {}
+
+    def start(self, now):
+        """Gives every beacon one timeout from `now` to show up."""
+        if self.presence is not None:
+            self.presence.start(now)
+            return
+        self.deadlines = {mac: now + self.beacon_timeout for mac in self.beacon_to_serial}
+        self._heap = [(deadline, mac) for mac, deadline in self.deadlines.items()]
+        heapq.heapify(self._heap)
+        self._queued = set(self.deadlines)
+
+    def set_laptops(self, beacon_to_serial, serial_to_sensor, now):
+        """
+        Switches to a new set of laptops while running. Beacons that stay keep
+        their deadline (or presence window) and missing/moved state; new ones
+        get one timeout from `now` to show up, as at start; removed ones are
+        forgotten, which may end the alarm they were causing. A beacon now
+        tagged on another laptop counts as removed and added.
+        """
+        changed = {mac for mac, serial in beacon_to_serial.items() if self.beacon_to_serial.get(mac, serial) != serial}
+        removed = (self.beacon_to_serial.keys() - beacon_to_serial.keys()) | changed
+        added = (beacon_to_serial.keys() - self.beacon_to_serial.keys()) | changed
+        for mac in removed:
+            self.missing.discard(mac)
+            self.moved.discard(self.beacon_to_serial[mac])
+            self.deadlines.pop(mac, None)  # a leftover heap entry is skipped by `expire`
+            self._seen.pop(mac, None)
+        self.beacon_to_serial = dict(beacon_to_serial)
+        self.serial_to_sensor = dict(serial_to_sensor)
+
+        if self.presence is not None:
+            self.presence.set_beacons(self.beacon_to_serial)
+        else:
+            for mac in added:
+                self.deadlines[mac] = now + self.beacon_timeout
+                if mac not in self._queued:
+                    heapq.heappush(self._heap, (self.deadlines[mac], mac))
+                    self._queued.add(mac)
+        self._update_alarm()
+
+    def on_advertisement(self, mac, rssi, now):
+        serial = self.beacon_to_serial.get(mac)
+        if serial is None:
+            return
+        self._seen[mac] = rssi
+        if self.presence is not None:
+            self.presence.observe(mac, rssi, now)
+            return
+        # A queued beacon keeps its old heap entry; `expire` re-queues it with this deadline
+        self.deadlines[mac] = now + self.beacon_timeout
+        if mac not in self._queued:
+            heapq.heappush(self._heap, (self.deadlines[mac], mac))
+            self._queued.add(mac)
+        if mac in self.missing:
+            self._back([mac])
+
+    def on_frame(self, distances, now):
+        self.distances = distances
+        for mac, serial in self.beacon_to_serial.items():
+            if mac not in self.missing:
+                self._evaluate(serial)
+        self._update_alarm()
+
+    def next_deadline(self):
+        """When `expire` next has something to do, or None."""
+        if self.presence is not None:
+            return self.presence.next_evaluation
+        return self._heap[0][0] if self._heap else None
+
+    def expire(self, now):
+        if self.presence is not None:
+            absent, present = self.presence.advance(now)
+            if present:
+                self._back(present)
+            return self._gone(absent)
+
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, mac = heapq.heappop(self._heap)
+            current = self.deadlines.get(mac)
+            if current is None:
+                self._queued.discard(mac)  # removed by set_laptops
+                continue
+            if current > deadline:
+                heapq.heappush(self._heap, (current, mac))  # seen since; wait for the newer deadline
+                continue
+            # Stays off the heap until the beacon is seen again
+            self._queued.discard(mac)
+            if mac not in self.missing:
+                expired.append(mac)
+        return self._gone(expired)
+
+    def _gone(self, macs):
+        for mac in macs:
+            self.missing.add(mac)
+            self.on_status(self.beacon_to_serial[mac], True)
+        if macs:
+            log.warning("iBeacons missing: %s", ', '.join(macs))
+            self._update_alarm()
+        return macs
+
+    def _back(self, macs):
+        for mac in macs:
+            self.missing.discard(mac)
+            log.info("iBeacon %s (%s) is back.", mac, self.beacon_to_serial[mac])
+            self._evaluate(self.beacon_to_serial[mac])
+        self._update_alarm()
+
+    def report(self):
+        """
+        (mac, serial, rssi, is_moved) for every beacon heard since the last
+        report, with its latest RSSI.
+        """
+        seen, self._seen = self._seen, {}
+        return [(mac, self.beacon_to_serial[mac], rssi, self.beacon_to_serial[mac] in self.moved)
+                for mac, rssi in seen.items()]
+
+    def _evaluate(self, serial):
+        sensor_index = self.serial_to_sensor.get(serial)
+        is_moved = False
+        if sensor_index is not None and self.distances is not None:
+            distance = self.distances[sensor_index]
+            is_moved = distance > self.min_distance_cm
+            if is_moved and serial not in self.moved:
+                log.warning("Laptop %s moved! Distance is %s cm", serial, distance)
+        if is_moved:
+            self.moved.add(serial)
+        else:
+            self.moved.discard(serial)
+        self.on_status(serial, is_moved)
+
+    def _update_alarm(self):
+        active = bool(self.missing or self.moved)
+        if active == self.alarm_active:
+            return
+        self.alarm_active = active
+        if active:
+            reasons = [f"{mac} missing" for mac in sorted(self.missing)] + [f"{s} moved" for s in sorted(self.moved)]
+            self.on_alarm(True, ', '.join(reasons))
+        else:
+            self.on_alarm(False, "all beacons found and laptops are close")
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import time
+
+import numpy as np
+
+from pi.serial_reader import SerialFrameReader
+
+log = logging.getLogger(__name__)
+
+# Backends for the three pieces of hardware the sensor script talks to, so
+# the detection loop can run (and be load-tested) away from a Raspberry Pi:
+#
+# - beacon sources call `on_advertisement(mac, rssi)` on the event loop and
+#   are started/stopped with `await start()` / `await stop()`;
+# - distance sources have the SerialFrameReader interface (start, stop,
+#   latest, window, since, stats, on_frame);
+# - alarm outputs have on(), off() and close().
+#
+# Hardware libraries are imported when a backend starts, not at import time.
+
+
+class BleakBeaconSource:
+    """
+    Real BLE advertisements from the Pi's Bluetooth adapter. Where BlueZ
+    supports it the adapter only passes iBeacons on (see
+    pi.ibeacon.start_scanner); `callbacks` counts the advertisements that
+    still reached Python.
+    """
+
+    def __init__(self, on_advertisement, filtered=True):
+        self.on_advertisement = on_advertisement
+        self.filtered = filtered
+        self.mode = None
+        self.callbacks = 0
+        self._scanner = None
+
+    async def start(self):
+        from pi.ibeacon import start_scanner
+
+        def detection_callback(device, advertisement_data):
+            self.callbacks += 1
+            self.on_advertisement(device.address, advertisement_data.rssi)
+
+        self._scanner, self.mode = await start_scanner(detection_callback, filtered=self.filtered)
+
+    async def stop(self):
+        if self._scanner is not None:
+            await self._scanner.stop()
+
+
+class DaemonBeaconSource:
+    """
+    Advertisements from the BLE daemon (pi/ble_daemon.py), which owns the
+    adapter and shares it with the web app's beacon discovery. If the daemon
+    goes away the source keeps reconnecting every `retry_seconds`.
+    """
+
+    def __init__(self, on_advertisement, path, retry_seconds=2.0):
+        self.on_advertisement = on_advertisement
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.received = 0
+        self.reconnects = 0
+        self._task = None
+
+    async def start(self):
+        from pi.ble_daemon import subscribe
+
+        # Fail at start if there is no daemon, like BleakBeaconSource without an adapter
+        self._task = asyncio.create_task(self._run(*await subscribe(self.path)))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, reader, writer):
+        from pi.ble_daemon import subscribe
+
+        while True:
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    sighting = json.loads(line)
+                    self.received += 1
+                    self.on_advertisement(sighting['mac'], sighting['rssi'])
+            finally:
+                writer.close()
+            log.warning("Lost the BLE daemon at %s, reconnecting...", self.path)
+            while True:
+                await asyncio.sleep(self.retry_seconds)
+                try:
+                    reader, writer = await subscribe(self.path)
+                    self.reconnects += 1
+                    break
+                except OSError:
+                    pass
+
+
+class SimulatedBeaconSource:
+    """
+    Synthetic iBeacons, each advertising every `interval` seconds (+/- 10%
+    jitter) with an RSSI around its own base level plus Gaussian noise.
+
+    Movement and dropout patterns:
+    - `dropout`: chance that any single advertisement is lost;
+    - `departure_rate`: chance per beacon per hour of it leaving the room,
+      staying silent for `absence_seconds`;
+    - `leave(mac, seconds)`: scripts a departure for one beacon.
+
+    Due advertisements are picked with vectorized NumPy operations every
+    `step` seconds, so thousands of beacons cost little beyond the callbacks.
+    """
+
+    def __init__(self, on_advertisement, macs, interval=1.0, dropout=0.05, departure_rate=0.0,
+                 absence_seconds=30.0, rssi_noise=4.0, step=0.05, seed=None):
+        self.on_advertisement = on_advertisement
+        self.macs = list(macs)
+        self.interval = interval
+        self.dropout = dropout
+        self.departure_rate = departure_rate
+        self.absence_seconds = absence_seconds
+        self.rssi_noise = rssi_noise
+        self.step = step
+        self.sent = 0
+        self.lost = 0
+        self._rng = np.random.default_rng(seed)
+        self._index = {mac: row for row, mac in enumerate(self.macs)}
+        self._base_rssi = self._rng.uniform(-80, -55, len(self.macs))
+        self._away_until = np.zeros(len(self.macs))
+        self._task = None
+        self._loop = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def leave(self, mac, seconds):
+        """Silences one beacon for `seconds`, as if its laptop was carried away and brought back."""
+        self._away_until[self._index[mac]] = self._loop.time() + seconds
+
+    async def _run(self):
+        count = len(self.macs)
+        next_advertisement = self._loop.time() + self._rng.uniform(0, self.interval, count)
+        while True:
+            await asyncio.sleep(self.step)
+            now = self._loop.time()
+
+            if self.departure_rate:
+                leaving = self._rng.random(count) < self.departure_rate * self.step / 3600
+                leaving &= self._away_until <= now
+                self._away_until[leaving] = now + self.absence_seconds
+
+            due = np.flatnonzero(next_advertisement <= now)
+            if not due.size:
+                continue
+            next_advertisement[due] = np.maximum(
+                next_advertisement[due] + self.interval * self._rng.uniform(0.9, 1.1, due.size), now
+            )
+            heard = due[(self._rng.random(due.size) >= self.dropout) & (self._away_until[due] <= now)]
+            self.lost += due.size - heard.size
+            rssi = np.rint(self._base_rssi[heard] + self._rng.normal(0, self.rssi_noise, heard.size))
+            for row, value in zip(heard.tolist(), rssi.astype(int).tolist()):
+                self.on_advertisement(self.macs[row], value)
+            self.sent += heard.size
+
+
+class SimulatedDistanceSource(SerialFrameReader):
+    """
+    Stands in for the Arduino: writes `frame_rate` frames a second of
+    `sensors` distances around `rest_cm` through the same line parser and
+    ring buffer as the serial reader. A sensor is "lifted" (reads `lifted_cm`)
+    at random, `lift_rate` times per sensor per hour for `lift_seconds`, or
+    on demand with `lift(sensor, seconds)`.
+    """
+
+    def __init__(self, frame_rate=10.0, sensors=4, rest_cm=2.0, noise_cm=0.3, lift_rate=0.0,
+                 lift_seconds=10.0, lifted_cm=30.0, capacity=256, on_frame=None, seed=None):
+        super().__init__(None, None, capacity=capacity, values_per_frame=sensors, on_frame=on_frame)
+        self.frame_rate = frame_rate
+        self.sensors = sensors
+        self.rest_cm = rest_cm
+        self.noise_cm = noise_cm
+        self.lift_rate = lift_rate
+        self.lift_seconds = lift_seconds
+        self.lifted_cm = lifted_cm
+        self._rng = np.random.default_rng(seed)
+        self._lifted_until = np.zeros(sensors)
+
+    def lift(self, sensor, seconds):
+        self._lifted_until[sensor] = time.monotonic() + seconds
+
+    def _run(self):
+        period = 1.0 / self.frame_rate
+        while not self._stopping.wait(period):
+            now = time.monotonic()
+            if self.lift_rate:
+                lifting = self._rng.random(self.sensors) < self.lift_rate * period / 3600
+                self._lifted_until[lifting & (self._lifted_until <= now)] = now + self.lift_seconds
+            distances = np.where(self._lifted_until > now, self.lifted_cm, self.rest_cm)
+            distances = np.maximum(distances + self._rng.normal(0, self.noise_cm, self.sensors), 0)
+            self._handle_line((','.join(f'{d:.2f}' for d in distances) + '\n').encode())
+
+
+class GpioBuzzer:
+    """The buzzer on a Raspberry Pi GPIO pin (BCM numbering), set up on first use."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self._gpio = None
+
+    def _setup(self):
+        if self._gpio is None:
+            import RPi.GPIO as GPIO
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(self.pin, GPIO.OUT)
+            self._gpio = GPIO
+        return self._gpio
+
+    def on(self):
+        gpio = self._setup()
+        gpio.output(self.pin, gpio.HIGH)
+
+    def off(self):
+        gpio = self._setup()
+        gpio.output(self.pin, gpio.LOW)
+
+    def close(self):
+        if self._gpio is not None:
+            self._gpio.cleanup()
+            self._gpio = None
+
+
+class SimulatedBuzzer:
+    """Records what a buzzer would have done: how often and how long it sounded."""
+
+    def __init__(self):
+        self.is_on = False
+        self.beeps = 0
+        self.seconds_on = 0.0
+        self._on_since = None
+
+    def on(self):
+        if not self.is_on:
+            self.is_on = True
+            self.beeps += 1
+            self._on_since = time.monotonic()
+
+    def off(self):
+        if self.is_on:
+            self.is_on = False
+            self.seconds_on += time.monotonic() - self._on_since
+
+    def close(self):
+        self.off()
+
+
+def simulated_laptops(count, sensors=4):
+    """Beacon and sensor maps for `count` synthetic laptops, shaped like the ones read from the database."""
+    ibeacon_map = {f'02:00:{i >> 24 & 0xff:02X}:{i >> 16 & 0xff:02X}:{i >> 8 & 0xff:02X}:{i & 0xff:02X}': f'SIM{i:06d}'
+                   for i in range(count)}
+    ultrasonic_map = {serial: i % sensors for i, serial in enumerate(ibeacon_map.values())}
+    return ibeacon_map, ultrasonic_map
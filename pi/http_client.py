@@ -0,0 +1,144 @@
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Latency samples kept per endpoint for the percentile stats
+LATENCY_SAMPLES = 256
+
+_STOP = object()
+
+
+class EndpointStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, elapsed, ok):
+        self.latencies.append(elapsed)
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return {'sent': self.sent, 'failed': self.failed}
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(ordered[-1] * 1000, 1),
+        }
+
+
+class ApiSender:
+    """
+    Sends HTTP requests to the Flask API from a small pool of worker threads
+    so the asyncio loop never waits on the network. Each worker keeps its own
+    keep-alive session, and at most `workers` requests are in flight at once.
+
+    `submit` only enqueues; when the bounded queue is full the request is
+    dropped and counted instead of blocking the caller. Callbacks run on the
+    event loop passed to `start`, so they can safely touch loop-owned state.
+    """
+
+    def __init__(self, workers=2, queue_size=256, timeout=5):
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._loop = None
+
+    def start(self, loop=None):
+        self._loop = loop
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'api-sender-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Lets queued requests drain for up to `timeout` seconds, then stops the workers."""
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self.queue.put(_STOP, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, name, url, payload, on_success=None, on_error=None):
+        """
+        Queues a JSON POST to `url`. `name` groups the call in the stats.
+        Returns False if the queue was full and the request was dropped.
+        """
+        try:
+            self.queue.put_nowait((name, url, payload, on_success, on_error))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self.queue.qsize(),
+                'dropped': self.dropped,
+                'endpoints': {name: stats.summary() for name, stats in self._stats.items()},
+            }
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _run(self):
+        session = self._new_session()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _STOP:
+                    return
+                name, url, payload, on_success, on_error = item
+                started = time.monotonic()
+                try:
+                    response = session.post(url, json=payload, timeout=self.timeout)
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    self._record(name, started, ok=False)
+                    self._callback(on_error, e)
+                else:
+                    self._record(name, started, ok=True)
+                    self._callback(on_success, response)
+        finally:
+            session.close()
+
+    def _record(self, name, started, ok):
+        with self._lock:
+            self._stats[name].record(time.monotonic() - started, ok)
+
+    def _callback(self, callback, arg):
+        if callback is None:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(callback, arg)
+        else:
+            callback(arg)
@@ -0,0 +1,151 @@
+import functools
+import logging
+import struct
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+APPLE_COMPANY_ID = 0x004c
+IBEACON_PREFIX = bytes([0x02, 0x15])
+
+# Apple manufacturer data of an iBeacon: 0x02 0x15, 16 byte proximity UUID,
+# major and minor (big endian), then the calibrated TX power we don't use
+IBEACON = struct.Struct('>2s16sHH')
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode(data):
+    if len(data) < IBEACON.size:
+        return None
+    prefix, uuid, major, minor = IBEACON.unpack_from(data)
+    if prefix != IBEACON_PREFIX:
+        return None
+    return uuid.hex(), major, minor
+
+
+def decode_ibeacon(manufacturer_data):
+    """
+    (uuid, major, minor) from bleak's manufacturer_data, or None if it isn't
+    an iBeacon. A tag repeats the same payload in every advertisement, so
+    decoded payloads are cached.
+    """
+    data = manufacturer_data.get(APPLE_COMPANY_ID)
+    if data is None:
+        return None
+    return _decode(bytes(data))
+
+
+def or_patterns(uuid=None):
+    """
+    BlueZ advertisement monitor patterns matching iBeacons (of one proximity
+    UUID if given), so the adapter drops every other device's advertisements.
+    """
+    from bleak.assigned_numbers import AdvertisementDataType
+
+    # Manufacturer data as it is on air: company id (little endian), then the payload
+    prefix = APPLE_COMPANY_ID.to_bytes(2, 'little') + IBEACON_PREFIX
+    if uuid:
+        prefix += bytes.fromhex(uuid.replace('-', ''))
+    return [(0, AdvertisementDataType.MANUFACTURER_SPECIFIC_DATA, prefix)]
+
+
+async def start_scanner(detection_callback, uuid=None, filtered=True):
+    """
+    Starts a BleakScanner and returns (scanner, mode). With `filtered`, on
+    Linux it first tries a passive scan the adapter filters down to iBeacons
+    (mode "filtered"; needs BlueZ 5.56+ running with --experimental), and
+    otherwise scans everything (mode "active"), leaving the filtering to the
+    callback.
+    """
+    from bleak import BleakScanner
+
+    if filtered and sys.platform.startswith('linux'):
+        scanner = BleakScanner(detection_callback, scanning_mode='passive', bluez={'or_patterns': or_patterns(uuid)})
+        try:
+            await scanner.start()
+            return scanner, 'filtered'
+        except Exception as e:
+            log.warning("Adapter-level iBeacon filtering unavailable (%s); scanning all devices.", e)
+    scanner = BleakScanner(detection_callback)
+    await scanner.start()
+    return scanner, 'active'
+
+
+class BeaconStats:
+    """Running statistics of one beacon's advertisements over a scan."""
+
+    __slots__ = ('mac_address', 'uuid', 'major', 'minor', 'count', 'rssi_min', 'rssi_max', 'rssi_sum',
+                 'first_seen', 'last_seen')
+
+    def __init__(self, mac_address, uuid, major, minor):
+        self.mac_address = mac_address
+        self.uuid = uuid
+        self.major = major
+        self.minor = minor
+        self.count = 0
+        self.rssi_min = None
+        self.rssi_max = None
+        self.rssi_sum = 0
+        self.first_seen = None
+        self.last_seen = None
+
+    def add(self, rssi, now):
+        if self.count == 0:
+            self.rssi_min = self.rssi_max = rssi
+            self.first_seen = now
+        elif rssi < self.rssi_min:
+            self.rssi_min = rssi
+        elif rssi > self.rssi_max:
+            self.rssi_max = rssi
+        self.count += 1
+        self.rssi_sum += rssi
+        self.last_seen = now
+
+    @property
+    def rssi_mean(self):
+        return self.rssi_sum / self.count if self.count else None
+
+    def as_dict(self):
+        """The beacon as discovery reports it; "rssi" is the mean over the scan so far."""
+        mean = self.rssi_mean
+        return {
+            'mac_address': self.mac_address,
+            'uuid': self.uuid,
+            'major': self.major,
+            'minor': self.minor,
+            'rssi': round(mean) if mean is not None else None,
+            'count': self.count,
+            'rssi_min': self.rssi_min,
+            'rssi_max': self.rssi_max,
+            'rssi_mean': round(mean, 1) if mean is not None else None,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+        }
+
+
+class ScanCounters:
+    """
+    How many advertisements reached a scan's Python callback and how many of
+    those were iBeacons, to show what adapter-level filtering saves.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.callbacks = 0
+        self.ibeacons = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def as_dict(self):
+        seconds = (self.finished or time.monotonic()) - self.started
+        return {
+            'mode': self.mode,
+            'callbacks': self.callbacks,
+            'ibeacons': self.ibeacons,
+            'seconds': round(seconds, 2),
+            'callbacks_per_second': round(self.callbacks / seconds, 1) if seconds > 0 else None,
+        }
@@ -0,0 +1,167 @@
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and is logged as a field
+_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One line per record: "<time> <LEVEL> <logger>: <message>", followed by
+    the record's `extra` fields as key=value. The message text is kept as it
+    was printed before, so pi.trace can still parse the log.
+    """
+
+    default_time_format = '%Y-%m-%dT%H:%M:%S'
+    default_msec_format = '%s.%03d'
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [(key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES]
+        if fields:
+            line += ' ' + ' '.join(f'{key}={_field(value)}' for key, value in fields)
+        return line
+
+
+def _field(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "='):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets each message type, a logger and message template pair, through at
+    `rate` records a second on average with bursts of up to `burst`. Records
+    over the limit are dropped and counted; the next one of that type that
+    gets through carries the count as its "suppressed" field. `limits` maps
+    a message template to its own (rate, burst). Records at `exempt_level`
+    or above are never dropped.
+
+    At most once every `prune_seconds` the buckets that have refilled and
+    hold no suppressed count are forgotten, as a new bucket would be the
+    same; past `max_types` message types the oldest bucket is dropped, so
+    messages built with f-strings can't grow the table without bound.
+    """
+
+    def __init__(self, rate=1.0, burst=20, limits=None, exempt_level=logging.CRITICAL, max_types=1000,
+                 prune_seconds=60.0):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits or {}
+        self.exempt_level = exempt_level
+        self.max_types = max_types
+        self.prune_seconds = prune_seconds
+        self.suppressed = 0
+        self._buckets = {}
+        self._next_prune = time.monotonic() + prune_seconds
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_types:
+                    del self._buckets[next(iter(self._buckets))]
+                rate, burst = self.limits.get(record.msg, (self.rate, self.burst))
+                # [tokens, last refill, rate, burst, suppressed since the last record that passed]
+                bucket = self._buckets[key] = [burst, now, rate, burst, 0]
+            bucket[0] = min(bucket[3], bucket[0] + (now - bucket[1]) * bucket[2])
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[4] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[4] = bucket[4], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def _prune(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[4] or bucket[0] + (now - bucket[1]) * bucket[2] < bucket[3]}
+        self._next_prune = now + self.prune_seconds
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a QueueListener without ever blocking: records that find the queue full are dropped."""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def rotating_handler(path, max_bytes=5 * 1024 * 1024, backups=5, when=None):
+    """
+    A file handler that rotates `path` once it reaches `max_bytes`, or at
+    `when` (as for TimedRotatingFileHandler, e.g. "midnight") if given,
+    keeping `backups` gzipped old files.
+    """
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backups, encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(path, level='INFO', max_bytes=5 * 1024 * 1024, backups=5, when=None, rate=1.0, burst=20,
+                  rate_limits=None, queue_size=10000, console=None):
+    """
+    Sends every logger's records through a rate limit and a bounded queue to
+    a thread that writes them to the rotating log file `path`, and to stderr
+    as well when `console` (by default: stderr is a terminal). Logging then
+    never waits for the SD card. Returns the QueueListener, whose stop()
+    writes out what is still queued.
+    """
+    formatter = StructuredFormatter()
+    handlers = [rotating_handler(path, max_bytes=max_bytes, backups=backups, when=when)]
+    if console if console is not None else sys.stderr.isatty():
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(rate, burst, rate_limits))
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(records, *handlers)
+    listener.start()
+    return listener
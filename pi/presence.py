@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class PresenceTracker:
+    """
+    Decides per beacon whether it is present, using more than the last
+    advertisement so one missed packet doesn't raise the alarm.
+
+    Time is cut into slots of `slot_seconds`. A beacon counts as heard in a
+    slot if it advertised during it (and, with `min_rssi` set, its smoothed
+    RSSI was at least that strong). Over the last `window` slots a present
+    beacon turns absent once it was missed in `absent_slots` of them, and an
+    absent beacon turns present again once it was heard in `present_slots`
+    of them; in between it keeps its state (hysteresis). RSSI is smoothed
+    with an exponentially weighted moving average.
+
+    All state is kept in NumPy arrays with one row per beacon, so closing a
+    slot is a handful of vectorized operations however many beacons there are.
+    """
+
+    def __init__(self, beacons, slot_seconds=1.0, window=5, absent_slots=3, present_slots=3,
+                 alpha=0.3, min_rssi=None):
+        if not 0 < absent_slots <= window or not 0 < present_slots <= window:
+            raise ValueError('absent_slots and present_slots must be between 1 and window')
+        if absent_slots + present_slots <= window:
+            raise ValueError('absent_slots + present_slots must exceed window, or a beacon could be both')
+        self.beacons = list(beacons)
+        self.index = {mac: row for row, mac in enumerate(self.beacons)}
+        self.slot_seconds = slot_seconds
+        self.window = window
+        self.absent_slots = absent_slots
+        self.present_slots = present_slots
+        self.alpha = alpha
+        self.min_rssi = min_rssi
+
+        count = len(self.beacons)
+        # Beacons start out present with a full window, so a beacon that is
+        # never heard is reported absent after `absent_slots` slots.
+        self.heard = np.ones((count, window), dtype=bool)
+        self.rssi = np.full((count, window), np.nan, dtype=np.float32)
+        self.smoothed = np.full(count, np.nan, dtype=np.float32)
+        self.present = np.ones(count, dtype=bool)
+        self._heard_now = np.zeros(count, dtype=bool)
+        self._rssi_now = np.full(count, np.nan, dtype=np.float32)
+        self._column = 0
+        self._slot_end = None
+
+    def start(self, now):
+        self._slot_end = now + self.slot_seconds
+
+    def set_beacons(self, beacons):
+        """
+        Switches to a new list of beacons. Those tracked before keep their
+        window, RSSI and state; new ones start out present with a full window,
+        like every beacon at construction.
+        """
+        beacons = list(beacons)
+        rows = np.array([self.index.get(mac, -1) for mac in beacons], dtype=np.intp)
+        kept = rows >= 0
+
+        def resize(array, fill):
+            resized = np.full((len(beacons),) + array.shape[1:], fill, dtype=array.dtype)
+            resized[kept] = array[rows[kept]]
+            return resized
+
+        self.heard = resize(self.heard, True)
+        self.rssi = resize(self.rssi, np.nan)
+        self.smoothed = resize(self.smoothed, np.nan)
+        self.present = resize(self.present, True)
+        self._heard_now = resize(self._heard_now, False)
+        self._rssi_now = resize(self._rssi_now, np.nan)
+        self.beacons = beacons
+        self.index = {mac: row for row, mac in enumerate(beacons)}
+
+    @property
+    def next_evaluation(self):
+        """When the current slot closes, i.e. when `advance` next has something to do."""
+        return self._slot_end
+
+    def observe(self, mac, rssi, now):
+        row = self.index.get(mac)
+        if row is None:
+            return
+        previous = self.smoothed[row]
+        self.smoothed[row] = rssi if np.isnan(previous) else self.alpha * rssi + (1 - self.alpha) * previous
+        self._heard_now[row] = True
+        self._rssi_now[row] = rssi
+
+    def advance(self, now):
+        """
+        Closes every slot that ended by `now` and returns the beacons that
+        turned (absent, present) as two lists of MACs.
+        """
+        if self._slot_end is None:
+            self.start(now)
+        if now < self._slot_end:
+            return [], []
+        elapsed = int((now - self._slot_end) // self.slot_seconds) + 1
+
+        # Only the slot that just closed has samples; any further elapsed slots were empty
+        heard = self._heard_now
+        if self.min_rssi is not None:
+            heard = heard & (self.smoothed >= self.min_rssi)
+        self.heard[:, self._column] = heard
+        self.rssi[:, self._column] = self._rssi_now
+        empty = (self._column + 1 + np.arange(min(elapsed - 1, self.window))) % self.window
+        self.heard[:, empty] = False
+        self.rssi[:, empty] = np.nan
+        self._column = (self._column + elapsed) % self.window
+        self._slot_end += elapsed * self.slot_seconds
+        self._heard_now[:] = False
+        self._rssi_now[:] = np.nan
+
+        heard_count = self.heard.sum(axis=1)
+        turned_absent = self.present & (self.window - heard_count >= self.absent_slots)
+        turned_present = ~self.present & (heard_count >= self.present_slots)
+        self.present ^= turned_absent | turned_present
+        return ([self.beacons[row] for row in np.flatnonzero(turned_absent)],
+                [self.beacons[row] for row in np.flatnonzero(turned_present)])
+
+    def is_present(self, mac):
+        return bool(self.present[self.index[mac]])
+
+    def absent(self):
+        return [self.beacons[row] for row in np.flatnonzero(~self.present)]
+
+    def smoothed_rssi(self, mac):
+        """The beacon's EWMA RSSI, or None if it has never been heard."""
+        value = self.smoothed[self.index[mac]]
+        return None if np.isnan(value) else float(value)
+
+    def stats(self):
+        """Per beacon: present flag, slots heard in the window, smoothed and mean-of-window RSSI."""
+        heard_count = self.heard.sum(axis=1)
+        samples = (~np.isnan(self.rssi)).sum(axis=1)
+        window_mean = np.where(samples > 0, np.nansum(self.rssi, axis=1) / np.maximum(samples, 1), np.nan)
+        return {
+            mac: {
+                'present': bool(self.present[row]),
+                'heard_slots': int(heard_count[row]),
+                'smoothed_rssi': None if np.isnan(self.smoothed[row]) else round(float(self.smoothed[row]), 1),
+                'mean_rssi': None if np.isnan(window_mean[row]) else round(float(window_mean[row]), 1),
+            }
+            for row, mac in enumerate(self.beacons)
+        }
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+import serial
+
+log = logging.getLogger(__name__)
+
+# One line from the Arduino: "d1,d2,d3,d4" in centimetres. `timestamp` is
+# time.monotonic() when the line was read, `seq` counts frames since start.
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'distances'])
+
+
+class SerialFrameReader:
+    """
+    Reads the Arduino's ultrasonic frames on a background thread, parsing
+    every line into a fixed-size ring buffer of timestamped frames, so the
+    sensor loop can take the latest frame (or a window of them) without ever
+    touching the serial port itself.
+
+    `malformed` counts lines that did not hold `values_per_frame` numbers,
+    `dropped` counts lines that never became a frame (undecodable bytes or
+    cut short by a read timeout) and `reopens` counts serial errors after
+    which the port had to be reopened.
+
+    `on_frame`, if given, is called with every new frame on the reader
+    thread, so it must be quick and thread-safe (e.g. hand the frame to an
+    event loop with `call_soon_threadsafe`). `on_error`, if given, is called
+    there with each serial error.
+    """
+
+    def __init__(self, port, baudrate, capacity=256, values_per_frame=4, reopen_delay=2.0, on_frame=None,
+                 on_error=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.values_per_frame = values_per_frame
+        self.reopen_delay = reopen_delay
+        self.on_frame = on_frame
+        self.on_error = on_error
+        self.frames = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.reopens = 0
+        self._buffer = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._serial = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='serial-reader', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def latest(self, max_age=None):
+        """The newest frame, or None if there is none (or it is older than `max_age` seconds)."""
+        with self._lock:
+            frame = self._buffer[-1] if self._buffer else None
+        if frame is None or (max_age is not None and time.monotonic() - frame.timestamp > max_age):
+            return None
+        return frame
+
+    def window(self, seconds):
+        """Frames read in the last `seconds` seconds, oldest first."""
+        cutoff = time.monotonic() - seconds
+        with self._lock:
+            return [frame for frame in self._buffer if frame.timestamp >= cutoff]
+
+    def since(self, seq):
+        """Frames newer than `seq` still held in the buffer, oldest first."""
+        with self._lock:
+            return [frame for frame in self._buffer if frame.seq > seq]
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'malformed': self.malformed,
+            'dropped': self.dropped,
+            'reopens': self.reopens,
+            'buffered': len(self._buffer),
+        }
+
+    def _open(self):
+        self._serial = serial.Serial(self.port, self.baudrate, timeout=1)
+        # Whatever is waiting was sent before we started; the first line is most likely partial
+        self._serial.reset_input_buffer()
+        self._serial.readline()
+
+    def _close(self):
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except serial.SerialException:
+                pass
+            self._serial = None
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if self._serial is None:
+                        self._open()
+                    raw = self._serial.readline()
+                except serial.SerialException as e:
+                    log.error("Error reading from Arduino: %s", e)
+                    if self.on_error:
+                        self.on_error(e)
+                    if self._serial is not None:
+                        self.reopens += 1
+                    self._close()
+                    self._stopping.wait(self.reopen_delay)
+                    continue
+                self._handle_line(raw)
+        finally:
+            self._close()
+
+    def _handle_line(self, raw):
+        if not raw:
+            return
+        if not raw.endswith(b'\n'):
+            self.dropped += 1  # timed out mid-line
+            return
+        try:
+            line = raw.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            self.dropped += 1
+            return
+        if not line:
+            return
+        try:
+            distances = tuple(float(d) for d in line.split(','))
+        except ValueError:
+            distances = ()
+        if len(distances) != self.values_per_frame:
+            self.malformed += 1
+            log.warning("Error parsing line from Arduino: '%s'", line)
+            return
+        with self._lock:
+            self.frames += 1
+            frame = Frame(self.frames, time.monotonic(), distances)
+            self._buffer.append(frame)
+        if self.on_frame is not None:
+            self.on_frame(frame)
@@ -0,0 +1,216 @@
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# Sequence numbers are reserved from the database in blocks, so handing one
+# out is normally just an increment in memory.
+SEQ_BLOCK = 1000
+
+
+def utc_timestamp():
+    return datetime.utcnow().isoformat()
+
+
+def is_retryable(error):
+    """Connection problems, timeouts and 5xx responses are worth retrying; 4xx responses are not."""
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code >= 500
+
+
+class Spool:
+    """
+    Durable SQLite queue of readings and status/log events that could not be
+    delivered to the Flask API. Entries are kept in sequence-number order and
+    survive restarts; when the spool is full the oldest readings are dropped
+    first, status and log events are kept.
+    """
+
+    def __init__(self, path, max_entries=500000):
+        self.max_entries = max_entries
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS spool ('
+            'seq INTEGER PRIMARY KEY, kind TEXT NOT NULL, captured_at TEXT NOT NULL, payload TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._count = self._conn.execute('SELECT count(*) FROM spool').fetchone()[0]
+        self._next_seq = self._reserved_seq = self._meta('next_seq')
+        self.has_entries = threading.Event()
+        if self._count:
+            self.has_entries.set()
+
+    def _meta(self, key, default=1):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def next_seq(self):
+        """A sequence number that is never handed out again, even after a restart."""
+        with self._lock:
+            if self._next_seq >= self._reserved_seq:
+                self._reserved_seq = self._next_seq + SEQ_BLOCK
+                self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                   ('next_seq', self._reserved_seq))
+            seq = self._next_seq
+            self._next_seq += 1
+            return seq
+
+    def __len__(self):
+        return self._count
+
+    def append(self, kind, payload):
+        """Stores one entry; `payload` must carry the "seq" and "captured_at" it was created with."""
+        self.extend(kind, [payload])
+
+    def extend(self, kind, payloads):
+        rows = [(p['seq'], kind, p['captured_at'], json.dumps(p)) for p in payloads]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO spool (seq, kind, captured_at, payload) VALUES (?, ?, ?, ?)', rows
+            )
+            self._count += self._conn.total_changes - before
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                before = self._conn.total_changes
+                self._conn.execute(
+                    "DELETE FROM spool WHERE seq IN "
+                    "(SELECT seq FROM spool WHERE kind = 'reading' ORDER BY seq LIMIT ?)", (overflow,)
+                )
+                removed = self._conn.total_changes - before
+                self._count -= removed
+                self.dropped += removed
+            if self._count:
+                self.has_entries.set()
+
+    def peek(self, limit):
+        """The oldest `limit` entries as (seq, kind, payload) tuples."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT seq, kind, payload FROM spool ORDER BY seq LIMIT ?', (limit,)
+            ).fetchall()
+        return [(seq, kind, json.loads(payload)) for seq, kind, payload in rows]
+
+    def ack(self, seqs):
+        """Removes delivered (or undeliverable) entries."""
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany('DELETE FROM spool WHERE seq = ?', [(seq,) for seq in seqs])
+            self._count -= self._conn.total_changes - before
+            if not self._count:
+                self.has_entries.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolDrainer:
+    """
+    Background thread that replays the spool to the Flask API, oldest entry
+    first: consecutive readings go out as one batch request, status and log
+    events one by one. The server skips entries it already stored, so an
+    entry that is sent twice (e.g. the response was lost) is harmless. While
+    the server is unreachable the drainer backs off exponentially instead of
+    retrying every tick.
+    """
+
+    def __init__(self, spool, source_id, batch_url, status_url, log_url,
+                 batch_size=500, timeout=10, min_backoff=1.0, max_backoff=60.0, station=None):
+        self.spool = spool
+        self.source_id = source_id
+        self.station = station
+        self.batch_url = batch_url
+        self.status_url = status_url
+        self.log_url = log_url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.replayed = 0
+        self.discarded = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self.spool.has_entries.set()  # wake the thread up
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        session = requests.Session()
+        backoff = self.min_backoff
+        try:
+            while not self._stopping.is_set():
+                self.spool.has_entries.wait()
+                if self._stopping.is_set():
+                    return
+                try:
+                    self._drain_once(session)
+                    backoff = self.min_backoff
+                except requests.exceptions.RequestException as e:
+                    log.warning("Spool replay failed (%d entries waiting), retrying in %.0fs: %s", len(self.spool),
+                                backoff, e)
+                    self._stopping.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            session.close()
+
+    def _drain_once(self, session):
+        """Replays up to one batch worth of entries; raises on a retryable failure."""
+        entries = self.spool.peek(self.batch_size)
+        readings = []
+        for seq, kind, payload in entries:
+            if kind == 'reading':
+                readings.append((seq, payload))
+                continue
+            # Keep the order: flush readings that came before this event first
+            self._send_readings(session, readings)
+            readings = []
+            if kind == 'status':
+                url = f"{self.status_url}/{payload['serial_number']}"
+                body = {"is_stolen": payload["is_stolen"]}
+            else:
+                url = self.log_url
+                body = dict(payload, source_id=self.source_id)
+            self._post(session, url, body, [seq])
+        self._send_readings(session, readings)
+
+    def _send_readings(self, session, readings):
+        if not readings:
+            return
+        body = {"source_id": self.source_id, "station": self.station, "replayed": True,
+                "readings": [payload for _, payload in readings]}
+        response = self._post(session, self.batch_url, body, [seq for seq, _ in readings])
+        if response is not None:
+            log.info("Replayed %d spooled readings (%d entries left).", len(readings), len(self.spool))
+
+    def _post(self, session, url, body, seqs):
+        try:
+            response = session.post(url, json=body, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if is_retryable(e):
+                raise
+            # The server will never accept these, so don't keep them around
+            log.error("Discarding %d spooled entries rejected by the server: %s", len(seqs), e)
+            self.spool.ack(seqs)
+            self.discarded += len(seqs)
+            return None
+        self.spool.ack(seqs)
+        self.replayed += len(seqs)
+        return response
@@ -0,0 +1,152 @@
+import ast
+import json
+import re
+import threading
+import time
+
+# A trace is a stream of events, each a dict with "t" (seconds; only the
+# differences between events matter) and "type":
+#
+#   config         ibeacon_map {mac: serial}, ultrasonic_map {serial: sensor index};
+#                  again mid-session when the Pi synced a changed config
+#   start          the sensor script (re)started; state from before is gone
+#   advertisement  mac, rssi
+#   frame          distances [cm, ...]
+#   serial_error   reading the Arduino failed
+#   status         serial, is_stolen        -- a decision the Pi made
+#   alarm          active, reason           -- a decision the Pi made
+#
+# Captures (TraceWriter) store exactly these dicts as JSON lines. parse_log
+# infers them from a sensor script log written with LOG_LEVEL = "DEBUG" (at
+# INFO the advertisements and distance reads aren't logged) and a rate limit
+# high enough to keep every line; it goes by the tick, not the log's clock.
+
+ADVERTISEMENT = re.compile(r'Found target iBeacon \(([0-9A-Fa-f:]{17})\) with RSSI: (-?\d+)')
+FRAME = re.compile(r'Read distances from Arduino: \[([^\]]*)\] cm')
+STATUS = re.compile(r'Laptop (\S+) status (?:updated to )?is_stolen=(True|False)')
+ALARM_ON = re.compile(r'ALARM ACTIVATED! (.*)')
+IBEACON_MAP = re.compile(r'iBeacon Map: (\{.*\})')
+ULTRASONIC_MAP = re.compile(r'Ultrasonic Sensor Map: (\{.*\})')
+
+
+def parse_log(lines, tick=2.0, session_gap=60.0):
+    """
+    Turns the output of pi_sensor_script.py (tick mode) into a trace, one
+    event at a time, so logs of any size can be streamed.
+
+    The log has no clock, so time is inferred from the script's tick: a tick
+    ends at the first line the loop prints for it, an Arduino read (or read
+    error) or, for ticks without one, a status or alarm decision. The
+    advertisements heard since the previous tick are spread evenly across
+    it, and decisions printed after the tick ends are placed at its end. A
+    restart of the script starts a new session `session_gap` seconds later.
+    """
+    now = 0.0
+    pending = []
+    ibeacon_map = None
+
+    def close_tick():
+        nonlocal now, pending
+        start, now = now, now + tick
+        for i, event in enumerate(pending):
+            event['t'] = round(start + tick * (i + 1) / (len(pending) + 1), 3)
+        events, pending = pending, []
+        return events
+
+    for line in lines:
+        line = line.strip()
+        match = ADVERTISEMENT.search(line)
+        if match:
+            pending.append({'type': 'advertisement', 'mac': match.group(1), 'rssi': int(match.group(2))})
+            continue
+
+        match = FRAME.search(line)
+        if match or 'Error reading from Arduino' in line:
+            yield from close_tick()
+            if match:
+                try:
+                    distances = [float(d) for d in match.group(1).split(',')]
+                except ValueError:
+                    continue
+                yield {'t': round(now, 3), 'type': 'frame', 'distances': distances}
+            else:
+                yield {'t': round(now, 3), 'type': 'serial_error'}
+            continue
+
+        decision = None
+        match = STATUS.search(line)
+        if match:
+            decision = {'type': 'status', 'serial': match.group(1), 'is_stolen': match.group(2) == 'True'}
+        elif ALARM_ON.search(line):
+            decision = {'type': 'alarm', 'active': True, 'reason': ALARM_ON.search(line).group(1)}
+        elif 'Alarm deactivated' in line:
+            decision = {'type': 'alarm', 'active': False, 'reason': line}
+        if decision is not None:
+            if pending:
+                yield from close_tick()
+            decision['t'] = round(now, 3)
+            yield decision
+            continue
+
+        match = IBEACON_MAP.search(line)
+        if match:
+            ibeacon_map = ast.literal_eval(match.group(1))
+            continue
+        match = ULTRASONIC_MAP.search(line)
+        if match and ibeacon_map is not None:
+            yield {'t': round(now, 3), 'type': 'config', 'ibeacon_map': ibeacon_map,
+                   'ultrasonic_map': ast.literal_eval(match.group(1))}
+            ibeacon_map = None
+            continue
+
+        if 'Starting iBeacon scanner' in line:
+            if pending:
+                yield from close_tick()
+            now += session_gap
+            yield {'t': round(now, 3), 'type': 'start'}
+    if pending:
+        yield from close_tick()
+
+
+def read_capture(lines):
+    """Events from a JSON lines capture written by TraceWriter."""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_trace(path, **log_options):
+    """Events from a capture (*.jsonl) or a plain sensor script log (anything else)."""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        if path.endswith('.jsonl'):
+            yield from read_capture(f)
+        else:
+            yield from parse_log(f, **log_options)
+
+
+class TraceWriter:
+    """
+    Records what the sensor script sees and decides as a JSON lines capture,
+    for replaying later with benchmarks/replay_trace.py. Safe to call from
+    the serial reader thread as well as the event loop.
+
+    Each run is appended to the file as a new session. Times come from the
+    monotonic clock, shifted to Unix time when the writer was opened, so
+    they never jump within a session and keep sessions in order.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._offset = time.time() - time.monotonic()
+        self.write('start')
+
+    def write(self, event_type, **fields):
+        event = {'t': round(time.monotonic() + self._offset, 3), 'type': event_type, **fields}
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
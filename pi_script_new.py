@@ -2,9 +2,8 @@ import asyncio
 import time
 import requests
 import json
-import RPi.GPIO as GPIO
 import serial
-from bleak import BleakScanner
+from pi.hardware import BleakBeaconSource, GpioBuzzer
 
 # --- CONFIGURATION ---
 FLASK_DATA_API_URL = "http://192.168.100.36:5000/api/sensor_data"
@@ -35,22 +34,21 @@ SERIAL_BAUDRATE = 9600
 
 # --- BUZZER CONFIGURATION ---
 BUZZER_PIN = 18 
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
 
 alarm_task = None
+buzzer = GpioBuzzer(BUZZER_PIN)
 stolen_laptops_status = {serial: False for serial in IBEACON_TO_LAPTOP_MAP.values()}
 
 async def beeping_alarm():
     """An async task that makes the buzzer beep continuously."""
     try:
         while True:
-            GPIO.output(BUZZER_PIN, GPIO.HIGH)
+            buzzer.on()
             await asyncio.sleep(0.5)
-            GPIO.output(BUZZER_PIN, GPIO.LOW)
+            buzzer.off()
             await asyncio.sleep(0.5)
     except asyncio.CancelledError:
-        GPIO.output(BUZZER_PIN, GPIO.LOW)
+        buzzer.off()
         print("Beeping alarm stopped.")
 
 def update_stolen_status(laptop_serial, is_stolen):
@@ -95,15 +93,14 @@ async def scan_and_send_data():
     found_devices = {}
     ser = None
     
-    def detection_callback(device, advertisement_data):
-        if device.address in IBEACON_TO_LAPTOP_MAP:
-            rssi = advertisement_data.rssi
-            found_devices[device.address] = {
+    def detection_callback(address, rssi):
+        if address in IBEACON_TO_LAPTOP_MAP:
+            found_devices[address] = {
                 "rssi": rssi
             }
-            print(f"Found target iBeacon ({device.address}) with RSSI: {rssi}")
+            print(f"Found target iBeacon ({address}) with RSSI: {rssi}")
 
-    scanner = BleakScanner(detection_callback)
+    scanner = BleakBeaconSource(detection_callback)
     await scanner.start()
 
     try:
@@ -185,7 +182,7 @@ async def scan_and_send_data():
         await scanner.stop()
         if ser:
             ser.close()
-        GPIO.cleanup()
+        buzzer.close()
 
 if __name__ == "__main__":
     try:
@@ -194,4 +191,4 @@ if __name__ == "__main__":
         print("Script terminated by user.")
     except Exception as e:
         print(f"An error occurred: {e}")
-        GPIO.cleanup()
\ No newline at end of file
+        buzzer.close()
\ No newline at end of file
@@ -1,24 +1,98 @@
 import asyncio
+import logging
+import os
+import signal
 import time
-import requests
 import json
-import RPi.GPIO as GPIO
-import serial
-from bleak import BleakScanner
-import psycopg2
-
-# --- DATABASE CONFIGURATION ---
-DB_HOST = "localhost"
-DB_NAME = "laptop_security_db"
-DB_USER = "justine"
-
-DB_PASSWORD = "justine123"
+import socket
+import requests
+from pi.http_client import ApiSender
+from pi.serial_reader import SerialFrameReader
+from pi.config_sync import ConfigSync, diff_maps
+from pi.detector import EventDetector
+from pi.presence import PresenceTracker
+from pi.ble_daemon import is_listening
+from pi.control import ControlServer, LoopMetrics, heartbeat, remove_pid_file
+from pi.hardware import (BleakBeaconSource, DaemonBeaconSource, GpioBuzzer, SimulatedBeaconSource, SimulatedBuzzer,
+                         SimulatedDistanceSource, simulated_laptops)
+from pi.spool import Spool, SpoolDrainer, is_retryable, utc_timestamp
+from pi.trace import TraceWriter
+from pi.logs import setup_logging
+
+log = logging.getLogger("sensor")
 
 # --- FLASK CONFIGURATION ---
+# Laptops to watch; fetched at startup and then long-polled, so added and removed laptops apply without a restart
+FLASK_CONFIG_API_URL = "http://localhost:5000/api/config"
+# Sent as a bearer token with every config request; must match CONFIG_TOKEN on the server (None if it has none)
+CONFIG_TOKEN = None
+# Seconds the server may hold a config long-poll open before answering "unchanged"
+CONFIG_WAIT_SECONDS = 30
 FLASK_DATA_API_URL = "http://localhost:5000/api/sensor_data"
 FLASK_STATUS_API_URL = "http://localhost:5000/api/laptop_status"
 # NEW: API endpoint to create a log entry
 FLASK_LOG_API_URL = "http://localhost:5000/api/log_event"
+# Endpoint that accepts every laptop's reading for one tick in a single request
+FLASK_BATCH_DATA_API_URL = "http://localhost:5000/api/sensor_data/batch"
+# When True, each tick's readings are sent as one batch instead of one POST per laptop
+BATCH_MODE = True
+# Background HTTP sender: concurrent requests, queued requests before dropping, per-request timeout
+HTTP_WORKERS = 2
+HTTP_QUEUE_SIZE = 256
+HTTP_TIMEOUT = 5
+# Identifies this Pi to the server, which uses it with each entry's sequence number to skip replayed duplicates
+SOURCE_ID = socket.gethostname()
+# The station (see `flask stations`) this Pi is; it then watches only that station's laptops.
+# None watches every laptop, for a single-Pi setup
+STATION_NAME = None
+# Local store for readings and events the server couldn't take; oldest readings are dropped beyond the limit
+SPOOL_PATH = "sensor_spool.db"
+SPOOL_MAX_ENTRIES = 500000
+# Spooled entries replayed per request once the server is back
+SPOOL_DRAIN_BATCH = 500
+# "event" evaluates every BLE advertisement and serial frame as it arrives; "tick" polls every TICK_INTERVAL seconds
+DETECTION_MODE = "event"
+# Seconds between sensor ticks in tick mode
+TICK_INTERVAL = 2.0
+# Event mode: seconds without an advertisement before a beacon counts as missing, and seconds between uploads
+BEACON_TIMEOUT = 2.0
+REPORT_INTERVAL = 2.0
+# Presence filter: a beacon goes missing once it was not heard in PRESENCE_ABSENT_SLOTS of the last
+# PRESENCE_WINDOW_SLOTS slots, and is back once heard in PRESENCE_PRESENT_SLOTS of them (replaces BEACON_TIMEOUT)
+PRESENCE_FILTER = True
+PRESENCE_SLOT_SECONDS = 1.0   # tick mode always uses one slot per tick
+PRESENCE_WINDOW_SLOTS = 5
+PRESENCE_ABSENT_SLOTS = 3
+PRESENCE_PRESENT_SLOTS = 3
+# Weight of each new RSSI sample in the smoothed value, and the smoothed RSSI below which a beacon counts as not heard
+RSSI_SMOOTHING = 0.3
+PRESENCE_MIN_RSSI = None
+# Ticks (or reports) between HTTP latency reports
+STATS_EVERY_TICKS = 30
+# When set, advertisements, frames and decisions are appended to this JSON lines file for
+# benchmarks/replay_trace.py
+CAPTURE_PATH = None
+# Local socket the web app uses to check on and stop the script (SENSOR_CONTROL_SOCKET in config.py)
+CONTROL_SOCKET = "/tmp/laptop-security-sensor.sock"
+# Written by the web app when it launches the script, which deletes it on exit
+PID_PATH = "sensor_script.pid"
+
+# --- LOGGING ---
+# Written from a background thread and rotated once it reaches LOG_MAX_BYTES (or at LOG_ROTATE_WHEN, e.g.
+# "midnight"), keeping LOG_BACKUPS gzipped files. The dashboard shows its last lines
+LOG_PATH = "sensor_script_log.txt"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_ROTATE_WHEN = None
+# "DEBUG" also logs every advertisement, distance read and upload, which is what pi.trace needs to turn a log
+# into a trace (CAPTURE_PATH records the same without the log)
+LOG_LEVEL = "INFO"
+# Each message is logged at most LOG_RATE_PER_SECOND times a second, in bursts of up to LOG_RATE_BURST; the
+# suppressed count shows on the next one that gets through. LOG_RATE_LIMITS sets (per second, burst) for
+# single messages, e.g. {"No fresh frame from Arduino in the last %ss.": (1 / 60, 1)}
+LOG_RATE_PER_SECOND = 1.0
+LOG_RATE_BURST = 20
+LOG_RATE_LIMITS = {}
 
 # --- ULTRASONIC SENSOR MAPPING ---
 IBEACON_TO_LAPTOP_MAP = {}
@@ -30,231 +104,568 @@ MIN_DISTANCE_CM = 5.0
 # Arduino Serial Port Configuration
 SERIAL_PORT = "/dev/ttyUSB0"   # change if your Arduino is on a different port
 SERIAL_BAUDRATE = 9600
+# Frames kept in memory, and the oldest frame (seconds) still used for a tick
+SERIAL_BUFFER_FRAMES = 256
+SERIAL_FRAME_MAX_AGE = 3.0
 # --- BUZZER CONFIGURATION ---
 BUZZER_PIN = 18
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
+
+# --- HARDWARE ---
+# "pi" uses the Bluetooth adapter, the Arduino and the GPIO buzzer; "sim" runs the same loop on any
+# machine against SIM_LAPTOPS synthetic beacons and a simulated Arduino and buzzer
+HARDWARE = "pi"
+# With the BLE daemon (python -m pi.ble_daemon) listening here, advertisements come from it and the web app
+# can discover beacons while the scanner runs; otherwise the script opens the Bluetooth adapter itself
+BLE_DAEMON_SOCKET = "/tmp/laptop-security-ble.sock"
+SIM_LAPTOPS = 1000
+SIM_ADVERTISING_INTERVAL = 1.0
+SIM_DROPOUT = 0.05             # share of advertisements lost
+SIM_DEPARTURES_PER_HOUR = 1.0  # per beacon; each departure lasts SIM_ABSENCE_SECONDS
+SIM_ABSENCE_SECONDS = 30.0
+SIM_LIFTS_PER_HOUR = 0.5       # per ultrasonic sensor
 
 alarm_task = None
+buzzer = SimulatedBuzzer() if HARDWARE == "sim" else GpioBuzzer(BUZZER_PIN)
 # Stores the current 'stolen' status for each laptop to detect changes
 stolen_laptops_status = {}
-
-def fetch_config_from_db():
+# Status changes sent to the server but not yet acknowledged, so they aren't resent every tick
+pending_status_updates = {}
+# TraceWriter for CAPTURE_PATH while the scanner runs
+capture = None
+# The beacon source while the scanner runs
+scanner = None
+# Heartbeat, tick durations, rates and last error, reported on CONTROL_SOCKET
+metrics = LoopMetrics()
+
+api = ApiSender(workers=HTTP_WORKERS, queue_size=HTTP_QUEUE_SIZE, timeout=HTTP_TIMEOUT)
+spool = Spool(SPOOL_PATH, max_entries=SPOOL_MAX_ENTRIES)
+drainer = SpoolDrainer(spool, SOURCE_ID, FLASK_BATCH_DATA_API_URL, FLASK_STATUS_API_URL, FLASK_LOG_API_URL,
+                       batch_size=SPOOL_DRAIN_BATCH, station=STATION_NAME)
+config_sync = ConfigSync(FLASK_CONFIG_API_URL, station=STATION_NAME, wait=CONFIG_WAIT_SECONDS, timeout=HTTP_TIMEOUT,
+                         on_error=lambda e: metrics.error("config", e), token=CONFIG_TOKEN)
+
+def fetch_config():
     """
-    Connects to the PostgreSQL database and fetches the laptop configuration.
+    Fetches the laptop configuration from the Flask API, only for this Pi's
+    station when STATION_NAME is set. Empty maps if that fails; ConfigSync
+    fills them in once the server answers.
     """
-    global IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP
-    
-    ibeacon_map = {}
-    ultrasonic_map = {}
-
     try:
-        conn = psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
-        cur = conn.cursor()
-
-        cur.execute("SELECT ibeacon_mac_address, serial_number, ultrasonic_sensor_index FROM laptop;")
-        rows = cur.fetchall()
-
-        for row in rows:
-            ibeacon_mac, serial_number, sensor_index = row
-            if ibeacon_mac and serial_number and sensor_index is not None:
-                ibeacon_map[ibeacon_mac] = serial_number
-                ultrasonic_map[serial_number] = sensor_index
-
-        cur.close()
-        conn.close()
-
-        print("Configuration successfully loaded from the database.")
-        print(f"iBeacon Map: {ibeacon_map}")
-        print(f"Ultrasonic Sensor Map: {ultrasonic_map}")
-        
-        return ibeacon_map, ultrasonic_map
-
-    except (Exception, psycopg2.Error) as error:
-        print(f"Error while connecting to PostgreSQL or fetching data: {error}")
+        _, ibeacon_map, ultrasonic_map = config_sync.fetch()
+    except (requests.exceptions.RequestException, KeyError) as error:
+        log.error("Error while fetching the configuration from the server: %s", error)
         return {}, {}
 
+    log.info("Configuration version %s successfully loaded from the server.", config_sync.version)
+    log.info("iBeacon Map: %s", ibeacon_map)
+    log.info("Ultrasonic Sensor Map: %s", ultrasonic_map)
+    return ibeacon_map, ultrasonic_map
+
 async def beeping_alarm():
     try:
         while True:
             for _ in range(3):
-                GPIO.output(BUZZER_PIN, GPIO.HIGH)
+                buzzer.on()
                 await asyncio.sleep(0.1)
-                GPIO.output(BUZZER_PIN, GPIO.LOW)
+                buzzer.off()
                 await asyncio.sleep(0.1)
             await asyncio.sleep(1.0)
     except asyncio.CancelledError:
-        GPIO.output(BUZZER_PIN, GPIO.LOW)
-        print("Beeping alarm stopped.")
+        buzzer.off()
+        log.info("Beeping alarm stopped.")
 
-def log_event_in_db(laptop_serial, event_type):
+def record(event_type, **fields):
+    if capture is not None:
+        capture.write(event_type, **fields)
+
+def stamp(payload):
+    """Tags a payload with the sequence number and capture time it keeps if it ends up spooled."""
+    payload["seq"] = spool.next_seq()
+    payload["captured_at"] = utc_timestamp()
+    return payload
+
+def deliver(kind, name, url, body, payloads, on_success, on_spooled=None, on_rejected=None):
     """
-    Sends a POST request to the Flask API to create a new log entry.
+    Sends `body` in the background, or stores `payloads` in the spool for the
+    drainer to replay if the server can't be reached. While older entries are
+    still spooled, new ones go straight to the spool so they stay in order.
     """
-    url = FLASK_LOG_API_URL
-    payload = {"serial_number": laptop_serial, "event_type": event_type}
-    try:
-        response = requests.post(url, json=payload, timeout=5)
-        response.raise_for_status()
-        print(f"Logged event '{event_type}' for laptop {laptop_serial}.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error logging event for {laptop_serial}: {e}")
+    def spool_payloads(reason, *args):
+        spool.extend(kind, payloads)
+        log.warning(reason + "; spooled %d %s entries (%d waiting).", *args, len(payloads), kind, len(spool))
+        if on_spooled:
+            on_spooled()
+
+    def on_error(e):
+        metrics.error(kind, e)
+        if is_retryable(e):
+            spool_payloads("Could not deliver %s to the server (%s)", kind, e)
+        else:
+            log.error("Server rejected %s: %s", kind, e)
+            if on_rejected:
+                on_rejected()
 
-def update_stolen_status(laptop_serial, is_stolen):
-    global stolen_laptops_status
-    
-    # Check if the status has actually changed
-    if stolen_laptops_status.get(laptop_serial) != is_stolen:
-        url = f"{FLASK_STATUS_API_URL}/{laptop_serial}"
-        payload = {"is_stolen": is_stolen}
-        try:
-            response = requests.post(url, json=payload, timeout=5)
-            response.raise_for_status()
-            stolen_laptops_status[laptop_serial] = is_stolen
-            print(f"Laptop {laptop_serial} status updated to is_stolen={is_stolen} in the database.")
-            
-            # Call the log function based on the status change
-            event_type = 'stolen' if is_stolen else 'returned'
-            log_event_in_db(laptop_serial, event_type)
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error updating laptop status for {laptop_serial}: {e}")
+    if len(spool):
+        spool_payloads("Spool backlog not yet replayed")
+    elif not api.submit(name, url, body, on_success, on_error):
+        spool_payloads("HTTP queue full")
 
-def get_ultrasonic_distances(ser):
-    default_distances = [0.0, 0.0, 0.0, 0.0] 
-    
-    try:
-        ser.flushInput()
-        line = ser.readline().decode('utf-8').strip()
-        
-        if line:
-            try:
-                distances = [float(d) for d in line.split(',')]
-                if len(distances) == 4:
-                    print(f"Read distances from Arduino: {distances} cm")
-                    return distances
-            except ValueError:
-                print(f"Error parsing line from Arduino: '{line}'")
-    except Exception as e:
-        print(f"Error reading from Arduino: {e}")
-        
-    return default_distances
+def log_event_in_db(laptop_serial, event_type):
+    """
+    Queues a POST request to the Flask API to create a new log entry.
+    """
+    payload = stamp({"serial_number": laptop_serial, "event_type": event_type})
 
-# --- SCANNING AND DATA SENDING LOGIC ---
-async def scan_and_send_data():
-    global alarm_task, IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP, stolen_laptops_status
-    print("Starting iBeacon scanner...")
+    def on_success(response):
+        log.info("Logged event '%s' for laptop %s.", event_type, laptop_serial)
 
-    found_devices = {}
+    deliver("log", "log", FLASK_LOG_API_URL, dict(payload, source_id=SOURCE_ID), [payload], on_success)
 
-    def detection_callback(device, advertisement_data):
-        if device.address in IBEACON_TO_LAPTOP_MAP:
-            rssi = advertisement_data.rssi
-            found_devices[device.address] = {
-                "rssi": rssi
-            }
-            print(f"Found target iBeacon ({device.address}) with RSSI: {rssi}")
+def update_stolen_status(laptop_serial, is_stolen):
+    global stolen_laptops_status
 
-    scanner = BleakScanner(detection_callback)
-    await scanner.start()
+    # Check if the status has actually changed and isn't already on its way to the server
+    if stolen_laptops_status.get(laptop_serial) == is_stolen:
+        pending_status_updates.pop(laptop_serial, None)
+        return
+    if pending_status_updates.get(laptop_serial) == is_stolen:
+        return
+    record("status", serial=laptop_serial, is_stolen=is_stolen)
+
+    def on_delivered(message):
+        if pending_status_updates.get(laptop_serial) != is_stolen:
+            return  # superseded by a newer change
+        del pending_status_updates[laptop_serial]
+        stolen_laptops_status[laptop_serial] = is_stolen
+        log.info(message, laptop_serial, is_stolen)
+
+        # Call the log function based on the status change
+        event_type = 'stolen' if is_stolen else 'returned'
+        log_event_in_db(laptop_serial, event_type)
+
+    def on_success(response):
+        on_delivered("Laptop %s status updated to is_stolen=%s in the database.")
+
+    def on_spooled():
+        # The spool guarantees delivery, so stop re-sending the change every tick
+        on_delivered("Laptop %s status is_stolen=%s spooled for the server.")
+
+    def on_rejected():
+        # Forget the attempt so the next tick tries again
+        if pending_status_updates.get(laptop_serial) == is_stolen:
+            del pending_status_updates[laptop_serial]
+
+    payload = stamp({"serial_number": laptop_serial, "is_stolen": is_stolen})
+    pending_status_updates[laptop_serial] = is_stolen
+    url = f"{FLASK_STATUS_API_URL}/{laptop_serial}"
+    deliver("status", "status", url, {"is_stolen": is_stolen}, [payload], on_success, on_spooled, on_rejected)
+
+def send_sensor_data(payload):
+    """
+    Queues a single laptop's reading for the Flask API.
+    """
+    laptop_serial = payload["serial_number"]
 
-    ser = serial.Serial(SERIAL_PORT, SERIAL_BAUDRATE, timeout=1)
-    ser.flushInput()
+    def on_success(response):
+        log.debug("Sent data for %s successfully.", laptop_serial)
 
-    try:
-        while True:
-            await asyncio.sleep(2)
-            ultrasonic_distances = get_ultrasonic_distances(ser)
+    deliver("reading", "data", FLASK_DATA_API_URL, dict(payload, source_id=SOURCE_ID, station=STATION_NAME), [payload],
+            on_success)
 
-            found_mac_addresses = found_devices.keys()
-            all_target_macs = IBEACON_TO_LAPTOP_MAP.keys()
+def send_sensor_data_batch(payloads):
+    """
+    Queues all readings collected during one tick as a single request to the Flask API.
+    """
+    def on_success(response):
+        try:
+            result = response.json()
+            log.debug("Sent batch of %d readings: %d accepted, %d rejected.", len(payloads), result['accepted'],
+                      result['rejected'])
+            for item in result["results"]:
+                if item["status"] != "ok":
+                    log.warning("Reading for %s rejected: %s", item['serial_number'], item['error'])
+        except (ValueError, KeyError) as e:
+            log.error("Error reading batch response: %s", e)
+
+    body = {"source_id": SOURCE_ID, "station": STATION_NAME, "readings": payloads}
+    deliver("reading", "batch", FLASK_BATCH_DATA_API_URL, body, payloads, on_success)
+
+def print_http_stats():
+    stats = api.stats()
+    endpoints = ", ".join(
+        f"{name}: {s['sent']} ok/{s['failed']} failed"
+        + (f" p50={s['p50_ms']}ms p95={s['p95_ms']}ms max={s['max_ms']}ms" if 'p50_ms' in s else "")
+        for name, s in sorted(stats["endpoints"].items())
+    )
+    log.info("HTTP: %d queued, %d dropped; %s", stats['queued'], stats['dropped'], endpoints)
+    log.info("Spool: %d waiting, %d replayed, %d discarded, %d dropped when full", len(spool), drainer.replayed,
+             drainer.discarded, spool.dropped)
+
+def get_ultrasonic_distances(reader):
+    default_distances = [0.0, 0.0, 0.0, 0.0]
+
+    frame = reader.latest(max_age=SERIAL_FRAME_MAX_AGE)
+    if frame is None:
+        log.warning("No fresh frame from Arduino in the last %ss.", SERIAL_FRAME_MAX_AGE)
+        return default_distances
+
+    distances = list(frame.distances)
+    log.debug("Read distances from Arduino: %s cm", distances)
+    return distances
 
-            # The logic for checking missing beacons is fine, but let's make sure it updates the status for each one.
+# --- SCANNING AND DATA SENDING LOGIC ---
+def print_stats(reader):
+    print_http_stats()
+    log.info("Serial: %s", reader.stats())
+    if getattr(scanner, "callbacks", None) is not None:
+        log.info("BLE: %d advertisements reached the callback (%s scan)", scanner.callbacks, scanner.mode)
+
+def set_alarm(active, reason):
+    global alarm_task
+    if active and not alarm_task:
+        alarm_task = asyncio.create_task(beeping_alarm())
+        log.warning("ALARM ACTIVATED! %s", reason)
+        record("alarm", active=True, reason=reason)
+    elif not active and alarm_task:
+        alarm_task.cancel()
+        alarm_task = None
+        log.info("Alarm deactivated: %s.", reason)
+        record("alarm", active=False, reason=reason)
+
+async def run_tick_detection(loop, reader, found_devices, presence):
+    """
+    Polling mode: every TICK_INTERVAL seconds, checks which beacons were heard
+    during the tick and the latest ultrasonic frame, then reports.
+    """
+    global alarm_task
+
+    tick = 0
+    next_tick = loop.time()
+    while True:
+        # Sleep to a fixed schedule so slow ticks don't push every later tick back
+        next_tick = max(next_tick + TICK_INTERVAL, loop.time() - TICK_INTERVAL)
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        tick_started = loop.time()
+        tick += 1
+        ultrasonic_distances = get_ultrasonic_distances(reader)
+
+        found_mac_addresses = found_devices.keys()
+        all_target_macs = IBEACON_TO_LAPTOP_MAP.keys()
+
+        # The logic for checking missing beacons is fine, but let's make sure it updates the status for each one.
+        if presence is not None:
+            for mac_address, beacon_data in found_devices.items():
+                presence.observe(mac_address, beacon_data['rssi'], loop.time())
+            presence.advance(loop.time())
+            missing_beacons = presence.absent()
+        else:
             missing_beacons = [mac for mac in all_target_macs if mac not in found_mac_addresses]
 
-            if missing_beacons:
-                if not alarm_task:
-                    alarm_task = asyncio.create_task(beeping_alarm())
-                    print(f"ALARM ACTIVATED! The following beacons are missing: {', '.join(missing_beacons)}")
-                for mac in missing_beacons:
+        if missing_beacons:
+            if not alarm_task:
+                alarm_task = asyncio.create_task(beeping_alarm())
+                log.warning("ALARM ACTIVATED! The following beacons are missing: %s", ', '.join(missing_beacons))
+                record("alarm", active=True, reason=f"{', '.join(missing_beacons)} missing")
+            for mac in missing_beacons:
+                laptop_serial = IBEACON_TO_LAPTOP_MAP.get(mac)
+                if laptop_serial:
+                    update_stolen_status(laptop_serial, True)
+        else:
+            if alarm_task:
+                # Check if all currently stolen laptops are returned
+                all_returned = True
+                for mac in all_target_macs:
                     laptop_serial = IBEACON_TO_LAPTOP_MAP.get(mac)
-                    if laptop_serial:
-                        update_stolen_status(laptop_serial, True)
-            else:
-                if alarm_task:
-                    # Check if all currently stolen laptops are returned
-                    all_returned = True
-                    for mac in all_target_macs:
-                        laptop_serial = IBEACON_TO_LAPTOP_MAP.get(mac)
-                        if stolen_laptops_status.get(laptop_serial):
-                            all_returned = False
-                            break
-                    if all_returned:
-                        alarm_task.cancel()
-                        alarm_task = None
-                        print("All beacons found and laptops are close. Alarm deactivated.")
-
-            for mac_address, beacon_data in found_devices.items():
-                laptop_serial = IBEACON_TO_LAPTOP_MAP.get(mac_address)
+                    if stolen_laptops_status.get(laptop_serial):
+                        all_returned = False
+                        break
+                if all_returned:
+                    alarm_task.cancel()
+                    alarm_task = None
+                    log.info("All beacons found and laptops are close. Alarm deactivated.")
+                    record("alarm", active=False, reason="all beacons found and laptops are close")
+
+        tick_payloads = []
+        for mac_address, beacon_data in found_devices.items():
+            laptop_serial = IBEACON_TO_LAPTOP_MAP.get(mac_address)
+            
+            if laptop_serial:
+                sensor_index = ULTRASONIC_SENSOR_TO_LAPTOP_MAP.get(laptop_serial)
                 
-                if laptop_serial:
-                    sensor_index = ULTRASONIC_SENSOR_TO_LAPTOP_MAP.get(laptop_serial)
+                is_moved = False
+                if mac_address in missing_beacons:
+                    pass  # heard again, but not often enough yet to count as back
+                elif sensor_index is not None:
+                    distance = ultrasonic_distances[sensor_index]
+                    log.debug("Distance for %s (Sensor %s): %s cm", laptop_serial, sensor_index, distance)
+                    if distance > MIN_DISTANCE_CM:
+                        log.warning("Laptop %s moved! Distance is %s cm", laptop_serial, distance)
+                        is_moved = True
+
+                if is_moved:
+                    if not alarm_task:
+                        alarm_task = asyncio.create_task(beeping_alarm())
+                        record("alarm", active=True, reason=f"{laptop_serial} moved")
+                    update_stolen_status(laptop_serial, True)
                     
-                    is_moved = False
-                    if sensor_index is not None:
-                        distance = ultrasonic_distances[sensor_index]
-                        print(f"Distance for {laptop_serial} (Sensor {sensor_index}): {distance} cm")
-                        if distance > MIN_DISTANCE_CM:
-                            print(f"Laptop {laptop_serial} moved! Distance is {distance} cm")
-                            is_moved = True
-
-                    if is_moved:
-                        if not alarm_task:
-                            alarm_task = asyncio.create_task(beeping_alarm())
-                        update_stolen_status(laptop_serial, True)
-                        
-                    else:
-                        update_stolen_status(laptop_serial, False)
-
-                    # Send normal sensor data regardless of alarm status
-                    payload = {
-                        "serial_number": laptop_serial,
-                        "ibeacon_rssi": beacon_data['rssi'],
-                        "ultrasonic_distances": ultrasonic_distances
-                    }
-                    try:
-                        response = requests.post(FLASK_DATA_API_URL, json=payload, timeout=5)
-                        response.raise_for_status()
-                        print(f"Sent data for {laptop_serial} successfully.")
-                    except requests.exceptions.RequestException as e:
-                        print(f"Error sending data for {laptop_serial}: {e}")
-
-            found_devices.clear()
+                elif mac_address not in missing_beacons:
+                    update_stolen_status(laptop_serial, False)
+
+                # Send normal sensor data regardless of alarm status
+                payload = stamp({
+                    "serial_number": laptop_serial,
+                    "ibeacon_rssi": beacon_data['rssi'],
+                    "ultrasonic_distances": ultrasonic_distances,
+                    "ultrasonic_intrusion_detected": is_moved
+                })
+                if BATCH_MODE:
+                    tick_payloads.append(payload)
+                else:
+                    send_sensor_data(payload)
+
+        if tick_payloads:
+            send_sensor_data_batch(tick_payloads)
+
+        found_devices.clear()
+        metrics.tick(loop.time() - tick_started)
+
+        if tick % STATS_EVERY_TICKS == 0:
+            print_stats(reader)
+
+async def run_event_detection(loop, reader, detector, wakeup):
+    """
+    Event mode: advertisements and serial frames are evaluated by the detector
+    the moment they arrive. This coroutine only wakes up when a beacon's
+    deadline falls due, and reports to the server every REPORT_INTERVAL
+    seconds, independently of detection.
+    """
+    async def expire_deadlines():
+        while True:
+            deadline = detector.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            detector.expire(loop.time())
+
+    expiry_task = asyncio.create_task(expire_deadlines())
+    try:
+        reports = 0
+        next_report = loop.time()
+        while True:
+            next_report = max(next_report + REPORT_INTERVAL, loop.time() - REPORT_INTERVAL)
+            await asyncio.sleep(max(0.0, next_report - loop.time()))
+            report_started = loop.time()
+            reports += 1
+
+            seen = detector.report()
+            if seen:
+                ultrasonic_distances = get_ultrasonic_distances(reader)
+                payloads = [stamp({
+                    "serial_number": laptop_serial,
+                    "ibeacon_rssi": rssi,
+                    "ultrasonic_distances": ultrasonic_distances,
+                    "ultrasonic_intrusion_detected": is_moved
+                }) for mac_address, laptop_serial, rssi, is_moved in seen]
+                if BATCH_MODE:
+                    send_sensor_data_batch(payloads)
+                else:
+                    for payload in payloads:
+                        send_sensor_data(payload)
+            metrics.tick(loop.time() - report_started)
+
+            if reports % STATS_EVERY_TICKS == 0:
+                print_stats(reader)
+    finally:
+        expiry_task.cancel()
+
+async def scan_and_send_data():
+    global alarm_task, capture, scanner, IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP, stolen_laptops_status
+    log.info("Starting iBeacon scanner (%s detection)...", DETECTION_MODE)
 
+    loop = asyncio.get_running_loop()
+    if CAPTURE_PATH:
+        capture = TraceWriter(CAPTURE_PATH)
+        record("config", ibeacon_map=IBEACON_TO_LAPTOP_MAP, ultrasonic_map=ULTRASONIC_SENSOR_TO_LAPTOP_MAP)
+    found_devices = {}
+    detector = None
+    presence = None
+    wakeup = asyncio.Event()
+    if PRESENCE_FILTER:
+        presence = PresenceTracker(
+            IBEACON_TO_LAPTOP_MAP,
+            slot_seconds=PRESENCE_SLOT_SECONDS if DETECTION_MODE == "event" else TICK_INTERVAL,
+            window=PRESENCE_WINDOW_SLOTS, absent_slots=PRESENCE_ABSENT_SLOTS,
+            present_slots=PRESENCE_PRESENT_SLOTS, alpha=RSSI_SMOOTHING, min_rssi=PRESENCE_MIN_RSSI,
+        )
+        presence.start(loop.time())
+    if DETECTION_MODE == "event":
+        detector = EventDetector(IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP, MIN_DISTANCE_CM,
+                                 BEACON_TIMEOUT, on_status=update_stolen_status, on_alarm=set_alarm,
+                                 presence=presence)
+        detector.start(loop.time())
+
+    def detection_callback(address, rssi):
+        metrics.advertisements += 1
+        if address in IBEACON_TO_LAPTOP_MAP:
+            record("advertisement", mac=address, rssi=rssi)
+            if detector is not None:
+                if address in detector.missing:
+                    wakeup.set()  # its deadline goes back on the heap
+                detector.on_advertisement(address, rssi, loop.time())
+                return
+            found_devices[address] = {
+                "rssi": rssi
+            }
+            log.debug("Found target iBeacon (%s) with RSSI: %s", address, rssi)
+
+    def handle_frame(frame):
+        detector.on_frame(list(frame.distances), loop.time())
+
+    def apply_config(version, ibeacon_map, ultrasonic_map):
+        """Applies a configuration from the server in place, keeping the scanner and beacon state running."""
+        added, removed, changed = diff_maps(IBEACON_TO_LAPTOP_MAP, ibeacon_map)
+        sensors_changed = diff_maps(ULTRASONIC_SENSOR_TO_LAPTOP_MAP, ultrasonic_map)[2]
+        if not (added or removed or changed or sensors_changed):
+            return
+        log.info("Configuration version %s: %d beacons added, %d removed, %d changed.", version, len(added),
+                 len(removed), len(changed) + len(sensors_changed))
+        for serial in ULTRASONIC_SENSOR_TO_LAPTOP_MAP.keys() - ultrasonic_map.keys():
+            stolen_laptops_status.pop(serial, None)
+            pending_status_updates.pop(serial, None)
+        for serial in ultrasonic_map:
+            stolen_laptops_status.setdefault(serial, False)
+        for mac in removed:
+            found_devices.pop(mac, None)
+        # Updated in place: detection_callback and the tick loop read these on every event
+        IBEACON_TO_LAPTOP_MAP.clear()
+        IBEACON_TO_LAPTOP_MAP.update(ibeacon_map)
+        ULTRASONIC_SENSOR_TO_LAPTOP_MAP.clear()
+        ULTRASONIC_SENSOR_TO_LAPTOP_MAP.update(ultrasonic_map)
+        if detector is not None:
+            detector.set_laptops(ibeacon_map, ultrasonic_map, loop.time())
+            wakeup.set()  # new beacons may have the earliest deadline
+        elif presence is not None:
+            presence.set_beacons(ibeacon_map)
+        record("config", ibeacon_map=ibeacon_map, ultrasonic_map=ultrasonic_map)
+
+    # Control socket commands; they run on the socket's thread
+    main_task = asyncio.current_task()
+
+    def control_status(request):
+        http = api.stats()
+        return dict(
+            metrics.as_dict(), pid=os.getpid(), hardware=HARDWARE, detection=DETECTION_MODE, station=STATION_NAME,
+            config_version=config_sync.version, laptops=len(IBEACON_TO_LAPTOP_MAP),
+            scan_mode=getattr(scanner, "mode", None), alarm=alarm_task is not None,
+            stolen=sum(list(stolen_laptops_status.values())),
+            http_queued=http["queued"], http_dropped=http["dropped"], spooled=len(spool),
+        )
+
+    def control_stop(request):
+        loop.call_soon_threadsafe(main_task.cancel)
+        return {"stopping": True}
+
+    def control_reload(request):
+        if HARDWARE == "sim":
+            return {"error": "simulated laptops have no configuration to reload"}
+        try:
+            config = config_sync.fetch()
+        except (requests.exceptions.RequestException, KeyError) as e:
+            log.error("Reloading the configuration failed: %s", e)
+            metrics.error("config", e)
+            return {"error": f"could not fetch the configuration: {e}"}
+        if config is not None:
+            loop.call_soon_threadsafe(apply_config, *config)
+        return {"version": config_sync.version, "changed": config is not None}
+
+    control = ControlServer(CONTROL_SOCKET, {"status": control_status, "stop": control_stop,
+                                             "reload": control_reload})
+    try:
+        control.start()
+    except RuntimeError as e:
+        log.error("%s. Exiting.", e)
+        return
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+    heartbeat_task = asyncio.create_task(heartbeat(metrics))
+
+    api.start(loop)
+    drainer.start()
+    if HARDWARE != "sim":
+        config_sync.on_change = lambda *config: loop.call_soon_threadsafe(apply_config, *config)
+        config_sync.start()
+
+    def on_frame(frame):
+        # Runs on the serial reader thread
+        metrics.frames += 1
+        record("frame", distances=list(frame.distances))
+        if detector is not None:
+            loop.call_soon_threadsafe(handle_frame, frame)
+    if HARDWARE == "sim":
+        scanner = SimulatedBeaconSource(detection_callback, IBEACON_TO_LAPTOP_MAP, interval=SIM_ADVERTISING_INTERVAL,
+                                        dropout=SIM_DROPOUT, departure_rate=SIM_DEPARTURES_PER_HOUR,
+                                        absence_seconds=SIM_ABSENCE_SECONDS)
+        reader = SimulatedDistanceSource(lift_rate=SIM_LIFTS_PER_HOUR, lifted_cm=MIN_DISTANCE_CM * 4,
+                                         capacity=SERIAL_BUFFER_FRAMES, on_frame=on_frame)
+    else:
+        if is_listening(BLE_DAEMON_SOCKET):
+            log.info("Reading advertisements from the BLE daemon at %s.", BLE_DAEMON_SOCKET)
+            scanner = DaemonBeaconSource(detection_callback, BLE_DAEMON_SOCKET)
+        else:
+            scanner = BleakBeaconSource(detection_callback)
+        reader = SerialFrameReader(SERIAL_PORT, SERIAL_BAUDRATE, capacity=SERIAL_BUFFER_FRAMES, on_frame=on_frame,
+                                   on_error=lambda e: metrics.error("serial", e))
+
+    try:
+        await scanner.start()
+        reader.start()
+        if detector is not None:
+            await run_event_detection(loop, reader, detector, wakeup)
+        else:
+            await run_tick_detection(loop, reader, found_devices, presence)
     except asyncio.CancelledError:
-        print("Scanner stopped.")
+        log.info("Scanner stopped.")
     finally:
+        heartbeat_task.cancel()
         if alarm_task:
             alarm_task.cancel()
             try:
                 await alarm_task
             except asyncio.CancelledError:
                 pass
+        config_sync.stop()
         await scanner.stop()
-        ser.close()
-        GPIO.cleanup()
+        reader.stop()
+        api.stop()
+        drainer.stop()
+        print_http_stats()
+        spool.close()
+        buzzer.close()
+        if capture is not None:
+            capture.close()
+        control.stop()
 
 if __name__ == "__main__":
-    IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP = fetch_config_from_db()
+    log_listener = setup_logging(LOG_PATH, level=LOG_LEVEL, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                                 when=LOG_ROTATE_WHEN, rate=LOG_RATE_PER_SECOND, burst=LOG_RATE_BURST,
+                                 rate_limits=LOG_RATE_LIMITS)
+    if HARDWARE == "sim":
+        IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP = simulated_laptops(SIM_LAPTOPS)
+    else:
+        IBEACON_TO_LAPTOP_MAP, ULTRASONIC_SENSOR_TO_LAPTOP_MAP = fetch_config()
     stolen_laptops_status = {serial: False for serial in IBEACON_TO_LAPTOP_MAP.values()}
+    if not IBEACON_TO_LAPTOP_MAP:
+        log.warning("No laptops loaded yet; waiting for the server to send the configuration.")
 
     try:
-        if IBEACON_TO_LAPTOP_MAP and ULTRASONIC_SENSOR_TO_LAPTOP_MAP:
-            asyncio.run(scan_and_send_data())
-        else:
-            print("No laptops found in the database. Exiting.")
+        asyncio.run(scan_and_send_data())
     except KeyboardInterrupt:
-        print("Script terminated by user.")
+        log.info("Script terminated by user.")
     except Exception as e:
-        print(f"An error occurred: {e}")
-        GPIO.cleanup()
\ No newline at end of file
+        log.exception("An error occurred: %s", e)
+        buzzer.close()
+    finally:
+        remove_pid_file(PID_PATH, os.getpid())
+        log_listener.stop()
\ No newline at end of file
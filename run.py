@@ -6,4 +6,7 @@ def make_shell_context():
     return {'db': db, 'User': User, 'Laptop': Laptop}
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
+    # One process serving requests on threads: the dashboard's live feed is
+    # kept in memory, so its streams must be served by the process that
+    # stored the Pi's readings
+    app.run(host='0.0.0.0', debug=True, threaded=True, processes=1)
\ No newline at end of file
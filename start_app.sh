@@ -1,4 +1,5 @@
 #!/bin/bash
 cd /home/justine/laptop-security-application
 source venv/bin/activate
-python run.py
+# Only one copy of the app may serve at a time (see "Run the application" in README.md)
+exec flock --nonblock --conflict-exit-code 75 /tmp/laptop-security-app.lock python run.py
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+DB_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'test.db')}"
+
+from flask_migrate import upgrade  # noqa: E402
+
+from app import app, db  # noqa: E402
+from app.models import Laptop, LaptopState, User  # noqa: E402
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    """A migrated SQLite database holding one user who owns laptop S1."""
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        user = User(username='owner', email='owner@example.com')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.add(Laptop(name='L1', serial_number='S1', owner=user, ibeacon_uuid='u', ibeacon_major=1,
+                              ibeacon_minor=2, ibeacon_mac_address='AA:BB:CC:DD:EE:FF', ultrasonic_sensor_index=0,
+                              state=LaptopState(is_stolen=False)))
+        db.session.commit()
+    yield
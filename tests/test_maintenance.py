@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db
+from app.maintenance import maintain_readings, raw_purge_cutoff
+from app.models import Laptop, RollupBacklog, SensorReading, SensorReadingRollup
+
+RAW_RETENTION = timedelta(days=7)
+MINUTE_RETENTION = timedelta(days=90)
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        for model in (SensorReading, SensorReadingRollup, RollupBacklog):
+            model.query.delete()
+        db.session.commit()
+    return app.test_client()
+
+
+def replay(client, seq, captured_at):
+    response = client.post('/api/sensor_data/batch', json={'source_id': 'pi-1', 'replayed': True, 'readings': [{
+        'serial_number': 'S1', 'ibeacon_rssi': -60, 'ultrasonic_distances': [10, 20, 30, 40],
+        'seq': seq, 'captured_at': captured_at.isoformat(),
+    }]})
+    assert response.status_code == 200
+
+
+def minute_rollup(bucket_start):
+    return SensorReadingRollup.query.filter_by(resolution='minute', bucket_start=bucket_start).first()
+
+
+def test_readings_replayed_after_the_lookback_are_rolled_up(client):
+    now = datetime.utcnow().replace(second=30, microsecond=0)
+    replay(client, 1, now - timedelta(minutes=5))
+    with app.app_context():
+        maintain_readings(RAW_RETENTION, MINUTE_RETENTION, now=now)
+
+    late = now - timedelta(hours=3)
+    replay(client, 2, late)
+    with app.app_context():
+        assert RollupBacklog.pending('minute').since == late
+        # Not purged before the next pass has rolled it up
+        assert raw_purge_cutoff(now) <= late
+
+        maintain_readings(RAW_RETENTION, MINUTE_RETENTION, now=now)
+        rollup = minute_rollup(late.replace(second=0))
+        assert rollup is not None and rollup.sample_count == 1
+        hour = SensorReadingRollup.query.filter_by(resolution='hour',
+                                                   bucket_start=late.replace(minute=0, second=0)).first()
+        assert hour is not None and hour.sample_count == 1
+        assert RollupBacklog.pending('minute') is None
+        assert RollupBacklog.pending('hour') is None
+
+
+def test_rollups_are_not_rebuilt_from_purged_readings(client):
+    now = datetime.utcnow().replace(second=30, microsecond=0)
+    expired = now - RAW_RETENTION - timedelta(days=1)
+    replay(client, 1, now - timedelta(minutes=5))
+    with app.app_context():
+        maintain_readings(RAW_RETENTION, MINUTE_RETENTION, now=now)
+        # Rolled up from readings purged long ago
+        laptop_id = Laptop.query.filter_by(serial_number='S1').one().id
+        db.session.add(SensorReadingRollup(laptop_id=laptop_id, resolution='minute',
+                                           bucket_start=expired.replace(second=0), sample_count=40,
+                                           intrusion_count=0))
+        db.session.commit()
+
+    replay(client, 2, expired)
+    with app.app_context():
+        maintain_readings(RAW_RETENTION, MINUTE_RETENTION, now=now)
+        assert minute_rollup(expired.replace(second=0)).sample_count == 40
+        assert RollupBacklog.pending('minute') is None
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db
+from app.models import SensorReading
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        SensorReading.query.delete()
+        db.session.commit()
+    return app.test_client()
+
+
+def reading(seq, captured_at):
+    return {'serial_number': 'S1', 'ibeacon_rssi': -60, 'ultrasonic_distances': [10, 20, 30, 40],
+            'seq': seq, 'captured_at': captured_at.isoformat()}
+
+
+def stored_timestamps():
+    with app.app_context():
+        return [timestamp for (timestamp,) in db.session.query(SensorReading.timestamp)]
+
+
+def test_live_reading_from_a_pi_clock_ahead_is_stored_at_server_time(client):
+    ahead = datetime.utcnow() + timedelta(hours=2)
+    response = client.post('/api/sensor_data', json=dict(reading(1, ahead), source_id='pi-1'))
+    assert response.status_code == 200
+
+    response = client.post('/api/sensor_data/batch', json={'source_id': 'pi-1', 'readings': [reading(2, ahead)]})
+    assert response.status_code == 200
+    assert response.json['accepted'] == 1
+
+    timestamps = stored_timestamps()
+    assert len(timestamps) == 2
+    assert all(timestamp <= datetime.utcnow() for timestamp in timestamps)
+
+
+def test_replay_of_a_reading_stored_from_a_pi_clock_ahead_is_skipped(client):
+    ahead = datetime.utcnow() + timedelta(hours=2)
+    client.post('/api/sensor_data/batch', json={'source_id': 'pi-1', 'readings': [reading(1, ahead)]})
+
+    # The response was lost, so the Pi spooled the reading and replays it later
+    response = client.post('/api/sensor_data/batch', json={
+        'source_id': 'pi-1', 'replayed': True, 'readings': [reading(1, ahead), reading(2, ahead)],
+    })
+    assert response.status_code == 200
+    assert response.json['accepted'] == 2
+    assert len(stored_timestamps()) == 2
+
+
+def test_replay_keeps_the_capture_time_of_an_old_reading(client):
+    captured_at = datetime.utcnow().replace(microsecond=0) - timedelta(hours=3)
+    response = client.post('/api/sensor_data/batch', json={
+        'source_id': 'pi-1', 'replayed': True, 'readings': [reading(1, captured_at)],
+    })
+    assert response.status_code == 200
+    assert stored_timestamps() == [captured_at]